@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer, melt_snowflake
+from utils.codec import open_file
 from utils.plot_conf import ColorPalette, hide_spines
 
 
@@ -26,7 +27,7 @@ def main():
     sample_cascade_influence = {}
     sample_cascade_influence_10m = defaultdict(int)
     sample_cascade_influence_1h = defaultdict(int)
-    with open('../data/{0}_out/sample_retweet_{0}.txt'.format(app_name), 'r') as fin:
+    with open_file('../data/{0}_out/sample_retweet_{0}.txt'.format(app_name), 'r') as fin:
         for line in fin:
             root_tweet, cascades = line.rstrip().split(':')
             cascades = cascades.split(',')
@@ -55,7 +56,7 @@ def main():
     complete_cascade_influence = {}
     complete_cascade_influence_10m = defaultdict(int)
     complete_cascade_influence_1h = defaultdict(int)
-    with open('../data/{0}_out/complete_retweet_{0}.txt'.format(app_name), 'r') as fin:
+    with open_file('../data/{0}_out/complete_retweet_{0}.txt'.format(app_name), 'r') as fin:
         for line in fin:
             root_tweet, cascades = line.rstrip().split(':')
             cascades = cascades.split(',')
@@ -4,7 +4,7 @@
 """ Validate rate limit message by selecting unsampled segments, i.e., no ratemsg in complete dataset.
 
 Usage: python plot_fig1_missing_in_segment.py
-Input data files: ./[app_name]_out/ts_[app_name]_all.txt, ./[app_name]_out/complete_ts_[app_name].txt
+Input data files: ./[app_name]_out/ts_[app_name]_all.txt, ./[app_name]_out/complete_ts_[app_name].txt, flat or time partitioned
 Time: ~8M
 """
 
@@ -21,6 +21,7 @@ from matplotlib.ticker import FuncFormatter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer, count_track, melt_snowflake
+from utils.partition import open_partitioned
 from utils.metrics import mean_absolute_percentage_error as mape
 from utils.vars import ColorPalette
 
@@ -60,7 +61,7 @@ def main():
         # segments that silence 10s around rate limit messages and 180s proceeding disconnect messages in complete set
         init_segment_list = []
         init_start_ts = 0
-        with open(complete_input_path, 'r') as fin:
+        with open_partitioned(complete_input_path) as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 # if it is a disconnect msg
@@ -93,7 +94,7 @@ def main():
         look_for_end = False
         found_showcase = False
 
-        with open(sample_input_path, 'r') as fin:
+        with open_partitioned(sample_input_path) as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 if 'ratemsg' in split_line[1]:
@@ -148,7 +149,7 @@ def main():
         for input_path, tid_list in zip([sample_input_path, complete_input_path], [showcase_retrieved_tid_list, showcase_complete_tid_list]):
             current_segment_idx = 0
             current_segment_cnt = 0
-            with open(input_path, 'r') as fin:
+            with open_partitioned(input_path) as fin:
                 for line in fin:
                     split_line = line.rstrip().split(',')
                     if len(split_line) == 2:
@@ -4,12 +4,13 @@
 """ Plot the hourly/millisecondly sampling rates.
 
 Usage: python plot_fig2_temporal_sampling_rates.py
-Input data files: ./[app_name]_out/complete_ts_[app_name].txt, ./[app_name]_out/ts_[app_name]_all.txt
+Input data files: ./[app_name]_out/complete_ts_[app_name].txt, ./[app_name]_out/ts_[app_name]_all.txt, flat or time partitioned
 Time: ~12M
 """
 
 import sys, os, platform
 from datetime import datetime, timezone
+from functools import partial
 import numpy as np
 
 import matplotlib as mpl
@@ -20,10 +21,64 @@ import matplotlib.pyplot as plt
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.partition import map_partitions, read_lines
 from utils.metrics import mean_confidence_interval
 from utils.plot_conf import ColorPalette, hide_spines
 
 
+def count_shapes(num_days):
+    """Shapes of the matrices counted by count_sampled_tweets(), in the order of its results."""
+    hours_in_day = 24
+    return [(hours_in_day, num_days), (hours_in_day, num_days),
+            (1000, num_days * hours_in_day), (1000, num_days * hours_in_day),
+            (hours_in_day, 60, 60, 100), (hours_in_day, 60, 60, 100)]
+
+
+def count_sampled_tweets(sample_path, complete_path, min_timestamp, min_day, num_days):
+    """Count tweets in the complete set that are hit or missed by the sample set, by hour, millisecond,
+    and millisecond bin in a day. Paths are aligned partitions of the ts files, or the flat ts files.
+    Counts are returned sparse, as (flat indices, counts) of the nonzero cells of each matrix, since a partition
+    only fills a few cells of them, and results are sent back from the pool of processes, see count_shapes()."""
+    hours_in_day = 24
+    ms_in_second = 1000
+    ms_bins = 100
+    width = ms_in_second // ms_bins
+
+    sample_tid_set = set()
+
+    count_mats = [np.zeros(shape=shape) for shape in count_shapes(num_days)]
+    hour_hit_mat, hour_miss_mat, ms_hit_mat, ms_miss_mat, confusion_hit_mat, confusion_miss_mat = count_mats
+
+    for line in read_lines(sample_path):
+        split_line = line.rstrip().split(',')
+        if len(split_line) == 2:
+            sample_tid_set.add(split_line[1])
+
+    for line in read_lines(complete_path):
+        split_line = line.rstrip().split(',')
+        if len(split_line) == 2:
+            timestamp_ms = int(split_line[0][:-3])
+            if timestamp_ms >= min_timestamp:
+                dt_obj = datetime.utcfromtimestamp(timestamp_ms)
+                day_idx = dt_obj.day - min_day
+                hour = dt_obj.hour
+                minute = dt_obj.minute
+                second = dt_obj.second
+                millisec = int(split_line[0][-3:])
+                ms_idx = (millisec - 7) // width if millisec >= 7 else (ms_in_second + millisec - 7) // width
+
+                if split_line[1] in sample_tid_set:
+                    hour_hit_mat[hour][day_idx] += 1
+                    ms_hit_mat[millisec][hours_in_day * day_idx + hour] += 1
+                    confusion_hit_mat[hour][minute][second][ms_idx] += 1
+                else:
+                    hour_miss_mat[hour][day_idx] += 1
+                    ms_miss_mat[millisec][hours_in_day * day_idx + hour] += 1
+                    confusion_miss_mat[hour][minute][second][ms_idx] += 1
+
+    return [(np.flatnonzero(mat), mat[mat != 0]) for mat in count_mats]
+
+
 def main():
     timer = Timer()
     timer.start()
@@ -35,13 +90,12 @@ def main():
     fig, axes = plt.subplots(1, 2, figsize=(10, 3.3))
 
     num_days = 14
+    proc_num = 7
     hours_in_day = 24
     hour_x_axis = range(hours_in_day)
     minutes_in_hour = 60
     seconds_in_minute = 60
     ms_in_second = 1000
-    ms_bins = 100
-    width = ms_in_second // ms_bins
     ms_x_axis = range(ms_in_second)
 
     app_conf = {'cyberbullying': {'min_date': '2019-10-13',
@@ -58,46 +112,19 @@ def main():
         min_date = datetime.strptime(app_conf[app_name]['min_date'], '%Y-%m-%d').replace(tzinfo=timezone.utc)
         min_timestamp = int(min_date.timestamp())
         min_day = min_date.day
-        sample_datefile = open(os.path.join(archive_dir, 'ts_{0}_all.txt'.format(app_name)), 'r')
-        complete_datefile = open(os.path.join(archive_dir, 'complete_ts_{0}.txt'.format(app_name)), 'r')
-
-        sample_tid_set = set()
-
-        hour_hit_mat = np.zeros(shape=(hours_in_day, num_days))
-        hour_miss_mat = np.zeros(shape=(hours_in_day, num_days))
-
-        ms_hit_mat = np.zeros(shape=(ms_in_second, num_days * hours_in_day))
-        ms_miss_mat = np.zeros(shape=(ms_in_second, num_days * hours_in_day))
-
-        confusion_hit_mat = np.zeros(shape=(hours_in_day, minutes_in_hour, seconds_in_minute, ms_bins))
-        confusion_miss_mat = np.zeros(shape=(hours_in_day, minutes_in_hour, seconds_in_minute, ms_bins))
-
-        for line in sample_datefile:
-            split_line = line.rstrip().split(',')
-            if len(split_line) == 2:
-                sample_tid_set.add(split_line[1])
-
-        for line in complete_datefile:
-            split_line = line.rstrip().split(',')
-            if len(split_line) == 2:
-                timestamp_ms = int(split_line[0][:-3])
-                if timestamp_ms >= min_timestamp:
-                    dt_obj = datetime.utcfromtimestamp(timestamp_ms)
-                    day_idx = dt_obj.day - min_day
-                    hour = dt_obj.hour
-                    minute = dt_obj.minute
-                    second = dt_obj.second
-                    millisec = int(split_line[0][-3:])
-                    ms_idx = (millisec - 7) // width if millisec >= 7 else (ms_in_second + millisec - 7) // width
-
-                    if split_line[1] in sample_tid_set:
-                        hour_hit_mat[hour][day_idx] += 1
-                        ms_hit_mat[millisec][hours_in_day * day_idx + hour] += 1
-                        confusion_hit_mat[hour][minute][second][ms_idx] += 1
-                    else:
-                        hour_miss_mat[hour][day_idx] += 1
-                        ms_miss_mat[millisec][hours_in_day * day_idx + hour] += 1
-                        confusion_miss_mat[hour][minute][second][ms_idx] += 1
+
+        # ts files may be in the time partitioned layout, partitions before min_date or after num_days are skipped,
+        # and partitions of the sample and complete sets are counted in parallel, see utils/partition.py
+        count_mats = [np.zeros(shape=shape) for shape in count_shapes(num_days)]
+        for partition_counts in map_partitions(partial(count_sampled_tweets, min_timestamp=min_timestamp, min_day=min_day, num_days=num_days),
+                                               [os.path.join(archive_dir, 'ts_{0}_all.txt'.format(app_name)),
+                                                os.path.join(archive_dir, 'complete_ts_{0}.txt'.format(app_name))],
+                                               start_ms=min_timestamp * 1000,
+                                               end_ms=(min_timestamp + num_days * hours_in_day * minutes_in_hour * seconds_in_minute) * ms_in_second,
+                                               proc_num=proc_num):
+            for mat, (flat_idx, counts) in zip(count_mats, partition_counts):
+                mat.flat[flat_idx] += counts
+        hour_hit_mat, hour_miss_mat, ms_hit_mat, ms_miss_mat, confusion_hit_mat, confusion_miss_mat = count_mats
 
         # hourly tweet sampling rate
         rho_mean_list_hour = []
@@ -4,12 +4,13 @@
 """ Plot the number of tweets on different languages.
 
 Usage: python plot_fig3_lang_volume.py
-Input data files: ./youtube_out/ts_youtube_*.txt
+Input data files: ./youtube_out/ts_youtube_*.txt, flat or time partitioned
 Time: ~5M
 """
 
 import sys, os, platform
 from datetime import datetime
+from functools import partial
 import numpy as np
 
 import matplotlib as mpl
@@ -21,10 +22,51 @@ from matplotlib.ticker import FuncFormatter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.partition import map_partitions, read_lines
 from utils.metrics import mean_confidence_interval
 from utils.plot_conf import ColorPalette, hide_spines, concise_fmt
 
 
+def count_lang_volume(sample_ts_datefile, *subcrawler_ts_datefiles, num_days=14):
+    """Count tweets of sub-crawlers by hour and day, and how many of them are in the sample set.
+    Paths are aligned partitions of the ts files, or the flat ts files."""
+    hours_in_day = 24
+
+    sample_tid_set = set()
+    for line in read_lines(sample_ts_datefile):
+        split_line = line.rstrip().split(',')
+        if len(split_line) == 2:
+            ts, tid = split_line
+            sample_tid_set.add(tid)
+
+    num_in = 0
+    num_out = 0
+
+    count_sample = np.zeros(shape=(hours_in_day, num_days))
+    count_complete = np.zeros(shape=(hours_in_day, num_days))
+
+    visited_tid_set = set()
+
+    for ts_datefile in subcrawler_ts_datefiles:
+        for line in read_lines(ts_datefile):
+            split_line = line.rstrip().split(',')
+            if len(split_line) == 2:
+                ts, tid = split_line
+                if tid not in visited_tid_set:
+                    dt_obj = datetime.utcfromtimestamp(int(ts[:-3]))
+                    day_idx = dt_obj.day - 6
+                    hour = dt_obj.hour
+                    count_complete[hour][day_idx] += 1
+                    if tid in sample_tid_set:
+                        num_in += 1
+                        count_sample[hour][day_idx] += 1
+                    else:
+                        num_out += 1
+                    visited_tid_set.add(tid)
+
+    return num_in, num_out, count_sample, count_complete
+
+
 def main():
     timer = Timer()
     timer.start()
@@ -38,17 +80,11 @@ def main():
 
     num_days = 14
     hours_in_day = 24
+    proc_num = 7
 
     fig, axes = plt.subplots(1, 2, figsize=(10, 3.3))
 
-    sample_tid_set = set()
     sample_ts_datefile = os.path.join(archive_dir, 'ts_{0}_all.txt'.format(app_name))
-    with open(sample_ts_datefile, 'r') as fin:
-        for line in fin:
-            split_line = line.rstrip().split(',')
-            if len(split_line) == 2:
-                ts, tid = split_line
-                sample_tid_set.add(tid)
 
     for idx, lang in enumerate(lang_list):
         if idx == 0:
@@ -56,31 +92,19 @@ def main():
         else:
             subcrawler_ts_datefiles = [os.path.join(archive_dir, 'ts_{0}_{1}.txt'.format(app_name, j)) for j in [1, 4, 5, 6, 7, 10, 11, 12]]
 
+        # ts files may be in the time partitioned layout, partitions are counted in parallel, see utils/partition.py
         num_in = 0
         num_out = 0
 
         count_sample = np.zeros(shape=(hours_in_day, num_days))
         count_complete = np.zeros(shape=(hours_in_day, num_days))
 
-        visited_tid_set = set()
-
-        for ts_datefile in subcrawler_ts_datefiles:
-            with open(ts_datefile, 'r') as fin:
-                for line in fin:
-                    split_line = line.rstrip().split(',')
-                    if len(split_line) == 2:
-                        ts, tid = split_line
-                        if tid not in visited_tid_set:
-                            dt_obj = datetime.utcfromtimestamp(int(ts[:-3]))
-                            day_idx = dt_obj.day - 6
-                            hour = dt_obj.hour
-                            count_complete[hour][day_idx] += 1
-                            if tid in sample_tid_set:
-                                num_in += 1
-                                count_sample[hour][day_idx] += 1
-                            else:
-                                num_out += 1
-                            visited_tid_set.add(tid)
+        for partition_counts in map_partitions(partial(count_lang_volume, num_days=num_days),
+                                               [sample_ts_datefile] + subcrawler_ts_datefiles, proc_num=proc_num):
+            num_in += partition_counts[0]
+            num_out += partition_counts[1]
+            count_sample += partition_counts[2]
+            count_complete += partition_counts[3]
 
         print('collected tweets: {0}, missing tweets: {1}, sample ratio for lang {2}: {3:.2f}%'
               .format(num_in, num_out, lang, num_in / (num_in + num_out) * 100))
@@ -23,6 +23,7 @@ from powerlaw import Fit, plot_ccdf
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import open_file
 from utils.vars import ColorPalette
 from utils.plot_conf import hide_spines
 
@@ -77,8 +78,8 @@ def main():
     blue = cc4[0]
 
     for ax_idx, entity in enumerate(entities):
-        sample_datefile = open(os.path.join(archive_dir, '{0}_{1}_all.txt'.format(entity, app_name)), 'r', encoding='utf-8')
-        complete_datefile = open(os.path.join(archive_dir, 'complete_{0}_{1}.txt'.format(entity, app_name)), 'r', encoding='utf-8')
+        sample_datefile = open_file(os.path.join(archive_dir, '{0}_{1}_all.txt'.format(entity, app_name)), 'r', encoding='utf-8')
+        complete_datefile = open_file(os.path.join(archive_dir, 'complete_{0}_{1}.txt'.format(entity, app_name)), 'r', encoding='utf-8')
 
         sample_entity_freq_dict = defaultdict(int)
         complete_entity_freq_dict = defaultdict(int)
@@ -23,6 +23,7 @@ from matplotlib.ticker import FuncFormatter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import open_file
 from utils.plot_conf import ColorPalette, hide_spines
 
 
@@ -46,12 +47,12 @@ def main():
 
     print('for entity: {0}'.format(entity))
     sample_entity_freq_dict = defaultdict(int)
-    with open('../data/{1}_out/{0}_{1}_all.txt'.format(entity, app_name), 'r') as sample_datefile:
+    with open_file('../data/{1}_out/{0}_{1}_all.txt'.format(entity, app_name), 'r') as sample_datefile:
         for line in sample_datefile:
             sample_entity_freq_dict[line.rstrip().split(',')[1]] += 1
 
     complete_entity_freq_dict = defaultdict(int)
-    with open('../data/{1}_out/complete_{0}_{1}.txt'.format(entity, app_name), 'r') as complete_datefile:
+    with open_file('../data/{1}_out/complete_{0}_{1}.txt'.format(entity, app_name), 'r') as complete_datefile:
         for line in complete_datefile:
             complete_entity_freq_dict[line.rstrip().split(',')[1]] += 1
 
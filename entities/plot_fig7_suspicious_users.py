@@ -5,6 +5,7 @@
 
 Usage: python plot_fig4_top_entities.py
 Input data files: ../data/[app_name]_out/complete_user_[app_name].txt, ../data/[app_name]_out/user_[app_name]_all.txt
+                  ../data/[app_name]_out/user_profile_[app_name]/, for screen names of case users if it exists
 Time: ~8M
 """
 
@@ -23,6 +24,8 @@ from matplotlib.ticker import FuncFormatter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer, melt_snowflake
+from utils.codec import open_file
+from utils.profile_store import UserProfileStore, USER_PROFILE_INDEX
 from utils.plot_conf import ColorPalette, hide_spines
 
 cm = plt.cm.get_cmap('RdBu')
@@ -69,7 +72,7 @@ def main():
     load_external_data = False
     if not load_external_data:
         sample_entity_stats = defaultdict(int)
-        with open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 sample_entity_stats[split_line[1]] += 1
@@ -85,7 +88,7 @@ def main():
         complete_post_lists_10ms = [[0] * num_bins for _ in range(num_top)]
 
         complete_entity_stats = defaultdict(int)
-        with open('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 user_id = split_line[1]
@@ -130,7 +133,7 @@ def main():
         minutey_conversion = np.mean(confusion_sampling_rate, axis=(2, 3))
         secondly_conversion = np.mean(confusion_sampling_rate, axis=(3))
 
-        with open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 user_id = split_line[1]
@@ -232,6 +235,13 @@ def main():
     # == == == == == == Part 3: Plot case users == == == == == == #
     case_user_ids = ['1033778124968865793', '1182605743335211009']
     case_user_screennames = ['WeltRadio', 'bensonbersk']
+    profile_store_dir = '../data/{0}_out/user_profile_{0}'.format(app_name)
+    if os.path.exists(profile_store_dir):
+        # screen names of the case users as crawled, see merge_user_profiles.py
+        with UserProfileStore(profile_store_dir) as profile_store:
+            profiles = profile_store.get_many([int(user_id) for user_id in case_user_ids])
+        case_user_screennames = [screenname if profile is None else profile[USER_PROFILE_INDEX['screen_name']]
+                                 for screenname, profile in zip(case_user_screennames, profiles)]
 
     fig, axes = plt.subplots(1, 2, figsize=(7.2, 2.3))
 
@@ -22,6 +22,7 @@ import matplotlib.pyplot as plt
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer, melt_snowflake
+from utils.codec import open_file
 from utils.metrics import mean_absolute_percentage_error as mape
 
 cm = plt.cm.get_cmap('RdBu')
@@ -71,7 +72,7 @@ def main():
     load_external_data = True
     if not load_external_data:
         sample_entity_stats = defaultdict(int)
-        with open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 sample_entity_stats[split_line[1]] += 1
@@ -87,7 +88,7 @@ def main():
         complete_post_lists_10ms = [[0] * num_bins for _ in range(num_top)]
 
         complete_entity_stats = defaultdict(int)
-        with open('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 user_id = split_line[1]
@@ -132,7 +133,7 @@ def main():
         minutey_conversion = np.mean(confusion_sampling_rate, axis=(2, 3))
         secondly_conversion = np.mean(confusion_sampling_rate, axis=(3))
 
-        with open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
+        with open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r') as fin:
             for line in fin:
                 split_line = line.rstrip().split(',')
                 user_id = split_line[1]
@@ -2,6 +2,7 @@ import sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import open_file
 
 
 def main():
@@ -11,7 +12,7 @@ def main():
     app_name = 'cyberbullying'
 
     complete_user_id_set = set()
-    with open('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
+    with open_file('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r') as fin:
         for line in fin:
             tid, root_uid, _ = line.rstrip().split(',', 2)
             complete_user_id_set.add(root_uid)
@@ -28,7 +29,7 @@ def main():
     timer.stop()
 
     complete_hashtag_id_set = set()
-    with open('../data/{0}_out/complete_hashtag_{0}.txt'.format(app_name), 'r', encoding='utf-8') as fin:
+    with open_file('../data/{0}_out/complete_hashtag_{0}.txt'.format(app_name), 'r', encoding='utf-8') as fin:
         for line in fin:
             tid, *hashtags = line.rstrip().lower().split(',')
             complete_hashtag_id_set.update(hashtags)
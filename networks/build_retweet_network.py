@@ -17,6 +17,7 @@ import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import open_file
 
 
 def main():
@@ -35,9 +36,9 @@ def main():
     for date_type in ['sample', 'complete']:
         if not load_data_from_pickle:
             if date_type == 'sample':
-                user_datefile = open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r')
+                user_datefile = open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r')
             else:
-                user_datefile = open('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r')
+                user_datefile = open_file('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r')
 
             weighted_retweet_network = defaultdict(lambda: defaultdict(int))
             in_links_for_node = defaultdict(set)
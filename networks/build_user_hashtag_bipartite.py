@@ -15,6 +15,7 @@ from collections import defaultdict, Counter
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import open_file
 
 
 def main():
@@ -37,11 +38,11 @@ def main():
 
     for date_type in ['sample', 'complete']:
         if date_type == 'sample':
-            user_datefile = open('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r')
-            hashtag_datefile = open('../data/{0}_out/hashtag_{0}_all.txt'.format(app_name), 'r', encoding='utf-8')
+            user_datefile = open_file('../data/{0}_out/user_{0}_all.txt'.format(app_name), 'r')
+            hashtag_datefile = open_file('../data/{0}_out/hashtag_{0}_all.txt'.format(app_name), 'r', encoding='utf-8')
         else:
-            user_datefile = open('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r')
-            hashtag_datefile = open('../data/{0}_out/complete_hashtag_{0}.txt'.format(app_name), 'r', encoding='utf-8')
+            user_datefile = open_file('../data/{0}_out/complete_user_{0}.txt'.format(app_name), 'r')
+            hashtag_datefile = open_file('../data/{0}_out/complete_hashtag_{0}.txt'.format(app_name), 'r', encoding='utf-8')
 
         tid_set = set()
         tid_uid_dict = {}
@@ -0,0 +1,80 @@
+import sys, os, bz2, random
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.bz2block import find_blocks, decompress_blocks, split_bz2_file, TAIL_BLOCKS
+
+
+def make_bz2_file(path, num_lines=20000, seed=0):
+    """Write random lines into a bz2 file of 100k blocks, so lines cross block boundaries."""
+    rng = random.Random(seed)
+    lines = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(rng.randint(1, 60))).encode()
+             for _ in range(num_lines)]
+    data = b'\n'.join(lines) + b'\n'
+    with open(path, 'wb') as fout:
+        fout.write(bz2.compress(data, compresslevel=1))
+    return data, lines
+
+
+def test_blocks_decompress_to_the_original(tmp_path):
+    path = str(tmp_path / 'input.bz2')
+    data, _ = make_bz2_file(path)
+    with open(path, 'rb') as fin:
+        compressed = fin.read()
+    blocks = find_blocks(compressed)
+    assert len(blocks) > 3
+
+    texts = []
+    idx = 0
+    while idx < len(blocks):
+        text, idx = decompress_blocks(compressed, blocks, idx)
+        texts.append(text)
+    assert b''.join(texts) == data
+
+
+def test_chunks_yield_every_line_once(tmp_path):
+    path = str(tmp_path / 'input.bz2')
+    _, lines = make_bz2_file(path)
+    for chunk_size in (1, 50000, os.path.getsize(path)):
+        chunks = split_bz2_file(path, chunk_size)
+        assert [chunk.index for chunk in chunks] == list(range(len(chunks)))
+        assert all(chunk.num_chunks == len(chunks) for chunk in chunks)
+        assert [line for chunk in chunks for line in chunk] == lines
+
+
+def test_single_block_file(tmp_path):
+    path = str(tmp_path / 'small.bz2')
+    with open(path, 'wb') as fout:
+        fout.write(bz2.compress(b'first\nsecond\nthird'))
+    chunks = split_bz2_file(path, 1)
+    assert len(chunks) == 1
+    assert list(chunks[0]) == [b'first', b'second', b'third']
+
+
+def test_chunks_carry_their_blocks_and_a_tail(tmp_path):
+    path = str(tmp_path / 'input.bz2')
+    make_bz2_file(path)
+    with open(path, 'rb') as fin:
+        blocks = find_blocks(fin.read())
+    chunks = split_bz2_file(path, 1)
+    assert len(chunks) == len(blocks)
+    for idx, chunk in enumerate(chunks):
+        assert chunk.bit_range() == blocks[idx]
+        assert chunk.byte_range() == (blocks[idx][0] // 8, (blocks[idx][1] + 7) // 8)
+        assert len(chunk) == (blocks[idx][1] - blocks[idx][0]) // 8
+        assert chunk.blocks == blocks[idx:idx + 1 + TAIL_BLOCKS]
+        assert chunk.ends_file == (idx + 1 + TAIL_BLOCKS >= len(blocks))
+
+
+def test_line_past_the_tail_fails(tmp_path):
+    path = str(tmp_path / 'long.bz2')
+    rng = random.Random(0)
+    # a line over more blocks than the tail
+    line = bytes(rng.choice(b'abcdefghijklmnopqrstuvwxyz') for _ in range((TAIL_BLOCKS + 3) * 100000))
+    with open(path, 'wb') as fout:
+        fout.write(bz2.compress(line + b'\nlast\n', compresslevel=1))
+    chunks = split_bz2_file(path, 1)
+    assert len(chunks) > TAIL_BLOCKS + 2
+    with pytest.raises(OSError):
+        list(chunks[0])
+    assert list(chunks[-1]) == [b'last']
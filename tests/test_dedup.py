@@ -0,0 +1,74 @@
+import sys, os, random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.dedup import WindowDeduplicator
+
+
+def test_duplicates_within_the_window():
+    deduplicator = WindowDeduplicator(window_ms=1000, margin_ms=1000, bucket_ms=100)
+    assert deduplicator.add('a', 5000)
+    assert deduplicator.add('b', 5500)
+    assert not deduplicator.add('a', 5000)
+    # out of order within the window
+    assert deduplicator.add('c', 4800)
+    assert not deduplicator.add('c', 4800)
+    assert deduplicator.num_late == 0
+    assert len(deduplicator) == 3
+    deduplicator.close()
+
+
+def test_evicted_lines_are_spilled(tmp_path):
+    deduplicator = WindowDeduplicator(window_ms=1000, margin_ms=1000, bucket_ms=100, tmp_dir=str(tmp_path))
+    for timestamp_ms in range(0, 10000, 50):
+        assert deduplicator.add('line{0}'.format(timestamp_ms), timestamp_ms)
+    # only the window and the margin stay in memory
+    assert len(deduplicator) <= 2100 // 50 + 2
+    assert deduplicator.spill is not None
+
+
+def test_late_lines_are_checked_exactly(tmp_path):
+    deduplicator = WindowDeduplicator(window_ms=1000, margin_ms=1000, bucket_ms=100, tmp_dir=str(tmp_path))
+    for timestamp_ms in range(0, 10000, 50):
+        deduplicator.add('line{0}'.format(timestamp_ms), timestamp_ms)
+    # a late duplicate of a spilled line
+    assert not deduplicator.add('line100', 100)
+    # a late line that is new, and then its duplicate
+    assert deduplicator.add('other100', 100)
+    assert not deduplicator.add('other100', 100)
+    # a late line of a bucket that holds no line
+    assert deduplicator.add('line-5000', -5000)
+    assert not deduplicator.add('line-5000', -5000)
+    assert deduplicator.num_late == 5
+    deduplicator.close()
+    assert deduplicator.spill is None
+
+
+def test_stragglers_within_the_margin():
+    deduplicator = WindowDeduplicator(window_ms=1000, margin_ms=1000, bucket_ms=100)
+    deduplicator.add('a', 1000)
+    deduplicator.add('b', 3000)
+    assert not deduplicator.add('a', 1000)
+    assert deduplicator.num_stragglers == 1
+    assert deduplicator.num_late == 0
+
+
+def test_matches_a_set_on_a_shuffled_stream(tmp_path):
+    rng = random.Random(0)
+    items = []
+    for idx in range(5000):
+        timestamp_ms = idx * 10 + rng.randrange(3000)
+        if rng.random() < 0.02:
+            # far out of order, beyond the window and the margin
+            timestamp_ms -= 20000
+        items.append((timestamp_ms, 'tweet{0}'.format(timestamp_ms)))
+    # duplicates come after their originals, some of them late
+    stream = items + [items[rng.randrange(len(items))] for _ in range(2000)]
+    stream = stream[:5000] + sorted(stream[5000:], key=lambda item: item[0] + rng.randrange(-5000, 5000))
+
+    deduplicator = WindowDeduplicator(window_ms=2000, margin_ms=1000, bucket_ms=100, tmp_dir=str(tmp_path))
+    seen = set()
+    for timestamp_ms, item in stream:
+        assert deduplicator.add(item, timestamp_ms) == (item not in seen)
+        seen.add(item)
+    assert deduplicator.num_late > 0
+    deduplicator.close()
@@ -0,0 +1,58 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from wrangling.extract_entities import ENTITY_FIELDS, EntityCollector, load_ratemsg_timestamps, ratemsg_offsets
+from utils.helper import make_snowflake
+
+BASE_MS = 1570000000000
+
+
+def make_entity_record(tweet_ms, user_id, hashtags='N', followers='10'):
+    record = dict.fromkeys(ENTITY_FIELDS, 'N')
+    record.update({'tweet_id_str': str(make_snowflake(tweet_ms, 1, 1, 0)), 'timestamp_ms': str(tweet_ms),
+                   'user_id_str': user_id, 'original_hashtags': hashtags, 'original_user_followers_count': followers})
+    return tuple(record[field] for field in ENTITY_FIELDS)
+
+
+def read_lines(output_dir, entity):
+    with open(os.path.join(output_dir, '{0}_test_1.txt'.format(entity))) as fin:
+        return fin.read().splitlines()
+
+
+def test_duplicate_tweets_keep_the_first_record(tmp_path):
+    collector = EntityCollector('1', 0, 5000, status_fields=ENTITY_FIELDS, memory_budget=7 * 1000, tmp_dir=str(tmp_path))
+    records = [make_entity_record(BASE_MS + idx * 1000, 'u{0}'.format(idx), 'tag{0}'.format(idx)) for idx in range(20)]
+    for record in records:
+        collector.add(record)
+    # the same tweets again, e.g., from overlapping hourly files, with later snapshots of their fields
+    for idx, record in enumerate(records[:10]):
+        duplicate = list(record)
+        duplicate[ENTITY_FIELDS.index('user_id_str')] = 'later{0}'.format(idx)
+        duplicate[ENTITY_FIELDS.index('original_hashtags')] = 'later{0}'.format(idx)
+        duplicate[ENTITY_FIELDS.index('original_user_followers_count')] = '99'
+        collector.add(tuple(duplicate))
+    output_dir = str(tmp_path / 'out')
+    os.makedirs(output_dir)
+    collector.dump(output_dir, 'test_1')
+
+    assert read_lines(output_dir, 'ts') == ['{0},{1}'.format(record[1], record[0]) for record in records]
+    assert read_lines(output_dir, 'user') == ['{0},u{1},N,N,N'.format(record[0], idx) for idx, record in enumerate(records)]
+    assert read_lines(output_dir, 'hashtag') == ['{0},tag{1}'.format(record[0], idx) for idx, record in enumerate(records)]
+    assert read_lines(output_dir, 'follower') == ['{0},10'.format(record[0]) for record in records]
+
+
+def test_ratemsg_offsets_of_a_status_file(tmp_path):
+    input_path = str(tmp_path / 'test_1.txt')
+    with open(input_path, 'w') as fout:
+        fout.write('ratemsg,{0},5\n'.format(BASE_MS))
+        fout.write('101,{0}\n'.format(BASE_MS + 1000))
+        fout.write('ratemsg,{0},6\n'.format(BASE_MS + 1500))
+        fout.write('ratemsg,{0},7\n'.format(BASE_MS + 2600))
+        fout.write('102,{0}\n'.format(BASE_MS + 3000))
+        fout.write('ratemsg,{0},8\n'.format(BASE_MS + 3100))
+    timestamps, is_ratemsg = load_ratemsg_timestamps(input_path, status_fields=('tweet_id_str', 'timestamp_ms'))
+    assert timestamps.dtype.name == 'int64' and is_ratemsg.dtype.name == 'bool'
+    assert timestamps.tolist() == [BASE_MS, BASE_MS + 1000, BASE_MS + 1500, BASE_MS + 2600, BASE_MS + 3000, BASE_MS + 3100]
+    assert is_ratemsg.tolist() == [True, False, True, True, False, True]
+    # only the last rate limit message of a run between two tweets has an offset
+    assert ratemsg_offsets(timestamps, is_ratemsg).tolist() == [600]
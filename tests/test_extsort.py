@@ -0,0 +1,66 @@
+import sys, os, random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.extsort import ExternalSorter
+
+
+def make_records(num_records=2000, num_keys=300, seed=0):
+    rng = random.Random(seed)
+    return [(rng.randrange(num_keys) * 10 ** 12, 'value{0}'.format(idx)) for idx in range(num_records)]
+
+
+def test_spilled_records_come_out_in_key_and_adding_order(tmp_path):
+    records = make_records()
+    sorter = ExternalSorter(memory_budget=2000, tmp_dir=str(tmp_path), key_type=int)
+    for key, value in records:
+        sorter.add(key, value)
+    assert len(sorter.run_paths) > 1
+    assert len(sorter) == len(records)
+    # a stable sort keeps the records of the same key in the order of adding
+    assert list(sorter) == sorted(records, key=lambda record: record[0])
+    sorter.close()
+
+
+def test_runs_are_merged_beyond_max_runs(tmp_path):
+    records = make_records()
+    sorter = ExternalSorter(memory_budget=2000, tmp_dir=str(tmp_path), max_runs=4, key_type=int)
+    for key, value in records:
+        sorter.add(key, value)
+    assert len(sorter.run_paths) < 4
+    assert sorter.num_runs > 4
+    assert list(sorter) == sorted(records, key=lambda record: record[0])
+    sorter.close()
+
+
+def test_groups_and_first_values(tmp_path):
+    records = make_records()
+    sorter = ExternalSorter(memory_budget=2000, tmp_dir=str(tmp_path), key_type=int)
+    for key, value in records:
+        sorter.add(key, value)
+    expected_groups = {}
+    for key, value in records:
+        expected_groups.setdefault(key, []).append(value)
+    assert list(sorter.groups()) == sorted(expected_groups.items())
+    expected_first_values = {}
+    for key, value in records:
+        expected_first_values.setdefault(key, value)
+    assert list(sorter.first_values()) == sorted(expected_first_values.items())
+    sorter.close()
+
+
+def test_string_keys_in_memory():
+    sorter = ExternalSorter()
+    for key, value in [('b', '1'), ('a', '2'), ('b', '3')]:
+        sorter.add(key, value)
+    assert sorter.run_dir is None
+    assert list(sorter) == [('a', '2'), ('b', '1'), ('b', '3')]
+
+
+def test_close_removes_runs(tmp_path):
+    sorter = ExternalSorter(memory_budget=1000, tmp_dir=str(tmp_path), key_type=int)
+    for key, value in make_records(200):
+        sorter.add(key, value)
+    assert len(os.listdir(str(tmp_path))) == 1
+    sorter.close()
+    assert os.listdir(str(tmp_path)) == []
+    assert len(sorter) == 0
@@ -0,0 +1,74 @@
+import sys, os
+from multiprocessing import Process
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.idset import SharedIdSet, DISCARDED_SLOT
+
+
+def test_add_and_contains():
+    id_set = SharedIdSet(capacity=1024, num_segments=4)
+    assert id_set.add(123456789012345678)
+    assert not id_set.add(123456789012345678)
+    assert 123456789012345678 in id_set
+    assert 42 not in id_set
+    assert len(id_set) == 1
+
+
+def test_discard_leaves_a_tombstone():
+    # one segment, so all ids share a probe path
+    id_set = SharedIdSet(capacity=64, num_segments=1)
+    ids = list(range(1, 41))
+    for value in ids:
+        id_set.add(value)
+    for value in ids[::2]:
+        id_set.discard(value)
+    assert len(id_set) == 20
+    assert sum(1 for slot in id_set.slots if slot == DISCARDED_SLOT) == 20
+    # the ids probed past a tombstone are still found
+    assert all(value in id_set for value in ids[1::2])
+    assert not any(value in id_set for value in ids[::2])
+    # discarding an id that is not in the set changes nothing
+    id_set.discard(1000)
+    assert len(id_set) == 20
+
+
+def test_add_reuses_tombstones():
+    id_set = SharedIdSet(capacity=64, num_segments=1)
+    for value in range(1, 41):
+        id_set.add(value)
+    for value in range(1, 41):
+        id_set.discard(value)
+    assert not id_set.is_full()
+    for value in range(1, 41):
+        assert id_set.add(value)
+    assert len(id_set) == 40
+    assert id_set.discarded[0] == 0
+    assert sum(1 for slot in id_set.slots if slot == DISCARDED_SLOT) == 0
+
+
+def test_full_segment_reports_new_ids():
+    id_set = SharedIdSet(capacity=8, num_segments=1, max_load=0.5)
+    for value in range(1, 5):
+        assert id_set.add(value)
+    assert id_set.is_full()
+    # an id beyond the load is not stored, and is reported as new every time
+    assert id_set.add(5)
+    assert id_set.add(5)
+    assert 5 not in id_set
+    assert not id_set.add(4)
+
+
+def _add_range(id_set, start, end):
+    for value in range(start, end):
+        id_set.add(value)
+
+
+def test_shared_across_processes():
+    id_set = SharedIdSet(capacity=4096, num_segments=8)
+    workers = [Process(target=_add_range, args=(id_set, start, start + 500)) for start in (1, 301)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert len(id_set) == 800
+    assert all(value in id_set for value in range(1, 801))
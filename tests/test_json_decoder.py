@@ -0,0 +1,90 @@
+import sys, os, json, logging
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+import utils.json_decoder as json_decoder
+from utils.json_decoder import JsonDecoder, available_backends
+from wrangling.tweet_extractor import TweetExtractor
+
+
+def make_status(idx, hashtags=(), urls=(), mentions=()):
+    return {'id_str': str(1000 + idx), 'created_at': 'Mon Oct 14 10:00:00 +0000 2019', 'lang': 'en',
+            'user': {'id_str': str(idx), 'location': None, 'followers_count': idx, 'friends_count': 2,
+                     'statuses_count': 3, 'favourites_count': 4},
+            'place': {'full_name': 'Austin, TX', 'country_code': 'US'}, 'filter_level': 'low',
+            'retweet_count': 5, 'favorite_count': 6, 'in_reply_to_status_id_str': None, 'in_reply_to_user_id_str': None,
+            'text': 'text of {0}, with a comma'.format(idx),
+            'entities': {'hashtags': [{'text': hashtag} for hashtag in hashtags],
+                         'urls': [{'expanded_url': url} for url in urls],
+                         'user_mentions': [{'id_str': mention} for mention in mentions]}}
+
+
+def make_tweet_line(idx):
+    tweet = make_status(idx, hashtags=('a{0}'.format(idx),), urls=('https://youtu.be/dQw4w9WgXcQ',), mentions=('9',))
+    tweet['timestamp_ms'] = str(1570000000000 + idx)
+    retweeted = make_status(idx + 1, hashtags=('b',), mentions=('8',))
+    retweeted['extended_tweet'] = {'full_text': 'full text of {0}'.format(idx),
+                                   'entities': {'hashtags': [{'text': 'c'}],
+                                                'urls': [{'expanded_url': 'https://www.youtube.com/watch?v=a-b_c1D2e3F'}],
+                                                'user_mentions': []}}
+    tweet['retweeted_status'] = retweeted
+    if idx % 2 == 0:
+        tweet['quoted_status'] = make_status(idx + 2, urls=(None,))
+    return json.dumps(tweet).encode('utf-8')
+
+
+@pytest.fixture
+def extractor(tmp_path, monkeypatch):
+    monkeypatch.setattr(TweetExtractor, '_setup_logger',
+                        lambda self, logger_name: setattr(self, 'logger', logging.getLogger(logger_name)))
+    return TweetExtractor(str(tmp_path / 'input'), str(tmp_path / 'output'))
+
+
+def test_stdlib_backend_collects_shared_entities():
+    tweet = JsonDecoder('json').loads(make_tweet_line(0))
+    original, retweeted, quoted = TweetExtractor._collect_entities(tweet)
+    assert [entities['hashtags'] for entities in original] == [[{'text': 'a0'}]]
+    # the entities of retweeted status and of its extended tweet
+    assert [[hashtag['text'] for hashtag in entities['hashtags']] for entities in retweeted] == [['b'], ['c']]
+    assert len(quoted) == 1
+
+    tweet = JsonDecoder('json').loads(make_tweet_line(1))
+    assert len(TweetExtractor._collect_entities(tweet)[2]) == 0
+
+
+def test_auto_picks_the_fastest_installed_backend(monkeypatch):
+    assert available_backends()[-1] == 'json'
+    assert JsonDecoder().backend == available_backends()[0]
+    monkeypatch.setattr(json_decoder, 'simdjson', None)
+    monkeypatch.setattr(json_decoder, 'orjson', None)
+    assert available_backends() == ['json']
+    assert JsonDecoder('auto').backend == 'json'
+    with pytest.raises(ValueError):
+        JsonDecoder('orjson')
+
+
+@pytest.mark.parametrize('backend', ['orjson', 'simdjson'])
+def test_backend_records_match_the_stdlib(extractor, backend):
+    pytest.importorskip(backend)
+    lines = [make_tweet_line(idx) for idx in range(6)]
+    expected = [extractor._status_record(JsonDecoder('json').loads(line)) for line in lines]
+    decoder = JsonDecoder(backend)
+    assert [extractor._status_record(decoder.loads(line)) for line in lines] == expected
+
+
+def test_simdjson_keeps_the_last_document_alive():
+    pytest.importorskip('simdjson')
+    decoder = JsonDecoder('simdjson')
+    last_tweet = None
+    for idx in range(6):
+        tweet = decoder.loads(make_tweet_line(idx))
+        if last_tweet is not None:
+            # the document of the line before is still readable once the next line is decoded
+            assert last_tweet['id_str'] == str(1000 + idx - 1)
+            assert last_tweet['retweeted_status']['extended_tweet']['entities']['hashtags'][0]['text'] == 'c'
+        last_tweet = tweet
+    # a document held beyond the line after next is parsed again by a fresh parser
+    held = decoder.loads(make_tweet_line(10))
+    decoder.loads(make_tweet_line(11))
+    assert decoder.loads(make_tweet_line(12))['id_str'] == '1012'
+    assert held['id_str'] == '1010'
@@ -0,0 +1,60 @@
+import sys, os, io, random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.kmerge import kway_merge, kway_merge_groups, open_from
+from utils.codec import open_file
+
+
+def parse_line(line):
+    return int(line.split(',', 1)[0]), line
+
+
+def make_inputs(num_inputs=5, num_lines=500, seed=0):
+    rng = random.Random(seed)
+    inputs = []
+    for idx in range(num_inputs):
+        heads = sorted(rng.randrange(1000) for _ in range(num_lines))
+        inputs.append(['{0},input{1}-{2}\n'.format(head, idx, line_idx) for line_idx, head in enumerate(heads)])
+    return inputs
+
+
+def test_merge_order_and_ties_in_input_order():
+    inputs = make_inputs()
+    merged = list(kway_merge([io.StringIO(''.join(lines)) for lines in inputs], parse_line, block_size=256))
+    # a stable sort keeps the lines of an input in their order
+    expected = sorted([(parse_line(line)[0], idx, line) for idx, lines in enumerate(inputs) for line in lines],
+                      key=lambda item: item[:2])
+    assert merged == expected
+
+
+def test_empty_inputs_and_blank_lines():
+    inputs = [io.StringIO(''), io.StringIO('1,a\n\n3,c\n'), io.StringIO('\n2,b\n')]
+    assert [record for _, _, record in kway_merge(inputs, parse_line)] == ['1,a\n', '2,b\n', '3,c\n']
+    assert list(kway_merge([io.StringIO('')], parse_line)) == []
+
+
+def test_groups_of_the_same_key():
+    inputs = [io.StringIO('1,a\n2,b\n'), io.StringIO('1,c\n3,d\n')]
+    assert list(kway_merge_groups(inputs, parse_line)) == [(1, [(0, '1,a\n'), (1, '1,c\n')]), (2, [(0, '2,b\n')]),
+                                                          (3, [(1, '3,d\n')])]
+
+
+def test_open_from_seeks_to_the_head(tmp_path):
+    lines = ['{0},line{1}\n'.format(head, idx) for idx, head in enumerate(range(0, 3000, 3))]
+    path = str(tmp_path / 'sorted.txt')
+    with open(path, 'w') as fout:
+        fout.writelines(lines)
+    for head in (-1, 0, 1, 1500, 1501, 2997, 2998):
+        with open_from(path, head) as fin:
+            assert fin.readlines() == [line for line in lines if parse_line(line)[0] >= head]
+    with open_from(path) as fin:
+        assert fin.readlines() == lines
+
+
+def test_open_from_reads_compressed_file_from_the_start(tmp_path):
+    lines = ['{0},line\n'.format(head) for head in range(100)]
+    path = str(tmp_path / 'sorted.txt.bz2')
+    with open_file(path, 'w') as fout:
+        fout.writelines(lines)
+    with open_from(path, 50) as fin:
+        assert fin.readlines() == lines
@@ -0,0 +1,120 @@
+import sys, os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.manifest import Manifest
+
+
+def write_input(path, data=b'0123456789' * 100):
+    with open(path, 'wb') as fout:
+        fout.write(data)
+    return path
+
+
+def test_done_tasks_survive_a_restart(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    manifest = Manifest(manifest_path)
+    assert not manifest.is_done(input_path, 0, 0, 500, (32, 4000))
+    manifest.mark_done(input_path, 0, 2, 0, 500, (32, 4000))
+
+    resumed = Manifest(manifest_path)
+    assert resumed.is_done(input_path, 0, 0, 500, (32, 4000))
+    assert not resumed.is_done(input_path, 1, 500, 1000, (4000, 7990))
+    assert not resumed.is_file_done(input_path)
+    resumed.mark_done(input_path, 1, 2, 500, 1000, (4000, 7990))
+    assert Manifest(manifest_path).is_file_done(input_path)
+
+
+def test_partial_line_is_skipped(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    Manifest(manifest_path).mark_done(input_path)
+    with open(manifest_path, 'a') as fout:
+        # a write interrupted halfway
+        fout.write('{"path": "')
+    manifest = Manifest(manifest_path)
+    assert manifest.is_done(input_path)
+    assert len(manifest.entries) == 1
+
+
+def test_touched_file_is_compared_by_checksum(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    Manifest(manifest_path).mark_done(input_path, 0, 2, 0, 500)
+    stat = os.stat(input_path)
+    os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert Manifest(manifest_path).is_done(input_path, 0, 0, 500)
+    # a whole file check needs the file unchanged
+    assert not Manifest(manifest_path).is_file_done(input_path)
+
+    # the same size but other bytes in the range of the task
+    write_input(input_path, b'x' * 10 + b'0123456789' * 99)
+    assert not Manifest(manifest_path).is_done(input_path, 0, 0, 500)
+    # the bytes of another task are unchanged
+    Manifest(manifest_path).mark_done(input_path, 1, 2, 500, 1000)
+    os.utime(input_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 2 * 10 ** 9))
+    assert Manifest(manifest_path).is_done(input_path, 1, 500, 1000)
+
+
+def test_changed_size_is_not_done(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    Manifest(manifest_path).mark_done(input_path)
+    write_input(input_path, b'0123456789' * 101)
+    assert not Manifest(manifest_path).is_done(input_path)
+
+
+def test_reset_forgets_all_tasks(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    manifest = Manifest(manifest_path)
+    manifest.mark_done(input_path)
+    manifest.reset()
+    assert not os.path.exists(manifest_path)
+    assert not Manifest(manifest_path).is_done(input_path)
+
+
+def test_chunk_of_another_split_is_not_done(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    manifest = Manifest(manifest_path)
+    # chunks 0 and 1 of a split into 3, e.g., before chunk_size changes
+    manifest.mark_done(input_path, 0, 3, 0, 300, (32, 2400))
+    manifest.mark_done(input_path, 1, 3, 300, 600, (2400, 4800))
+
+    resumed = Manifest(manifest_path)
+    # chunk 0 of a split into 2 covers more blocks
+    assert not resumed.is_done(input_path, 0, 0, 500, (32, 4000))
+    assert resumed.is_done(input_path, 1, 300, 600, (2400, 4800))
+    # the last chunk of another split, with the same number of chunks but another start
+    resumed.mark_done(input_path, 2, 3, 500, 1000, (4000, 7990))
+    assert not Manifest(manifest_path).is_file_done(input_path)
+    resumed.mark_done(input_path, 2, 3, 600, 1000, (4800, 7990))
+    assert Manifest(manifest_path).is_file_done(input_path)
+
+
+def test_task_with_a_removed_output_is_not_done(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    output_path = write_input(str(tmp_path / 'input.csv'), b'')
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    Manifest(manifest_path).mark_done(input_path, outputs=[output_path])
+    assert Manifest(manifest_path).is_done(input_path)
+    assert Manifest(manifest_path).is_file_done(input_path)
+    os.remove(output_path)
+    assert not Manifest(manifest_path).is_done(input_path)
+    assert not Manifest(manifest_path).is_file_done(input_path)
+
+
+def test_another_config_forgets_all_tasks(tmp_path):
+    input_path = write_input(str(tmp_path / 'input.bz2'))
+    manifest_path = str(tmp_path / 'manifest.jsonl')
+    manifest = Manifest(manifest_path)
+    assert not manifest.set_config({'codec': 'bz2', 'fields': ('tweet_id_str', 'timestamp_ms')})
+    manifest.mark_done(input_path)
+
+    resumed = Manifest(manifest_path)
+    assert not resumed.set_config({'codec': 'bz2', 'fields': ['tweet_id_str', 'timestamp_ms']})
+    assert resumed.is_done(input_path)
+    assert resumed.set_config({'codec': 'zstd', 'fields': ['tweet_id_str', 'timestamp_ms']})
+    assert not resumed.is_done(input_path)
+    assert not os.path.exists(manifest_path)
@@ -0,0 +1,100 @@
+import sys, os, shutil
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+import wrangling.merge_subcrawlers as merge_subcrawlers
+from wrangling.merge_subcrawlers import merge_entity
+from utils.helper import make_snowflake
+
+APP_NAME = 'test'
+TARGET_SUFFIX = ['1', 'all']
+BASE_MS = 1570000000000
+
+
+class Interrupted(Exception):
+    pass
+
+
+def write_entity_files(archive_dir, num_lines):
+    """Write vid files of two sub-crawlers, sub-crawler 1 misses every third line of the all crawler."""
+    for suffix in TARGET_SUFFIX:
+        with open(os.path.join(archive_dir, 'vid_{0}_{1}.txt'.format(APP_NAME, suffix)), 'w') as fout:
+            for idx in range(num_lines):
+                if suffix == '1' and idx % 3 == 0:
+                    continue
+                fout.write('{0},v{1}\n'.format(make_snowflake(BASE_MS + idx * 60000, 1, 1, idx % 4), idx % 5))
+
+
+def read_complete(archive_dir):
+    with open(os.path.join(archive_dir, 'complete_vid_{0}.txt'.format(APP_NAME))) as fin:
+        return fin.read()
+
+
+def full_merge(tmp_path, num_lines):
+    archive_dir = str(tmp_path / 'full')
+    os.makedirs(archive_dir)
+    write_entity_files(archive_dir, num_lines)
+    merge_entity(archive_dir, APP_NAME, TARGET_SUFFIX, 'vid')
+    return read_complete(archive_dir)
+
+
+def incremental_merge(archive_dir, num_lines):
+    write_entity_files(archive_dir, num_lines)
+    merge_entity(archive_dir, APP_NAME, TARGET_SUFFIX, 'vid', incremental=True)
+
+
+def interrupt_before_state(path, state):
+    if 'seam' in state:
+        raise Interrupted()
+
+
+def interrupt_before_truncate(output_path, seam):
+    raise Interrupted()
+
+
+def interrupt_after_truncate(output_path, seam):
+    os.truncate(output_path, seam)
+    raise Interrupted()
+
+
+@pytest.mark.parametrize('target, interrupt', [('save_merge_state', interrupt_before_state),
+                                               ('apply_tail', interrupt_before_truncate),
+                                               ('apply_tail', interrupt_after_truncate)])
+def test_interrupted_merge_is_finished_by_the_next_one(tmp_path, monkeypatch, target, interrupt):
+    archive_dir = str(tmp_path / 'incremental')
+    os.makedirs(archive_dir)
+    incremental_merge(archive_dir, 100)
+    incremental_merge(archive_dir, 200)
+    assert read_complete(archive_dir) == full_merge(tmp_path / 'first', 200)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(merge_subcrawlers, target, interrupt)
+        with pytest.raises(Interrupted):
+            incremental_merge(archive_dir, 300)
+    output_path = os.path.join(archive_dir, 'complete_vid_{0}.txt'.format(APP_NAME))
+    assert os.path.exists('{0}.tail'.format(output_path))
+
+    incremental_merge(archive_dir, 350)
+    assert read_complete(archive_dir) == full_merge(tmp_path / 'second', 350)
+    assert not os.path.exists('{0}.tail'.format(output_path))
+    assert not os.path.exists('{0}.new'.format(output_path))
+
+
+def test_merge_without_new_lines_keeps_the_complete_file(tmp_path):
+    archive_dir = str(tmp_path / 'incremental')
+    os.makedirs(archive_dir)
+    incremental_merge(archive_dir, 100)
+    complete = read_complete(archive_dir)
+    incremental_merge(archive_dir, 100)
+    assert read_complete(archive_dir) == complete
+    assert complete == full_merge(tmp_path, 100)
+
+
+def test_mismatched_state_falls_back_to_a_full_merge(tmp_path):
+    archive_dir = str(tmp_path / 'incremental')
+    os.makedirs(archive_dir)
+    incremental_merge(archive_dir, 100)
+    with open(os.path.join(archive_dir, 'complete_vid_{0}.txt'.format(APP_NAME)), 'a') as fout:
+        fout.write('garbage\n')
+    incremental_merge(archive_dir, 150)
+    assert read_complete(archive_dir) == full_merge(tmp_path, 150)
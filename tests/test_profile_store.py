@@ -0,0 +1,65 @@
+import sys, os, bz2
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.profile_store import build_profile_store, UserProfileStore, MISSING_COUNT
+
+
+def profile_line(user_id, screen_name, verified='N', followers='10'):
+    return '{0},{1},2019-10-14,{2},Austin TX,{3},20,1,30,N\n'.format(user_id, screen_name, verified, followers)
+
+
+def write_profiles(tmp_path):
+    """Write profiles of two sub-crawlers, users 2 ** 40 and 7 are in both."""
+    first_path = str(tmp_path / 'app_1_user.txt.bz2')
+    with bz2.open(first_path, 'wt', encoding='utf-8') as fout:
+        fout.write(profile_line(2 ** 40, 'first', 'Y', '5'))
+        fout.write(profile_line(7, 'seven', followers='N'))
+        fout.write(profile_line(300, 'three_hundred'))
+    second_path = str(tmp_path / 'app_all_user.txt')
+    with open(second_path, 'w', encoding='utf-8') as fout:
+        fout.write(profile_line(12, 'twelve'))
+        fout.write(profile_line(2 ** 40, 'last', 'N', '6'))
+        fout.write(profile_line(7, 'seven_again', followers='8'))
+    return [first_path, second_path]
+
+
+@pytest.mark.parametrize('keep', ['first', 'last'])
+def test_lookups_of_a_built_store(tmp_path, keep):
+    store_dir = str(tmp_path / 'store')
+    # a run is spilled every few profiles
+    assert build_profile_store(write_profiles(tmp_path), store_dir, keep, memory_budget=400, tmp_dir=str(tmp_path)) == 4
+    assert not os.path.exists('{0}.tmp'.format(store_dir))
+
+    with UserProfileStore(store_dir) as store:
+        assert len(store) == 4
+        assert 12 in store and 13 not in store
+        assert store.get(12) == ('12', 'twelve', '2019-10-14', 'N', 'Austin TX', '10', '20', '1', '30', 'N')
+        assert store.get(13) is None
+        screen_name = 'first' if keep == 'first' else 'last'
+        assert store.get(2 ** 40)[:2] == (str(2 ** 40), screen_name)
+
+        user_ids = [300, 13, 2 ** 40, 7, 12, -1]
+        profiles = store.get_many(user_ids)
+        assert [None if profile is None else int(profile[0]) for profile in profiles] == \
+            [300, None, 2 ** 40, 7, 12, None]
+        assert profiles[3][1] == ('seven' if keep == 'first' else 'seven_again')
+
+        followers = store.get_column('followers_count', user_ids)
+        assert followers.dtype.name == 'int64'
+        if keep == 'first':
+            assert followers.tolist() == [10, MISSING_COUNT, 5, MISSING_COUNT, 10, MISSING_COUNT]
+        else:
+            assert followers.tolist() == [10, MISSING_COUNT, 6, 8, 10, MISSING_COUNT]
+        assert store.get_column('verified', user_ids).tolist() == [False, False, keep == 'first', False, False, False]
+        with pytest.raises(ValueError):
+            store.get_column('description', user_ids)
+
+
+def test_empty_store(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    assert build_profile_store([], store_dir) == 0
+    with UserProfileStore(store_dir) as store:
+        assert len(store) == 0
+        assert store.get(7) is None
+        assert store.get_column('friends_count', [7]).tolist() == [MISSING_COUNT]
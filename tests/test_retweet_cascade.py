@@ -0,0 +1,86 @@
+import sys, os, io, random
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from wrangling.retweet_cascade import RetweetCascadeBuilder, load_retweet_cascades, get_retweet_cascade, \
+    MISSING_FOLLOWERS
+
+
+def make_triples(num_triples=200, num_roots=15, seed=0):
+    rng = random.Random(seed)
+    triples = []
+    for idx in range(num_triples):
+        root_id = 10 ** 18 + rng.randrange(num_roots) * 10 ** 6
+        followers = 'N' if idx % 11 == 0 else str(rng.randrange(1000))
+        triples.append((root_id, root_id + 1 + rng.randrange(10 ** 5), followers))
+    return triples
+
+
+def parse_text_cascade(line):
+    root_id, retweets = line.split(':')
+    return int(root_id), [(int(retweet_id), followers)
+                          for retweet_id, followers in (retweet.split('-') for retweet in retweets.split(','))]
+
+
+def test_text_and_binary_cascades_agree_across_runs(tmp_path):
+    triples = make_triples()
+    builder = RetweetCascadeBuilder(str(tmp_path), chunk_size=16, block_size=4)
+    for root_id, retweet_id, followers in triples:
+        builder.add(root_id, retweet_id, followers)
+    # a retweet added again, e.g., of a duplicate tweet, in a later run
+    builder.add(*triples[0])
+    assert len(builder.run_bounds) > 3
+
+    text_output = io.StringIO()
+    binary_dir = str(tmp_path / 'retweet_test')
+    builder.dump(text_output, binary_dir)
+    builder.close()
+    assert os.listdir(str(tmp_path)) == ['retweet_test']
+
+    expected = {}
+    for root_id, retweet_id, followers in sorted(set(triples)):
+        expected.setdefault(root_id, []).append((retweet_id, followers))
+    text_cascades = [parse_text_cascade(line) for line in text_output.getvalue().splitlines()]
+    assert text_cascades == sorted(expected.items())
+    # some root has retweets in more than one run
+    run_roots = [set(root_id for root_id, _, _ in triples[start:start + 16]) for start in range(0, len(triples), 16)]
+    assert any(sum(root_id in roots for roots in run_roots) > 1 for root_id in expected)
+
+    cascades = load_retweet_cascades(binary_dir)
+    assert cascades['root_ids'].tolist() == [root_id for root_id, _ in text_cascades]
+    assert cascades['offsets'].tolist()[-1] == sum(len(retweets) for _, retweets in text_cascades)
+    for root_id, retweets in text_cascades:
+        retweet_ids, followers = get_retweet_cascade(cascades, root_id)
+        assert retweet_ids.tolist() == [retweet_id for retweet_id, _ in retweets]
+        assert followers.tolist() == [MISSING_FOLLOWERS if count == 'N' else int(count) for _, count in retweets]
+    assert get_retweet_cascade(cascades, 1) is None
+    assert get_retweet_cascade(cascades, 2 * 10 ** 18) is None
+
+
+def test_empty_builder_dumps_empty_cascades(tmp_path):
+    builder = RetweetCascadeBuilder(str(tmp_path))
+    text_output = io.StringIO()
+    binary_dir = str(tmp_path / 'retweet_test')
+    builder.dump(text_output, binary_dir)
+    assert text_output.getvalue() == ''
+    cascades = load_retweet_cascades(binary_dir)
+    assert cascades['offsets'].tolist() == [0]
+    assert get_retweet_cascade(cascades, 10 ** 18) is None
+
+
+def test_duplicate_retweet_keeps_the_followers_first_added(tmp_path):
+    root_id = 10 ** 18
+    builder = RetweetCascadeBuilder(str(tmp_path), chunk_size=4, block_size=2)
+    # duplicates within a run, the later one with fewer followers
+    builder.add(root_id, root_id + 1, '50')
+    builder.add(root_id, root_id + 2, 'N')
+    builder.add(root_id, root_id + 1, '7')
+    builder.add(root_id, root_id + 3, '30')
+    # duplicates in later runs
+    builder.add(root_id, root_id + 3, '2')
+    builder.add(root_id, root_id + 2, '1')
+    for followers in ('0', '9', '1'):
+        builder.add(root_id, root_id + 3, followers)
+    assert len(builder.run_bounds) > 2
+    assert list(builder.cascades()) == [(root_id, [(root_id + 1, 50), (root_id + 2, MISSING_FOLLOWERS),
+                                                   (root_id + 3, 30)])]
+    builder.close()
@@ -0,0 +1,109 @@
+import sys, os
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from wrangling.status_sink import TWEET_STATUS_FIELDS, TWEET_STATUS_INDEX, RATEMSG, StatusDictionary, \
+    load_status_dictionary, decode_record, is_ratemsg_record, ParquetStatusSink, merge_parquet_files, read_parquet_records
+from wrangling.extract_entities import ENTITY_FIELDS
+
+
+def make_record(idx, lang, filter_level, countrycode, geoname):
+    record = ['N'] * len(TWEET_STATUS_FIELDS)
+    record[TWEET_STATUS_INDEX['tweet_id_str']] = str(1000 + idx)
+    record[TWEET_STATUS_INDEX['timestamp_ms']] = str(1570000000000 + idx)
+    record[TWEET_STATUS_INDEX['original_lang']] = lang
+    record[TWEET_STATUS_INDEX['retweeted_lang']] = 'en'
+    record[TWEET_STATUS_INDEX['original_filter']] = filter_level
+    record[TWEET_STATUS_INDEX['original_countrycode']] = countrycode
+    record[TWEET_STATUS_INDEX['original_geoname']] = geoname
+    return record
+
+
+def encode_in_workers(path, worker_records):
+    """Encode the records of each worker as a forked worker process would, from the dictionary state before the fork."""
+    dictionaries = [StatusDictionary(path) for _ in worker_records]
+    encoded = []
+    for worker_idx, (dictionary, records) in enumerate(zip(dictionaries, worker_records)):
+        dictionary.start_worker(worker_idx, len(worker_records))
+        encoded.append([dictionary.encode_record(record) for record in records])
+        dictionary.close_worker()
+    # the extractor merges the worker files once all workers have finished
+    StatusDictionary(path).merge_worker_files()
+    return encoded
+
+
+def assert_codes_are_unique(path):
+    values = {}
+    with open(path, 'r', encoding='utf-8') as fin:
+        for line in fin:
+            group, code, value = line.rstrip('\n').split(',', 2)
+            assert values.setdefault((group, code), value) == value
+
+
+def test_records_of_two_workers_decode_to_the_original(tmp_path):
+    path = str(tmp_path / 'dictionary.txt')
+    worker_records = [[make_record(0, 'en', 'low', 'US', 'Austin TX'), make_record(1, 'fr', 'none', 'N', 'N'),
+                       (RATEMSG, '1570000000002', '17')],
+                      [make_record(2, 'fr', 'low', 'FR', 'Paris France'), make_record(3, 'en', 'medium', 'US', 'Austin TX')]]
+    encoded = encode_in_workers(path, worker_records)
+    assert not os.path.exists('{0}.0'.format(path))
+    assert encoded[0][0][TWEET_STATUS_INDEX['original_lang']] != 'en'
+    assert encoded[0][2] == worker_records[0][2]
+    assert_codes_are_unique(path)
+
+    dictionary = load_status_dictionary(path)
+    for records, encoded_records in zip(worker_records, encoded):
+        for record, encoded_record in zip(records, encoded_records):
+            assert list(decode_record(encoded_record, dictionary)) == list(record)
+
+
+def test_resumed_run_continues_after_the_largest_code(tmp_path):
+    path = str(tmp_path / 'dictionary.txt')
+    first_records = [[make_record(0, 'en', 'low', 'US', 'Austin TX')], [make_record(1, 'de', 'none', 'DE', 'Berlin')]]
+    first_encoded = encode_in_workers(path, first_records)
+    second_records = [[make_record(2, 'ja', 'low', 'JP', 'Tokyo')], [make_record(3, 'de', 'high', 'N', 'N')]]
+    second_encoded = encode_in_workers(path, second_records)
+    assert_codes_are_unique(path)
+
+    dictionary = load_status_dictionary(path)
+    for records, encoded_records in zip(first_records + second_records, first_encoded + second_encoded):
+        assert decode_record(encoded_records[0], dictionary) == records[0]
+
+
+def test_parquet_shards_merge_and_read_back_entity_columns(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    records = []
+    shard_paths = []
+    for shard_idx in range(2):
+        record = make_record(shard_idx, 'en', 'low', 'US', 'Austin TX')
+        record[TWEET_STATUS_INDEX['user_id_str']] = str(2 ** 40 + shard_idx)
+        record[TWEET_STATUS_INDEX['original_hashtags']] = 'tag{0};other'.format(shard_idx)
+        record[TWEET_STATUS_INDEX['original_user_followers_count']] = '12'
+        ratemsg = (RATEMSG, str(1570000000500 + shard_idx), str(40 + shard_idx))
+        shard_path = str(tmp_path / 'shard{0}.parquet'.format(shard_idx))
+        # a row group per record
+        sink = ParquetStatusSink(shard_path, row_group_size=1)
+        sink.write(record)
+        sink.write(ratemsg)
+        sink.close()
+        assert pq.ParquetFile(shard_path).num_row_groups == 2
+        records.extend([record, ratemsg])
+        shard_paths.append(shard_path)
+    output_path = str(tmp_path / 'merged.parquet')
+    merge_parquet_files(shard_paths, output_path)
+
+    schema = pq.read_schema(output_path)
+    assert str(schema.field('tweet_id_str').type) == 'int64'
+    assert str(schema.field('timestamp_ms').type) == 'int64'
+    assert str(schema.field('original_retweet_count').type) == 'int32'
+    assert str(schema.field('original_lang').type) == 'dictionary<values=string, indices=int32, ordered=0>'
+    assert str(schema.field('original_hashtags').type) == 'string'
+    assert str(schema.field('track').type) == 'int64'
+
+    read_records = list(read_parquet_records(output_path, ENTITY_FIELDS))
+    assert [is_ratemsg_record(record) for record in read_records] == [False, True, False, True]
+    for record, read_record in zip(records, read_records):
+        if is_ratemsg_record(record):
+            assert read_record == record
+        else:
+            assert read_record == tuple(record[TWEET_STATUS_INDEX[field]] for field in ENTITY_FIELDS)
@@ -0,0 +1,269 @@
+import sys, os, io, re, bz2, json, random, logging
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from wrangling.tweet_extractor import TweetExtractor, classify_message, parse_limit_message, extract_vid, \
+    STATUS_MESSAGE, LIMIT_MESSAGE, DELETE_MESSAGE, DISCONNECT_MESSAGE, OTHER_MESSAGE
+from wrangling.status_sink import RATEMSG, is_ratemsg_record
+from wrangling.extract_entities import ENTITY_FIELDS, EntityCollector
+from wrangling.extract_tweet_status import list_shards
+from utils.manifest import Manifest
+from utils.idset import SharedIdSet
+
+BASE_MS = 1570000000000
+
+
+def make_user(user_id):
+    return {'id_str': str(user_id), 'screen_name': 'user{0}'.format(user_id), 'created_at': 'Mon Oct 14 10:00:00 +0000 2019',
+            'verified': False, 'location': 'Austin, TX', 'followers_count': 10, 'friends_count': 20, 'listed_count': 1,
+            'statuses_count': 30, 'favourites_count': 40, 'description': None}
+
+
+def make_tweet(idx, text='hello, world', hashtags=(), urls=()):
+    return {'id_str': str(1000 + idx), 'created_at': 'Mon Oct 14 10:00:00 +0000 2019', 'timestamp_ms': str(BASE_MS + idx),
+            'user': make_user(idx % 7), 'lang': 'en', 'place': None, 'filter_level': 'low',
+            'retweet_count': 0, 'favorite_count': 0, 'in_reply_to_status_id_str': None, 'in_reply_to_user_id_str': None,
+            'text': text,
+            'entities': {'hashtags': [{'text': hashtag} for hashtag in hashtags],
+                         'urls': [{'expanded_url': url} for url in urls], 'user_mentions': []}}
+
+
+def limit_line(idx):
+    return '{{"limit":{{"track":{0},"timestamp_ms":"{1}"}}}}'.format(idx, BASE_MS + idx)
+
+
+def write_input(extractor, filename, lines):
+    with bz2.open(os.path.join(extractor.input_dir, filename), 'wt', encoding='utf-8') as fout:
+        for line in lines:
+            fout.write(line if isinstance(line, str) else json.dumps(line))
+            fout.write('\n')
+
+
+@pytest.fixture
+def make_extractor(tmp_path, monkeypatch):
+    """Build extractors that log into the test log rather than by ../conf/logging.conf."""
+    def setup_logger(self, logger_name):
+        self.logger = logging.getLogger(logger_name)
+    monkeypatch.setattr(TweetExtractor, '_setup_logger', setup_logger)
+
+    def make(output_name='output', **kwargs):
+        input_dir = str(tmp_path / 'input')
+        os.makedirs(input_dir, exist_ok=True)
+        return TweetExtractor(input_dir, str(tmp_path / output_name), **kwargs)
+    return make
+
+
+def test_projection_starts_with_a_record_key(make_extractor):
+    extractor = make_extractor(fields=('timestamp_ms', 'original_text'))
+    tweet = make_tweet(0, text=RATEMSG)
+    record = extractor._status_record(tweet)
+    assert record == (str(BASE_MS), RATEMSG)
+    assert not is_ratemsg_record(record)
+    for fields in (('original_text', 'tweet_id_str'), ('original_hashtags',), ()):
+        with pytest.raises(ValueError):
+            extractor.set_fields(fields)
+
+
+def test_fused_extraction_keeps_the_manifest_of_extract(make_extractor, tmp_path):
+    extractor = make_extractor(proc_num=2, fields=ENTITY_FIELDS)
+    write_input(extractor, 'a.bz2', [make_tweet(0, hashtags=('x',)), limit_line(1), make_tweet(2)])
+    write_input(extractor, 'b.bz2', [make_tweet(3, hashtags=('y',))])
+    collector = EntityCollector('1', 0, None, status_fields=ENTITY_FIELDS, tmp_dir=str(tmp_path))
+    extractor.extract_fused(collector)
+    assert os.path.basename(extractor.manifest.path) == 'manifest.jsonl'
+    assert len(extractor.manifest.entries) == 0
+    assert sorted(os.listdir(extractor.entity_stats_path)) == ['a.txt', 'b.txt']
+
+    # workers mark tasks done in the manifest of extract
+    extractor.extract()
+    assert len(Manifest(os.path.join(extractor.output_dir, 'manifest.jsonl')).entries) == 2
+    assert len(Manifest(os.path.join(extractor.output_dir, 'fused_manifest.jsonl')).entries) == 2
+
+
+def test_shards_of_earlier_runs_are_not_listed(make_extractor):
+    extractor = make_extractor()
+    write_input(extractor, 'a.bz2', [make_tweet(0), limit_line(1)])
+    write_input(extractor, 'b.bz2', [make_tweet(2)])
+    # left by an earlier run with another codec or split, or interrupted
+    for stale_filename in ('a.zst', 'a-0000.bz2', 'b.bz2.tmp'):
+        open(os.path.join(extractor.tweet_stats_path, stale_filename), 'wb').close()
+    extractor.extract()
+    # a resumed run lists the outputs of the done tasks as well
+    extractor.extract()
+    assert sorted(extractor.task_filenames) == ['a', 'b']
+    assert list_shards(extractor.tweet_stats_path, extractor.task_filenames) == \
+        [os.path.join(extractor.tweet_stats_path, 'a.bz2'), os.path.join(extractor.tweet_stats_path, 'b.bz2')]
+
+
+
+def test_rerun_with_another_codec_or_projection_extracts_again(make_extractor, capsys):
+    extractor = make_extractor()
+    write_input(extractor, 'a.bz2', [make_tweet(0), limit_line(1)])
+    write_input(extractor, 'b.bz2', [make_tweet(2)])
+    extractor.extract()
+
+    extractor.set_codec('none')
+    extractor.extract()
+    assert sorted(os.listdir(extractor.tweet_stats_path)) == ['a.bz2', 'a.txt', 'b.bz2', 'b.txt']
+    assert sorted(os.listdir(extractor.user_stats_path)) == ['a.bz2', 'a.txt', 'b.bz2', 'b.txt']
+
+    extractor.set_fields(('tweet_id_str', 'timestamp_ms'))
+    extractor.extract()
+    with open(os.path.join(extractor.tweet_stats_path, 'b.txt'), 'r', encoding='utf-8') as fin:
+        assert fin.read().splitlines() == ['1002,{0}'.format(BASE_MS + 2)]
+
+    # a task whose output is removed is extracted again, the other is done
+    os.remove(os.path.join(extractor.tweet_stats_path, 'a.txt'))
+    capsys.readouterr()
+    assert list_shards(extractor.tweet_stats_path, extractor.task_filenames, codec='none') == \
+        [os.path.join(extractor.tweet_stats_path, 'b.txt')]
+    assert '1 of 2 files are missing' in capsys.readouterr().out
+    extractor.extract()
+    assert 'Skip 1 files or chunks' in capsys.readouterr().out
+    assert sorted(os.listdir(extractor.tweet_stats_path)) == ['a.bz2', 'a.txt', 'b.bz2', 'b.txt']
+
+
+@pytest.mark.parametrize('line, message_type', [
+    (b'{"created_at":"Mon Oct 14 10:00:00 +0000 2019","id":1,"id_str":"1"}\n', STATUS_MESSAGE),
+    (b'{"limit":{"track":283540,"timestamp_ms":"1483189188944"}}\r\n', LIMIT_MESSAGE),
+    (b'  {"limit":{"timestamp_ms":"1483189188944","track":283540}}', LIMIT_MESSAGE),
+    (b'{"delete":{"status":{"id":1,"id_str":"1","user_id":2,"user_id_str":"2"},"timestamp_ms":"1483189188944"}}',
+     DELETE_MESSAGE),
+    (b'{"disconnect":{"code":7,"stream_name":"app","reason":"admin logout"}}', DISCONNECT_MESSAGE),
+    # a status whose first key is not created_at is decoded as it is
+    (b'{"id_str":"1","created_at":"Mon Oct 14 10:00:00 +0000 2019"}', OTHER_MESSAGE),
+    (b'{"warning":{"code":"FALLING_BEHIND","percent_full":60}}', OTHER_MESSAGE),
+    (b'', OTHER_MESSAGE),
+])
+def test_classify_message(line, message_type):
+    assert classify_message(line) == message_type
+
+
+@pytest.mark.parametrize('line, limit', [
+    (b'{"limit":{"track":283540,"timestamp_ms":"1483189188944"}}', ('1483189188944', 283540)),
+    (b' {"limit": {"track": 0, "timestamp_ms": "1483189188944"}}\r\n', ('1483189188944', 0)),
+    # unusual layouts fall back to the decoder
+    (b'{"limit":{"timestamp_ms":"1483189188944","track":283540}}', None),
+    (b'{"limit":{"track":283540,"timestamp_ms":"1483189188944","extra":1}}', None),
+    (b'{"limit":{"track":283540}}', None),
+    (b'{"created_at":"Mon Oct 14 10:00:00 +0000 2019"}', None),
+])
+def test_parse_limit_message(line, limit):
+    assert parse_limit_message(line) == limit
+
+
+def test_unusual_messages_fall_back_to_the_decoder(make_extractor):
+    extractor = make_extractor(fields=('tweet_id_str', 'timestamp_ms'))
+    extractor.visited_user_ids = SharedIdSet(1 << 10)
+    tweet = make_tweet(0)
+    reordered_tweet = dict([('id_str', tweet['id_str'])] + [item for item in tweet.items() if item[0] != 'id_str'])
+    lines = [json.dumps(tweet).encode(),
+             limit_line(1).encode(),
+             b'{"limit":{"timestamp_ms":"1570000000002","track":2}}',
+             b'{"delete":{"status":{"id":1,"id_str":"1","user_id":2,"user_id_str":"2"},"timestamp_ms":"1"}}',
+             b'{"disconnect":{"code":7,"stream_name":"app","reason":"admin logout"}}',
+             json.dumps(reordered_tweet).encode(),
+             b'   \n']
+    records = list(extractor._iter_records(lines, 'test', io.StringIO()))
+    assert records == [(tweet['id_str'], tweet['timestamp_ms']), (RATEMSG, str(BASE_MS + 1), 1),
+                       (RATEMSG, '1570000000002', 2), (tweet['id_str'], tweet['timestamp_ms'])]
+
+
+def split_vid(expanded_url):
+    """The video id parser that extract_vid replaces."""
+    if 'watch?' in expanded_url and 'v=' in expanded_url:
+        vid = expanded_url.split('v=')[1][:11]
+    elif 'youtu.be' in expanded_url:
+        vid = expanded_url.rsplit('/', 1)[-1][:11]
+    else:
+        return None
+    valid = re.match(r'^[\w-]+$', vid) is not None
+    if valid and len(vid) == 11:
+        return vid
+    return None
+
+
+@pytest.mark.parametrize('expanded_url, vid', [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42s', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?feature=share&v=a-b_c1D2e3F&list=PL1', 'a-b_c1D2e3F'),
+    ('http://youtube.com/watch?v=dQw4w9WgXcQabc', 'dQw4w9WgXcQ'),
+    ('https://m.youtube.com/watch?v=dQw4w9WgXcQ&feature=youtu.be', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ?t=10', 'dQw4w9WgXcQ'),
+    ('https://www.youtu.be/abc/dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    # embed urls are not video urls to the parser, as before
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', None),
+    ('https://www.youtube.com/watch?v=dQw4w9WgX', None),
+    ('https://www.youtube.com/watch?v=dQw4w9W.XcQ', None),
+    ('https://www.youtube.com/watch?list=PL1', None),
+    ('https://youtu.be/', None),
+    ('https://youtu.be/dQw4w9W', None),
+    ('https://youtu.be/dQw4w9%gXcQ', None),
+    ('https://example.com/watch?v=dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://example.com/video/dQw4w9WgXcQ', None),
+])
+def test_extract_vid(expanded_url, vid):
+    assert extract_vid(expanded_url) == vid
+    assert split_vid(expanded_url) == vid
+
+
+def test_extract_vid_matches_the_split_parser():
+    rng = random.Random(0)
+    prefixes = ['https://www.youtube.com/watch?', 'https://m.youtube.com/watch?', 'https://youtu.be/',
+                'http://youtu.be/x/', 'https://www.youtube.com/embed/', 'https://example.com/', '']
+    alphabet = 'aZ09-_/?=&.#%v'
+    for _ in range(20000):
+        expanded_url = rng.choice(prefixes) + ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert extract_vid(expanded_url) == split_vid(expanded_url), expanded_url
+
+
+def read_outputs(stats_path):
+    outputs = {}
+    for filename in sorted(os.listdir(stats_path)):
+        with bz2.open(os.path.join(stats_path, filename), 'rt', encoding='utf-8') as fin:
+            outputs[filename] = fin.read().splitlines()
+    return outputs
+
+
+def test_pipeline_writes_what_extract_writes(make_extractor):
+    extractor = make_extractor('extract', proc_num=2)
+    pipeline = make_extractor('pipeline', stage_procs=(1, 2, 2), batch_size=3)
+    for file_idx in range(3):
+        lines = []
+        for idx in range(file_idx * 100, file_idx * 100 + 40):
+            lines.append(limit_line(idx) if idx % 9 == 0 else make_tweet(idx, hashtags=('tag{0}'.format(idx % 4),)))
+        write_input(extractor, 'f{0}.bz2'.format(file_idx), lines)
+    extractor.extract()
+    pipeline.extract()
+
+    assert read_outputs(pipeline.tweet_stats_path) == read_outputs(extractor.tweet_stats_path)
+    # a user profile is written by whichever task meets the user first
+    assert sorted(sum(read_outputs(pipeline.user_stats_path).values(), [])) == \
+        sorted(sum(read_outputs(extractor.user_stats_path).values(), []))
+    assert len(Manifest(os.path.join(pipeline.output_dir, 'manifest.jsonl')).entries) == 3
+
+
+def test_files_are_split_for_more_than_one_decompress_process(make_extractor):
+    extractor = make_extractor(stage_procs=(2, 1, 1), chunk_size=1)
+    rng = random.Random(0)
+    # a file of several bz2 blocks
+    write_input(extractor, 'a.bz2', [make_tweet(idx, text=''.join(rng.choice('abcdefghij') for _ in range(2000)))
+                                     for idx in range(1000)])
+    chunks = [chunk for _, chunk in extractor._list_input_tasks()]
+    assert len(chunks) > 1 and all(chunk is not None for chunk in chunks)
+    extractor.set_stage_procs(1, 2, 2)
+    assert [chunk for _, chunk in extractor._list_input_tasks()] == [None]
+
+
+def test_pipeline_discards_a_task_that_fails_to_parse(make_extractor):
+    pipeline = make_extractor(stage_procs=(1, 2, 2), batch_size=3)
+    write_input(pipeline, 'bad.bz2', [make_tweet(idx) for idx in range(10)] + ['{"created_at": broken'] +
+                [make_tweet(idx) for idx in range(10, 20)])
+    write_input(pipeline, 'good.bz2', [make_tweet(idx) for idx in range(20, 30)])
+    pipeline.extract()
+
+    assert sorted(os.listdir(pipeline.tweet_stats_path)) == ['good.bz2']
+    assert sorted(os.listdir(pipeline.user_stats_path)) == ['good.bz2']
+    manifest = Manifest(os.path.join(pipeline.output_dir, 'manifest.jsonl'))
+    assert [entry['path'] for entry in manifest.entries.values()] == [os.path.join(pipeline.input_dir, 'good.bz2')]
@@ -0,0 +1,177 @@
+""" Split a bz2 file at block boundaries, so that blocks can be decompressed independently.
+
+A bz2 stream is 'BZh[1-9]' followed by blocks, each starts with the 48-bit magic 0x314159265359 and a 32-bit block crc,
+and the stream ends with the 48-bit magic 0x177245385090 and a 32-bit stream crc. Blocks are not byte aligned.
+A block is decompressed by shifting its bits into a new single-block stream, whose stream crc equals the block crc.
+"""
+
+import bz2, mmap
+
+BLOCK_MAGIC = 0x314159265359
+EOS_MAGIC = 0x177245385090
+MAGIC_BITS = 48
+# blocks past its own that a chunk carries to complete its last line, a block holds 100k to 900k bytes of text
+TAIL_BLOCKS = 8
+
+
+def _read_bits(data, start_bit, end_bit):
+    """Read bits [start_bit, end_bit) of data as an integer."""
+    first_byte = start_bit // 8
+    last_byte = (end_bit + 7) // 8
+    value = int.from_bytes(data[first_byte:last_byte], 'big')
+    value >>= last_byte * 8 - end_bit
+    return value & ((1 << (end_bit - start_bit)) - 1)
+
+
+def _find_magic(data, magic):
+    """Find bit offsets of a 48-bit magic in data, at any bit alignment."""
+    total_bits = len(data) * 8
+    offsets = []
+    for shift in range(8):
+        # the magic at bit `shift` of byte k spans bytes k..k+6, bytes k+1..k+5 are fully covered
+        pattern = (magic << (8 - shift)).to_bytes(7, 'big')[1:6]
+        pos = data.find(pattern, 1)
+        while pos != -1:
+            bit = (pos - 1) * 8 + shift
+            if bit + MAGIC_BITS <= total_bits and _read_bits(data, bit, bit + MAGIC_BITS) == magic:
+                offsets.append(bit)
+            pos = data.find(pattern, pos + 1)
+    return sorted(offsets)
+
+
+def find_blocks(data):
+    """Return (start_bit, end_bit) of every block in data, a block ends at the next block or end-of-stream magic."""
+    block_offsets = _find_magic(data, BLOCK_MAGIC)
+    boundaries = sorted(block_offsets + _find_magic(data, EOS_MAGIC))
+    block_offsets = set(block_offsets)
+    blocks = []
+    for idx, start_bit in enumerate(boundaries):
+        if start_bit in block_offsets and idx + 1 < len(boundaries):
+            blocks.append((start_bit, boundaries[idx + 1]))
+    return blocks
+
+
+def decompress_block(data, start_bit, end_bit):
+    """Decompress the block at bits [start_bit, end_bit) of data."""
+    num_bits = end_bit - start_bit
+    block = _read_bits(data, start_bit, end_bit)
+    block_crc = (block >> (num_bits - MAGIC_BITS - 32)) & 0xffffffff
+    stream = (block << (MAGIC_BITS + 32)) | (EOS_MAGIC << 32) | block_crc
+    num_bits += MAGIC_BITS + 32
+    padding = -num_bits % 8
+    stream <<= padding
+    return bz2.decompress(b'BZh9' + stream.to_bytes((num_bits + padding) // 8, 'big'))
+
+
+def decompress_blocks(data, blocks, idx, max_merge=4):
+    """Decompress blocks[idx], return the text and the index of next block.
+
+    A block magic can occur by chance inside compressed data, then the real block is cut short and fails to decompress.
+    In that case the block is extended over the following boundaries, up to max_merge blocks.
+    """
+    start_bit = blocks[idx][0]
+    for next_idx in range(idx + 1, min(idx + 1 + max_merge, len(blocks) + 1)):
+        try:
+            return decompress_block(data, start_bit, blocks[next_idx - 1][1]), next_idx
+        except (OSError, ValueError, EOFError):
+            continue
+    raise OSError('Failed to decompress bz2 block at bit {0}'.format(start_bit))
+
+
+class Bz2Chunk(object):
+    """ A chunk of consecutive bz2 blocks, iterated as lines.
+
+    :param filepath: path of the bz2 file
+    :param index: index of the chunk in the file
+    :param blocks: (start_bit, end_bit) of the chunk blocks, followed by up to TAIL_BLOCKS blocks after them
+    :param num_blocks: number of blocks in the chunk, the blocks after them are only read to complete its last line
+    :param num_chunks: number of chunks the file is split into
+    :param ends_file: whether blocks run up to the last block of the file
+
+    A line belongs to the chunk where it starts. Every chunk but the first skips the text up to its first line break,
+    and every chunk but the last reads past its last block up to the next line break.
+    A chunk holds its own blocks and a short tail rather than the blocks of the whole file, as it is pickled into
+    the worker that extracts it. A line that runs past the tail raises OSError.
+    """
+
+    def __init__(self, filepath, index, blocks, num_blocks, num_chunks=1, ends_file=True):
+        self.filepath = filepath
+        self.index = index
+        self.blocks = blocks
+        self.num_blocks = num_blocks
+        self.num_chunks = num_chunks
+        self.ends_file = ends_file
+
+    def __len__(self):
+        """Compressed size of the chunk in bytes."""
+        return (self.blocks[self.num_blocks - 1][1] - self.blocks[0][0]) // 8
+
+    def byte_range(self):
+        """Range [start, end) of the file bytes that the chunk blocks lie in."""
+        return self.blocks[0][0] // 8, (self.blocks[self.num_blocks - 1][1] + 7) // 8
+
+    def bit_range(self):
+        """Range [start_bit, end_bit) of the chunk blocks in the file, which differs once the file is split otherwise."""
+        return self.blocks[0][0], self.blocks[self.num_blocks - 1][1]
+
+    def close(self):
+        """Nothing to close, the file is opened on iteration."""
+        pass
+
+    def _iter_texts(self, data):
+        idx = 0
+        while idx < len(self.blocks):
+            text, next_idx = decompress_blocks(data, self.blocks, idx)
+            yield idx, text
+            idx = next_idx
+
+    def __iter__(self):
+        with open(self.filepath, 'rb') as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            pending = b''
+            skip_first_line = self.index > 0
+            for idx, text in self._iter_texts(data):
+                if idx >= self.num_blocks:
+                    if skip_first_line:
+                        # the chunk lies within a single line
+                        return
+                    # read past the chunk, complete the pending line
+                    pos = text.find(b'\n')
+                    if pos == -1:
+                        pending += text
+                        continue
+                    yield pending + text[:pos]
+                    return
+                if skip_first_line:
+                    pos = text.find(b'\n')
+                    if pos == -1:
+                        continue
+                    text = text[pos + 1:]
+                    skip_first_line = False
+                lines = (pending + text).split(b'\n')
+                pending = lines.pop()
+                for line in lines:
+                    yield line
+            if not self.ends_file:
+                raise OSError('A line of chunk {0} of {1} runs past {2} blocks after the chunk'
+                              .format(self.index, self.filepath, len(self.blocks) - self.num_blocks))
+            if pending:
+                yield pending
+
+
+def split_bz2_file(filepath, chunk_size):
+    """Split a bz2 file into chunks of about chunk_size compressed bytes."""
+    with open(filepath, 'rb') as fin, mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        blocks = find_blocks(data)
+
+    block_ranges = []
+    start = 0
+    chunk_bits = 0
+    for idx, (start_bit, end_bit) in enumerate(blocks):
+        chunk_bits += end_bit - start_bit
+        if chunk_bits >= chunk_size * 8 or idx == len(blocks) - 1:
+            block_ranges.append((start, idx + 1))
+            start = idx + 1
+            chunk_bits = 0
+    return [Bz2Chunk(filepath, chunk_idx, blocks[start:end + TAIL_BLOCKS], end - start, len(block_ranges),
+                     end + TAIL_BLOCKS >= len(blocks))
+            for chunk_idx, (start, end) in enumerate(block_ranges)]
@@ -0,0 +1,119 @@
+""" Compression codecs of intermediate files, told apart by the file extension.
+
+bz2:  .bz2, the default of tweet status files, small but slow to compress and decompress.
+zstd: .zst, nearly as small as bz2 and many times faster, for archives.
+lz4:  .lz4, larger but the fastest, for scratch stages.
+gzip: .gz, standard library.
+none: no extension, plain text.
+
+All codecs support concatenated streams, so compressed files can be merged by copying bytes, see concat_files().
+"""
+
+import os, io, bz2, gzip, shutil
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODEC_EXTENSIONS = {'bz2': '.bz2', 'zstd': '.zst', 'lz4': '.lz4', 'gzip': '.gz', 'none': ''}
+CODECS = tuple(CODEC_EXTENSIONS.keys())
+
+
+def codec_of(path):
+    """Detect the codec of a file from its extension, 'none' for an unknown extension."""
+    for codec, extension in CODEC_EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return codec
+    return 'none'
+
+
+def strip_codec(path):
+    """Remove the codec extension from a path."""
+    extension = CODEC_EXTENSIONS[codec_of(path)]
+    if extension:
+        return path[:-len(extension)]
+    return path
+
+
+def with_codec(path, codec):
+    """Append the extension of codec to a path without codec extension."""
+    if codec not in CODEC_EXTENSIONS:
+        raise ValueError('Unknown codec {0}, choose from {1}'.format(codec, CODECS))
+    return '{0}{1}'.format(path, CODEC_EXTENSIONS[codec])
+
+
+def resolve_path(path):
+    """Find the existing file of a path under any codec, e.g., user_app_all.txt may be stored as user_app_all.txt.zst.
+    Return path itself if no such file exists."""
+    if os.path.exists(path):
+        return path
+    base_path = strip_codec(path)
+    for codec in CODECS:
+        candidate = with_codec(base_path, codec)
+        if os.path.exists(candidate):
+            return candidate
+    return path
+
+
+def _check_installed(codec):
+    if codec == 'zstd' and zstandard is None:
+        raise ImportError('zstandard is required for zstd files, pip install zstandard')
+    if codec == 'lz4' and lz4 is None:
+        raise ImportError('lz4 is required for lz4 files, pip install lz4')
+
+
+def _open_zstd(path, mode, level):
+    if 'r' in mode:
+        # read every frame, a concatenated file has one frame per part
+        reader = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader)
+    return zstandard.ZstdCompressor(level=level).stream_writer(open(path, mode[0] + 'b'), closefd=True)
+
+
+def open_file(path, mode='r', encoding='utf-8', codec=None, level=None):
+    """Open a file of any codec in text or binary mode, the codec is detected from the file extension.
+    In read mode, a path whose file does not exist is resolved to the file under another codec.
+
+    :param path: file path
+    :param mode: 'r', 'w', 'a' for text, 'rb', 'wb', 'ab' for binary
+    :param encoding: text encoding, ignored in binary mode
+    :param codec: codec of the file, None to detect from the extension, e.g., for a temporary file
+    :param level: compression level, None for the codec default
+    """
+    if codec is None:
+        if 'r' in mode:
+            path = resolve_path(path)
+        codec = codec_of(path)
+    _check_installed(codec)
+    binary_mode = mode.replace('t', '').replace('b', '') + 'b'
+
+    if codec == 'bz2':
+        fileobj = bz2.open(path, binary_mode, compresslevel=9 if level is None else level)
+    elif codec == 'gzip':
+        fileobj = gzip.open(path, binary_mode, compresslevel=9 if level is None else level)
+    elif codec == 'zstd':
+        fileobj = _open_zstd(path, binary_mode, 3 if level is None else level)
+    elif codec == 'lz4':
+        fileobj = lz4.frame.open(path, binary_mode, compression_level=0 if level is None else level)
+    else:
+        return open(path, mode, encoding=None if 'b' in mode else encoding)
+
+    if 'b' in mode:
+        return fileobj
+    return io.TextIOWrapper(fileobj, encoding=encoding)
+
+
+def concat_files(input_paths, output_path, buffer_size=16 * 1024 * 1024):
+    """Concatenate files of the same codec into one at the byte level, without recompression.
+    The output is written into a temporary file, which is renamed to output_path."""
+    with open('{0}.tmp'.format(output_path), 'wb') as fout:
+        for input_path in input_paths:
+            with open(input_path, 'rb') as fin:
+                shutil.copyfileobj(fin, fout, buffer_size)
+    os.replace('{0}.tmp'.format(output_path), output_path)
@@ -0,0 +1,124 @@
+""" Deduplication of a nearly time-ordered stream of lines in bounded memory.
+
+Lines that are duplicates of each other carry the same timestamp, e.g., the timestamp_ms or snowflake id
+of a tweet, and a time-ordered merge of sub-crawler files puts them close to each other.
+Seen lines are kept in buckets by their timestamp, and the buckets that fall behind the latest timestamp
+by more than the window plus a safety margin are evicted, so memory depends on the window, not on the crawl length.
+Evicted buckets are spilled into a temporary file with an index of bucket offsets, and a line older than
+the evicted buckets, a late line, is checked against the spilled lines of its bucket and all earlier late lines.
+Late lines are rare, so deduplication stays exact at the cost of writing every line to disk once.
+"""
+
+import tempfile
+from array import array
+from bisect import bisect_left
+
+
+class WindowDeduplicator(object):
+    """ Time Window Deduplicator Class.
+
+    :param window_ms: time span in milliseconds within which lines are expected out of order
+    :param margin_ms: extra time in milliseconds that seen lines are kept beyond the window
+    :param bucket_ms: time span of a bucket of seen lines, the unit of eviction
+    :param tmp_dir: directory of the spill file of evicted buckets, None for the system temporary directory
+
+    A straggler within the margin is still checked against the buckets in memory, but counted in num_stragglers,
+    a line beyond the window and the margin is counted in num_late, and checked against the spill file,
+    so the window can be tuned by both counts. Every late line is kept in memory, as it is rare.
+    Lines are compared without a trailing line break, and have no other line break.
+    """
+
+    def __init__(self, window_ms=60000, margin_ms=60000, bucket_ms=1000, tmp_dir=None):
+        self.window_ms = window_ms
+        self.margin_ms = margin_ms
+        self.bucket_ms = bucket_ms
+        self.tmp_dir = tmp_dir
+        self.buckets = {}
+        self.latest_ms = None
+        # buckets below this one have been evicted
+        self.evicted_bucket = None
+        self.late_items = set()
+        # evicted buckets in ascending order, and the byte offsets of their lines in the spill file
+        self.spill = None
+        self.spilled_buckets = array('q')
+        self.spilled_offsets = array('q', [0])
+        # the spilled bucket read last, late lines of the same bucket tend to come together
+        self.loaded_bucket = None
+        self.loaded_items = None
+        self.num_stragglers = 0
+        self.num_late = 0
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values()) + len(self.late_items)
+
+    def add(self, item, timestamp_ms):
+        """Add a line with its timestamp, return True if the line is new, False if it is a duplicate."""
+        bucket = timestamp_ms // self.bucket_ms
+        if self.latest_ms is None:
+            self.latest_ms = timestamp_ms
+            self.evicted_bucket = (timestamp_ms - self.window_ms - self.margin_ms) // self.bucket_ms
+        elif timestamp_ms > self.latest_ms:
+            self.latest_ms = timestamp_ms
+            self._evict()
+        elif timestamp_ms < self.latest_ms - self.window_ms:
+            self.num_stragglers += 1
+
+        if bucket < self.evicted_bucket:
+            # a duplicate of a late line is late too, as its bucket stays evicted
+            self.num_late += 1
+            if item in self.late_items or self._is_spilled(item, bucket):
+                return False
+            self.late_items.add(item)
+            return True
+
+        seen_items = self.buckets.get(bucket)
+        if seen_items is None:
+            seen_items = set()
+            self.buckets[bucket] = seen_items
+        elif item in seen_items:
+            return False
+        seen_items.add(item)
+        return True
+
+    def _evict(self):
+        cutoff_bucket = (self.latest_ms - self.window_ms - self.margin_ms) // self.bucket_ms
+        if cutoff_bucket <= self.evicted_bucket:
+            return
+        if cutoff_bucket - self.evicted_bucket > len(self.buckets):
+            # a long gap in time, scan the buckets instead of the bucket range
+            evicted_buckets = sorted([bucket for bucket in self.buckets if bucket < cutoff_bucket])
+        else:
+            evicted_buckets = [bucket for bucket in range(self.evicted_bucket, cutoff_bucket) if bucket in self.buckets]
+        for bucket in evicted_buckets:
+            self._spill_bucket(bucket, self.buckets.pop(bucket))
+        self.evicted_bucket = cutoff_bucket
+
+    def _spill_bucket(self, bucket, items):
+        if self.spill is None:
+            self.spill = tempfile.TemporaryFile(prefix='dedup_', dir=self.tmp_dir)
+        self.spill.write(''.join(['{0}\n'.format(item.rstrip('\n')) for item in items]).encode('utf-8'))
+        self.spilled_buckets.append(bucket)
+        self.spilled_offsets.append(self.spill.tell())
+
+    def _is_spilled(self, item, bucket):
+        """Check whether a line is among the spilled lines of its bucket."""
+        if bucket != self.loaded_bucket:
+            idx = bisect_left(self.spilled_buckets, bucket)
+            if idx == len(self.spilled_buckets) or self.spilled_buckets[idx] != bucket:
+                return False
+            start, end = self.spilled_offsets[idx], self.spilled_offsets[idx + 1]
+            self.spill.seek(start)
+            self.loaded_items = set(self.spill.read(end - start).decode('utf-8').split('\n')[:-1])
+            self.loaded_bucket = bucket
+            self.spill.seek(0, 2)
+        return item.rstrip('\n') in self.loaded_items
+
+    def close(self):
+        """Remove the spill file and drop all seen lines."""
+        if self.spill is not None:
+            self.spill.close()
+        self.spill = None
+        self.buckets = {}
+        self.late_items = set()
+        self.loaded_bucket = None
+        self.loaded_items = None
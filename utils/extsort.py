@@ -0,0 +1,118 @@
+""" External memory sort of (key, value) text records.
+
+Records are buffered in memory up to a budget of bytes, then sorted and spilled into a run file.
+Sorted records are read back by a k-way merge of the runs with heapq.merge, so that memory is bounded by the budget
+and one line per run. Values are strings, keys are strings or integers, e.g., int64 tweet ids that sort numerically.
+A key has no comma, neither has a line break.
+"""
+
+import os, heapq, shutil, tempfile
+from itertools import groupby
+from operator import itemgetter
+
+from utils.codec import CODEC_EXTENSIONS, open_file
+
+# approximate bytes of a buffered (key, value) tuple besides the characters of its value
+RECORD_OVERHEAD = 180
+
+
+class ExternalSorter(object):
+    """ External Memory Sorter Class.
+
+    :param memory_budget: approximate bytes of buffered records, a run is spilled once they exceed it
+    :param tmp_dir: directory to create the run directory in, None for the system temporary directory
+    :param codec: codec of run files, see utils/codec.py
+    :param max_runs: number of runs that are merged into one, to bound the number of files open at once
+    :param key_type: type of keys, str or int, keys are converted back from run files by it
+
+    Records of the same key come out in the order they are added, so that the caller can keep the first value,
+    see first_values(), or combine all of them, see groups().
+    """
+
+    def __init__(self, memory_budget=1 << 28, tmp_dir=None, codec='none', max_runs=256, key_type=str):
+        self.memory_budget = memory_budget
+        self.key_type = key_type
+        self.tmp_dir = tmp_dir
+        self.codec = codec
+        self.max_runs = max_runs
+        self.run_dir = None
+        self.run_paths = []
+        self.num_runs = 0
+        self.buffer = []
+        self.buffer_size = 0
+        self.num_records = 0
+
+    def __len__(self):
+        return self.num_records
+
+    def add(self, key, value):
+        self.buffer.append((key, value))
+        self.buffer_size += len(value) + RECORD_OVERHEAD
+        self.num_records += 1
+        if self.buffer_size >= self.memory_budget:
+            self._spill()
+
+    def _new_run_path(self):
+        if self.run_dir is None:
+            self.run_dir = tempfile.mkdtemp(prefix='extsort_', dir=self.tmp_dir)
+        run_path = os.path.join(self.run_dir, 'run_{0}.txt{1}'.format(self.num_runs, CODEC_EXTENSIONS[self.codec]))
+        self.num_runs += 1
+        return run_path
+
+    def _write_run(self, records):
+        run_path = self._new_run_path()
+        with open_file(run_path, 'w', encoding='utf-8', codec=self.codec) as fout:
+            for key, value in records:
+                fout.write('{0},{1}\n'.format(key, value))
+        return run_path
+
+    def _read_run(self, run_path):
+        key_type = self.key_type
+        with open_file(run_path, 'r', encoding='utf-8', codec=self.codec) as fin:
+            for line in fin:
+                key, value = line.rstrip('\n').split(',', 1)
+                yield key_type(key), value
+
+    def _spill(self):
+        # sort is stable, records of the same key stay in the order of adding
+        self.buffer.sort(key=itemgetter(0))
+        self.run_paths.append(self._write_run(self.buffer))
+        self.buffer = []
+        self.buffer_size = 0
+        if len(self.run_paths) >= self.max_runs:
+            self._merge_runs()
+
+    def _merge_runs(self):
+        """Merge all runs into one."""
+        run_path = self._write_run(heapq.merge(*[self._read_run(path) for path in self.run_paths], key=itemgetter(0)))
+        for path in self.run_paths:
+            os.remove(path)
+        self.run_paths = [run_path]
+
+    def __iter__(self):
+        """Yield (key, value) in key order, records of the same key in the order of adding."""
+        self.buffer.sort(key=itemgetter(0))
+        if len(self.run_paths) == 0:
+            return iter(self.buffer)
+        # heapq.merge is stable, ties are yielded in the order of runs, and the buffer is the latest run
+        return heapq.merge(*[self._read_run(path) for path in self.run_paths], iter(self.buffer), key=itemgetter(0))
+
+    def groups(self):
+        """Yield (key, [values]) in key order, values in the order of adding."""
+        for key, records in groupby(self, key=itemgetter(0)):
+            yield key, [value for _, value in records]
+
+    def first_values(self):
+        """Yield (key, value) in key order, the value first added for each key, later values of a key are skipped."""
+        for key, values in self.groups():
+            yield key, values[0]
+
+    def close(self):
+        """Drop all records and remove run files."""
+        if self.run_dir is not None:
+            shutil.rmtree(self.run_dir, ignore_errors=True)
+        self.run_dir = None
+        self.run_paths = []
+        self.buffer = []
+        self.buffer_size = 0
+        self.num_records = 0
@@ -0,0 +1,103 @@
+""" A set of positive int64 ids in shared memory, for processes forked after it is created.
+
+The set is an open addressing hash table of int64 slots in a RawArray, 8 bytes per slot rather than ~100 bytes per id
+in a python set of strings. The table is split into segments, each guarded by its own lock, and lookups take no lock.
+"""
+
+import ctypes
+from multiprocessing import Lock
+from multiprocessing.sharedctypes import RawArray
+
+EMPTY_SLOT = 0
+# a slot of a discarded id, skipped by lookups and reused by adds, ids are positive
+DISCARDED_SLOT = -1
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+HASH_MASK = (1 << 64) - 1
+
+
+class SharedIdSet(object):
+    """ Shared Id Set Class.
+
+    :param capacity: total number of slots, ids beyond max_load of a segment are not stored
+    :param num_segments: number of segments, each with its own lock
+    :param max_load: fraction of slots in a segment that can be filled
+
+    Once a segment is full, an id that is not in it is reported as new on every add, the caller should tolerate
+    repeated ids then, e.g., by a later dedup pass.
+    """
+
+    def __init__(self, capacity=1 << 24, num_segments=64, max_load=0.75):
+        self.num_segments = num_segments
+        self.segment_capacity = max(capacity // num_segments, 1)
+        self.max_size = int(self.segment_capacity * max_load)
+        self.slots = RawArray(ctypes.c_int64, self.segment_capacity * num_segments)
+        self.sizes = RawArray(ctypes.c_int64, num_segments)
+        # discarded slots still end no probe path, so they count towards the load of a segment
+        self.discarded = RawArray(ctypes.c_int64, num_segments)
+        self.locks = [Lock() for _ in range(num_segments)]
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def _locate(self, value):
+        hashed = (value * HASH_MULTIPLIER) & HASH_MASK
+        segment = hashed % self.num_segments
+        return segment, segment * self.segment_capacity, (hashed // self.num_segments) % self.segment_capacity
+
+    def _probe(self, value, base, offset):
+        """Return the slot index that holds value, or else the first discarded or empty slot on its probe path."""
+        slots = self.slots
+        capacity = self.segment_capacity
+        free_idx = None
+        for _ in range(capacity):
+            slot = slots[base + offset]
+            if slot == value:
+                return base + offset
+            if slot == EMPTY_SLOT:
+                return base + offset if free_idx is None else free_idx
+            if slot == DISCARDED_SLOT and free_idx is None:
+                free_idx = base + offset
+            offset += 1
+            if offset == capacity:
+                offset = 0
+        return free_idx
+
+    def __contains__(self, value):
+        _, base, offset = self._locate(value)
+        idx = self._probe(value, base, offset)
+        return idx is not None and self.slots[idx] == value
+
+    def add(self, value):
+        """Add a positive id, return True if it was not in the set."""
+        segment, base, offset = self._locate(value)
+        idx = self._probe(value, base, offset)
+        if idx is not None and self.slots[idx] == value:
+            return False
+        with self.locks[segment]:
+            # another process may have filled the slot since the lock-free probe
+            idx = self._probe(value, base, offset)
+            if idx is not None and self.slots[idx] == value:
+                return False
+            if idx is None:
+                return True
+            if self.slots[idx] == DISCARDED_SLOT:
+                self.discarded[segment] -= 1
+            elif self.sizes[segment] + self.discarded[segment] >= self.max_size:
+                return True
+            self.slots[idx] = value
+            self.sizes[segment] += 1
+        return True
+
+    def discard(self, value):
+        """Remove a positive id if it is in the set, e.g., an id added by a task that failed."""
+        segment, base, offset = self._locate(value)
+        with self.locks[segment]:
+            idx = self._probe(value, base, offset)
+            if idx is not None and self.slots[idx] == value:
+                self.slots[idx] = DISCARDED_SLOT
+                self.sizes[segment] -= 1
+                self.discarded[segment] += 1
+
+    def is_full(self):
+        """Check whether any segment is full."""
+        return any(size + discarded >= self.max_size for size, discarded in zip(self.sizes, self.discarded))
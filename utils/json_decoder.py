@@ -0,0 +1,63 @@
+""" Pluggable JSON decoder, use the fastest installed backend and fall back to the standard library.
+
+simdjson: parse into lazy objects, a field is only materialized into python object when it is accessed.
+orjson:   parse into python dict, several times faster than json.
+json:     the standard library.
+"""
+
+import json
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKENDS = ('simdjson', 'orjson', 'json')
+
+
+def available_backends():
+    """List installed backends, from the fastest to the slowest."""
+    installed = {'simdjson': simdjson is not None, 'orjson': orjson is not None, 'json': True}
+    return [backend for backend in JSON_BACKENDS if installed[backend]]
+
+
+class JsonDecoder(object):
+    """ JSON Decoder Class.
+
+    :param backend: one of 'auto', 'simdjson', 'orjson' and 'json', 'auto' picks the fastest installed backend
+
+    With simdjson, the decoded object is only valid until the line after next is decoded,
+    a caller should not keep the decoded objects of earlier lines.
+    """
+
+    def __init__(self, backend='auto'):
+        if backend == 'auto':
+            backend = available_backends()[0]
+        elif backend not in available_backends():
+            raise ValueError('JSON backend {0} is not installed, choose from {1}'.format(backend, available_backends()))
+        self.backend = backend
+
+        if backend == 'simdjson':
+            # a simdjson parser cannot be reused while objects of its last document are alive,
+            # so alternate between two parsers, the caller still holds the objects of the last line
+            self._parsers = [simdjson.Parser(), simdjson.Parser()]
+            self._parser_idx = 0
+            self.loads = self._simdjson_loads
+        elif backend == 'orjson':
+            self.loads = orjson.loads
+        else:
+            self.loads = json.loads
+
+    def _simdjson_loads(self, line):
+        self._parser_idx ^= 1
+        try:
+            return self._parsers[self._parser_idx].parse(line)
+        except RuntimeError:
+            # objects of an earlier document are still alive, parse with a fresh parser
+            self._parsers[self._parser_idx] = simdjson.Parser()
+            return self._parsers[self._parser_idx].parse(line)
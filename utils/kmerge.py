@@ -0,0 +1,96 @@
+""" K-way merge of sorted text files.
+
+Each input is read in blocks of lines, and each line is parsed once into a (key, record) pair, e.g.,
+a leading tweet id or timestamp_ms as an integer. The head record of every input is kept in a heap by its key,
+so each merged record costs O(log k) comparisons for k inputs, instead of a scan over all heads.
+Records of the same key come out in input order, as heapq.merge would yield them.
+"""
+
+import os, io, heapq
+from itertools import groupby
+from operator import itemgetter
+
+from utils.codec import codec_of, open_file, resolve_path
+
+# approximate bytes of lines read from an input at a time
+BLOCK_SIZE = 1 << 16
+
+
+def read_blocks(fin, block_size=BLOCK_SIZE):
+    """Yield lines of an open text file, read in blocks of about block_size bytes. Blank lines are skipped."""
+    while True:
+        lines = fin.readlines(block_size)
+        if not lines:
+            return
+        for line in lines:
+            if line.rstrip() != '':
+                yield line
+
+
+def seek_head(fin, head):
+    """Seek a binary file of lines sorted by a leading integer, e.g., a tweet id, to the first line whose leading
+    integer is at least head, by a binary search over byte offsets."""
+    lo, hi = 0, os.fstat(fin.fileno()).st_size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        # the first line that starts at or after mid
+        fin.seek(mid - 1 if mid > 0 else 0)
+        if mid > 0:
+            fin.readline()
+        line = fin.readline()
+        if line.strip() and int(line.split(b',', 1)[0]) < head:
+            lo = mid + 1
+        else:
+            hi = mid
+    fin.seek(lo - 1 if lo > 0 else 0)
+    if lo > 0:
+        fin.readline()
+
+
+def open_from(path, head=None, encoding='utf-8'):
+    """Open a text file of lines sorted by a leading integer, positioned at the first line whose leading integer
+    is at least head. A compressed file cannot seek, it is read from the start and the caller skips earlier lines."""
+    path = resolve_path(path)
+    if head is None or codec_of(path) != 'none':
+        return open_file(path, 'r', encoding=encoding)
+    fin = open(path, 'rb')
+    seek_head(fin, head)
+    return io.TextIOWrapper(fin, encoding=encoding)
+
+
+def kway_merge(inputs, parse, block_size=BLOCK_SIZE):
+    """Merge open text files that are sorted by the key of parse(line), yield (key, input index, record).
+
+    :param inputs: open text files, or any objects with readlines(hint)
+    :param parse: function of a line that returns (key, record), keys of an input are in ascending order
+    :param block_size: approximate bytes of lines read from an input at a time
+    """
+    heap = []
+    for idx, fin in enumerate(inputs):
+        records = map(parse, read_blocks(fin, block_size))
+        for key, record in records:
+            # the input index breaks ties of keys, so records are never compared
+            heap.append((key, idx, record, records))
+            break
+    heapq.heapify(heap)
+
+    while len(heap) > 1:
+        key, idx, record, records = heap[0]
+        yield key, idx, record
+        for next_key, next_record in records:
+            heapq.heapreplace(heap, (next_key, idx, next_record, records))
+            break
+        else:
+            heapq.heappop(heap)
+
+    if heap:
+        key, idx, record, records = heap[0]
+        yield key, idx, record
+        for key, record in records:
+            yield key, idx, record
+
+
+def kway_merge_groups(inputs, parse, block_size=BLOCK_SIZE):
+    """Merge sorted text files as kway_merge(), yield (key, [(input index, record)]) of records of the same key."""
+    for key, items in groupby(kway_merge(inputs, parse, block_size), key=itemgetter(0)):
+        yield key, [(idx, record) for _, idx, record in items]
@@ -0,0 +1,135 @@
+""" Manifest of processed input files, so that an interrupted run can resume.
+
+Each completed task appends a json line: path, chunk index, number of chunks, bit range of the chunk, file size,
+file mtime, adler32 checksum of the bytes the task covers, the output paths of the task, and the output configuration
+of the run, e.g., codec and fields. A task is marked done only after its outputs are in place, and it stays done only
+while they are. A chunk is identified by its bit range as well as its index, so that a chunk of another split, e.g.,
+after chunk_size or proc_num changes, is not taken for a done one. Tasks done under another output configuration are
+all forgotten, their outputs differ from what this run writes.
+"""
+
+import os, json, zlib
+
+
+def file_signature(filepath):
+    """Return (size, mtime_ns) of a file."""
+    stat = os.stat(filepath)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def checksum(filepath, start=0, end=None, block_size=1 << 20):
+    """Adler32 checksum of bytes [start, end) of a file, in hex."""
+    value = 1
+    with open(filepath, 'rb') as fin:
+        fin.seek(start)
+        remaining = None if end is None else end - start
+        while remaining is None or remaining > 0:
+            data = fin.read(block_size if remaining is None else min(block_size, remaining))
+            if not data:
+                break
+            value = zlib.adler32(data, value)
+            if remaining is not None:
+                remaining -= len(data)
+    return '{0:08x}'.format(value)
+
+
+class Manifest(object):
+    """ Processed File Manifest Class.
+
+    :param path: path of the manifest file, in json lines
+    :param lock: a multiprocessing lock shared by processes that mark tasks done
+    """
+
+    def __init__(self, path, lock=None):
+        self.path = path
+        self.lock = lock
+        self.config = None
+        self.load()
+
+    def load(self):
+        """Read the entries of the manifest file, e.g., again once worker processes have marked tasks done."""
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # a partial line from an interrupted write
+                        continue
+                    self.entries[(entry['path'], entry['chunk'])] = entry
+
+    def reset(self):
+        """Forget all processed files."""
+        self.entries = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def set_config(self, config):
+        """Set the output configuration of the tasks marked done from now on, a json serializable dict.
+        If a task was done under another configuration, forget all tasks and return True."""
+        # compared as read back from json, e.g., tuples are lists
+        self.config = json.loads(json.dumps(config))
+        if any(entry.get('config') != self.config for entry in self.entries.values()):
+            self.reset()
+            return True
+        return False
+
+    @staticmethod
+    def _outputs_exist(entry):
+        return all(os.path.exists(output_path) for output_path in entry.get('outputs', ()))
+
+    def file_entries(self, filepath):
+        """Return the entries of a file, in chunk order."""
+        entries = [entry for (path, _), entry in self.entries.items() if path == filepath]
+        return sorted(entries, key=lambda entry: -1 if entry['chunk'] is None else entry['chunk'])
+
+    def is_file_done(self, filepath):
+        """Check whether all tasks of a file are done under one split, and the file has not changed since.
+        The chunks of a split are consecutive, each starts at the bit where the one before it ends."""
+        entries = self.file_entries(filepath)
+        if len(entries) == 0 or any(entry['num_chunks'] != len(entries) for entry in entries):
+            return False
+        if len(entries) > 1:
+            bit_ranges = [entry.get('bit_range') for entry in entries]
+            if None in bit_ranges or any(bit_ranges[idx][1] != bit_ranges[idx + 1][0] for idx in range(len(entries) - 1)):
+                return False
+        if not all(self._outputs_exist(entry) for entry in entries):
+            return False
+        size, mtime = file_signature(filepath)
+        return all(entry['size'] == size and entry['mtime'] == mtime for entry in entries)
+
+    def is_done(self, filepath, chunk=None, start=0, end=None, bit_range=None):
+        """Check whether a task is done. The file may be touched since, then it is compared by checksum.
+        A chunk is done only if it covered the same bit range, bit_range is None for a whole file.
+        A task whose outputs have been removed since is not done."""
+        entry = self.entries.get((filepath, chunk))
+        if entry is None:
+            return False
+        if entry.get('bit_range') != (None if bit_range is None else list(bit_range)):
+            return False
+        if not self._outputs_exist(entry):
+            return False
+        size, mtime = file_signature(filepath)
+        if entry['size'] != size:
+            return False
+        return entry['mtime'] == mtime or entry['checksum'] == checksum(filepath, start, end)
+
+    def mark_done(self, filepath, chunk=None, num_chunks=1, start=0, end=None, bit_range=None, outputs=()):
+        """Append a completed task to the manifest, outputs are the paths of the files it wrote."""
+        size, mtime = file_signature(filepath)
+        entry = {'path': filepath, 'chunk': chunk, 'num_chunks': num_chunks,
+                 'bit_range': None if bit_range is None else list(bit_range), 'size': size, 'mtime': mtime,
+                 'checksum': checksum(filepath, start, end), 'outputs': list(outputs), 'config': self.config}
+        line = json.dumps(entry) + '\n'
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            with open(self.path, 'a') as fout:
+                fout.write(line)
+                fout.flush()
+                os.fsync(fout.fileno())
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+        self.entries[(filepath, chunk)] = entry
@@ -0,0 +1,242 @@
+""" Time-partitioned layout of entity files.
+
+A partitioned file, e.g., ts_youtube_all.txt, is a directory ts_youtube_all/ of one file per hour or day,
+named by the partition key, e.g., 2019-11-06.txt, and an index.json of the granularity, the codec,
+and per partition its file name, number of lines, and min and max timestamp in milliseconds.
+Readers list the partitions that overlap a time range from the index, without opening the others,
+and can process partitions in parallel, see map_partitions().
+Readers fall back to the flat file if there is no partition index, so both layouts can be read the same way.
+"""
+
+import os, json, shutil
+from datetime import datetime, timezone
+from multiprocessing import Pool
+
+from utils.codec import CODEC_EXTENSIONS, open_file, strip_codec
+
+PARTITION_GRANULARITIES = {'hour': ('%Y-%m-%d-%H', 3600000), 'day': ('%Y-%m-%d', 86400000)}
+INDEX_FILENAME = 'index.json'
+
+
+def partition_dir(path):
+    """Directory of the partitioned layout of a flat file path, the codec and .txt extensions are removed."""
+    path = strip_codec(path)
+    if path.endswith('.txt'):
+        path = path[:-len('.txt')]
+    return path
+
+
+def partition_key(timestamp_ms, granularity='day'):
+    """Partition key of a timestamp in milliseconds, in UTC, e.g., 2019-11-06 by day or 2019-11-06-13 by hour."""
+    if granularity not in PARTITION_GRANULARITIES:
+        raise ValueError('Unknown granularity {0}, choose from {1}'.format(granularity, tuple(PARTITION_GRANULARITIES)))
+    key_format, _ = PARTITION_GRANULARITIES[granularity]
+    return datetime.fromtimestamp(int(timestamp_ms) // 1000, tz=timezone.utc).strftime(key_format)
+
+
+def load_partition_index(path):
+    """Load the partition index of a flat file path, None if the file is not partitioned."""
+    index_path = os.path.join(partition_dir(path), INDEX_FILENAME)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as fin:
+        return json.load(fin)
+
+
+def _overlaps(entry, start_ms, end_ms):
+    return (start_ms is None or entry['end_ms'] >= start_ms) and (end_ms is None or entry['start_ms'] < end_ms)
+
+
+def list_partitions(path, start_ms=None, end_ms=None):
+    """Return [(key, partition path)] in key order, of partitions that have lines in [start_ms, end_ms).
+    None for either bound leaves the range open on that side. Return None if the file is not partitioned."""
+    index = load_partition_index(path)
+    if index is None:
+        return None
+    directory = partition_dir(path)
+    return [(key, os.path.join(directory, entry['path'])) for key, entry in sorted(index['partitions'].items())
+            if _overlaps(entry, start_ms, end_ms)]
+
+
+class PartitionWriter(object):
+    """ Time Partitioned File Writer Class.
+
+    :param path: flat file path, partitions are written into the directory of partition_dir(path)
+    :param granularity: 'hour' or 'day'
+    :param codec: codec of partition files, see utils/codec.py
+
+    Lines are expected in about time order, a partition that is left is reopened in append mode on a later line.
+    Partitions are written into a temporary directory, which replaces the partition directory on close.
+    """
+
+    def __init__(self, path, granularity='day', codec='none'):
+        if granularity not in PARTITION_GRANULARITIES:
+            raise ValueError('Unknown granularity {0}, choose from {1}'.format(granularity, tuple(PARTITION_GRANULARITIES)))
+        self.directory = partition_dir(path)
+        self.tmp_directory = '{0}.tmp'.format(self.directory)
+        self.granularity = granularity
+        self.codec = codec
+        self.bucket_ms = PARTITION_GRANULARITIES[granularity][1]
+        self.partitions = {}
+        self.bucket = None
+        self.entry = None
+        self.output = None
+        if os.path.exists(self.tmp_directory):
+            shutil.rmtree(self.tmp_directory)
+        os.makedirs(self.tmp_directory)
+
+    def _switch(self, timestamp_ms):
+        if self.output is not None:
+            self.output.close()
+        key = partition_key(timestamp_ms, self.granularity)
+        self.entry = self.partitions.get(key)
+        if self.entry is None:
+            self.entry = {'path': '{0}.txt{1}'.format(key, CODEC_EXTENSIONS[self.codec]),
+                          'lines': 0, 'start_ms': timestamp_ms, 'end_ms': timestamp_ms}
+            self.partitions[key] = self.entry
+            mode = 'w'
+        else:
+            mode = 'a'
+        self.output = open_file(os.path.join(self.tmp_directory, self.entry['path']), mode, encoding='utf-8', codec=self.codec)
+        self.bucket = timestamp_ms // self.bucket_ms
+
+    def write(self, timestamp_ms, line):
+        """Write a line, with its line break, into the partition of timestamp_ms."""
+        timestamp_ms = int(timestamp_ms)
+        if timestamp_ms // self.bucket_ms != self.bucket:
+            self._switch(timestamp_ms)
+        self.output.write(line)
+        entry = self.entry
+        entry['lines'] += 1
+        if timestamp_ms < entry['start_ms']:
+            entry['start_ms'] = timestamp_ms
+        elif timestamp_ms > entry['end_ms']:
+            entry['end_ms'] = timestamp_ms
+
+    def close(self):
+        if self.output is not None:
+            self.output.close()
+        with open(os.path.join(self.tmp_directory, INDEX_FILENAME), 'w') as fout:
+            json.dump({'granularity': self.granularity, 'codec': self.codec, 'partitions': self.partitions},
+                      fout, indent=1, sort_keys=True)
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.replace(self.tmp_directory, self.directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class PartitionedFile(object):
+    """ Partitioned File Reader Class, reads the lines of partitions in key order as one text file.
+
+    :param partition_paths: paths of partition files in key order
+    :param encoding: text encoding
+    """
+
+    def __init__(self, partition_paths, encoding='utf-8'):
+        self.partition_paths = list(partition_paths)
+        self.encoding = encoding
+        self.idx = 0
+        self.input = None
+
+    def readline(self):
+        while True:
+            if self.input is None:
+                if self.idx == len(self.partition_paths):
+                    return ''
+                self.input = open_file(self.partition_paths[self.idx], 'r', encoding=self.encoding)
+                self.idx += 1
+            line = self.input.readline()
+            if line:
+                return line
+            self.input.close()
+            self.input = None
+
+    def readlines(self, hint=-1):
+        """Read lines of about hint bytes from the current partition, or all lines if hint <= 0."""
+        lines = []
+        while hint <= 0 or len(lines) == 0:
+            if self.input is None:
+                if self.idx == len(self.partition_paths):
+                    break
+                self.input = open_file(self.partition_paths[self.idx], 'r', encoding=self.encoding)
+                self.idx += 1
+            block = self.input.readlines(hint)
+            if not block:
+                self.input.close()
+                self.input = None
+            lines.extend(block)
+        return lines
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def close(self):
+        if self.input is not None:
+            self.input.close()
+            self.input = None
+        self.idx = len(self.partition_paths)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_partitioned(path, encoding='utf-8', start_ms=None, end_ms=None):
+    """Open a flat file or its partitioned layout for reading as text.
+    Partitions outside [start_ms, end_ms) are skipped. Partitions are coarse and a flat file is read in full,
+    so callers still filter lines by time."""
+    partitions = list_partitions(path, start_ms, end_ms)
+    if partitions is None:
+        return open_file(path, 'r', encoding=encoding)
+    return PartitionedFile([partition_path for _, partition_path in partitions], encoding=encoding)
+
+
+def read_lines(path, encoding='utf-8'):
+    """Yield lines of a file, nothing if path is None, e.g., for a partition that a file does not have."""
+    if path is None:
+        return
+    with open_file(path, 'r', encoding=encoding) as fin:
+        for line in fin:
+            yield line
+
+
+def map_partitions(func, paths, start_ms=None, end_ms=None, proc_num=1):
+    """Apply func to aligned partitions of files, yield the results in key order.
+
+    func is called with one path per file in paths, for every partition key in [start_ms, end_ms) of any file,
+    the path is None if a file has no such partition. A line is in the same partition in every file
+    as long as files are partitioned by the same granularity and timestamp, e.g., a tweet id in ts files.
+    If any file is not partitioned, func is called once with the flat file paths.
+    With proc_num > 1, partitions are processed by a pool of processes, then func must be picklable.
+    Results are yielded as they are ready, so that the caller can reduce them without holding all of them.
+    """
+    indexes = [load_partition_index(path) for path in paths]
+    if any(index is None for index in indexes):
+        yield func(*paths)
+        return
+    granularities = set(index['granularity'] for index in indexes)
+    if len(granularities) > 1:
+        raise ValueError('Files are partitioned by different granularities {0}'.format(sorted(granularities)))
+
+    partitions = [dict(list_partitions(path, start_ms, end_ms)) for path in paths]
+    keys = sorted(set().union(*partitions))
+    tasks = [tuple(partition.get(key) for partition in partitions) for key in keys]
+    if proc_num > 1 and len(tasks) > 1:
+        with Pool(min(proc_num, len(tasks))) as pool:
+            for result in pool.imap(_apply_task, [(func, task) for task in tasks]):
+                yield result
+    else:
+        for task in tasks:
+            yield func(*task)
+
+
+def _apply_task(func_task):
+    func, task = func_task
+    return func(*task)
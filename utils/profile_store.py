@@ -0,0 +1,165 @@
+""" Read-only on-disk store of user profiles, keyed by int64 user id.
+
+A store is a directory of:
+1. profiles.txt: profile lines in user id order, as written by TweetExtractor,
+                 user_id_str, screen_name, created_at, verified, location, followers_count, friends_count,
+                 listed_count, statuses_count, description
+2. keys.npy:     sorted int64 user ids
+3. offsets.npy:  int64 byte offsets of the profile lines in profiles.txt, one more than the keys
+4. followers_count.npy, friends_count.npy, statuses_count.npy: int64 columns, -1 for a missing count
+5. verified.npy: bool column
+All files are memory-mapped on read, a lookup is a binary search over keys, so that the store is not loaded in memory.
+Numeric columns can be looked up for many users at once without parsing profile lines, see get_column().
+"""
+
+import os, io, mmap, shutil
+from array import array
+
+import numpy as np
+
+from utils.codec import open_file
+from utils.extsort import ExternalSorter
+
+USER_PROFILE_FIELDS = ('user_id_str', 'screen_name', 'created_at', 'verified', 'location', 'followers_count',
+                       'friends_count', 'listed_count', 'statuses_count', 'description')
+USER_PROFILE_INDEX = {field: idx for idx, field in enumerate(USER_PROFILE_FIELDS)}
+COUNT_COLUMNS = ('followers_count', 'friends_count', 'statuses_count')
+MISSING_COUNT = -1
+KEEP_POLICIES = ('first', 'last')
+
+
+def _parse_count(value):
+    return MISSING_COUNT if value == 'N' else int(value)
+
+
+def build_profile_store(input_paths, store_dir, keep='first', memory_budget=1 << 30, tmp_dir=None):
+    """Build a profile store from user profile files of any codec, return the number of users.
+
+    :param input_paths: user profile files, e.g., ../data/[app_name]_out/[app_name]_*_user.txt.bz2
+    :param store_dir: directory of the store, it is built in a temporary directory, which replaces store_dir
+    :param keep: 'first' to keep the first seen profile of a user, 'last' to keep the last seen one,
+                 in the order of input_paths, then of lines in a file. TweetExtractor writes one profile per user
+                 and run, an arbitrary snapshot, so keep picks among input files, e.g., sub-crawlers,
+                 not the earliest or latest snapshot in time
+    :param memory_budget: approximate bytes of profile lines in memory, sorted runs beyond it are spilled into tmp_dir
+    :param tmp_dir: directory of sorted runs, None for the system temporary directory
+    """
+    if keep not in KEEP_POLICIES:
+        raise ValueError('Unknown keep policy {0}, choose from {1}'.format(keep, KEEP_POLICIES))
+    sorter = ExternalSorter(memory_budget, tmp_dir, key_type=int)
+    for input_path in input_paths:
+        with open_file(input_path, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                user_id_str, profile = line.rstrip('\n').split(',', 1)
+                sorter.add(int(user_id_str), profile)
+
+    tmp_store_dir = '{0}.tmp'.format(store_dir)
+    if os.path.exists(tmp_store_dir):
+        shutil.rmtree(tmp_store_dir)
+    os.makedirs(tmp_store_dir)
+
+    keys = array('q')
+    offsets = array('q', [0])
+    counts = {column: array('q') for column in COUNT_COLUMNS}
+    verified = array('b')
+    with open(os.path.join(tmp_store_dir, 'profiles.txt'), 'wb') as fout:
+        offset = 0
+        for user_id, profiles in sorter.groups():
+            profile = profiles[0] if keep == 'first' else profiles[-1]
+            line = '{0},{1}\n'.format(user_id, profile).encode('utf-8')
+            fout.write(line)
+            offset += len(line)
+            keys.append(user_id)
+            offsets.append(offset)
+            split_profile = profile.split(',')
+            for column in COUNT_COLUMNS:
+                # the user id is not in the split profile
+                counts[column].append(_parse_count(split_profile[USER_PROFILE_INDEX[column] - 1]))
+            verified.append(split_profile[USER_PROFILE_INDEX['verified'] - 1] == 'Y')
+    sorter.close()
+
+    np.save(os.path.join(tmp_store_dir, 'keys.npy'), np.frombuffer(keys, dtype=np.int64))
+    np.save(os.path.join(tmp_store_dir, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+    for column in COUNT_COLUMNS:
+        np.save(os.path.join(tmp_store_dir, '{0}.npy'.format(column)), np.frombuffer(counts[column], dtype=np.int64))
+    np.save(os.path.join(tmp_store_dir, 'verified.npy'), np.frombuffer(verified, dtype=np.int8).astype(bool))
+
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.replace(tmp_store_dir, store_dir)
+    return len(keys)
+
+
+class UserProfileStore(object):
+    """ User Profile Store Class, memory-mapped lookups of user profiles.
+
+    :param store_dir: directory of a store built by build_profile_store()
+
+    A profile is a tuple of USER_PROFILE_FIELDS strings, None for a user that is not in the store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.keys = np.load(os.path.join(store_dir, 'keys.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(store_dir, 'offsets.npy'), mmap_mode='r')
+        self.columns = {}
+        self.profile_file = open(os.path.join(store_dir, 'profiles.txt'), 'rb')
+        # an empty file cannot be memory-mapped
+        self.profiles = mmap.mmap(self.profile_file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if len(self.keys) > 0 else io.BytesIO()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, user_id):
+        return self.locate([user_id])[0] >= 0
+
+    def locate(self, user_ids):
+        """Return the positions of user ids in the store as an int64 array, -1 for a user that is not in it."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        positions = np.searchsorted(self.keys, user_ids)
+        found = positions < len(self.keys)
+        found[found] = self.keys[positions[found]] == user_ids[found]
+        return np.where(found, positions, -1)
+
+    def _read_profile(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return tuple(self.profiles[start:end].decode('utf-8').rstrip('\n').split(','))
+
+    def get(self, user_id):
+        """Return the profile of a user, None if the user is not in the store."""
+        return self.get_many([user_id])[0]
+
+    def get_many(self, user_ids):
+        """Return the profiles of user ids, in the order of user_ids, None for a user that is not in the store.
+        Profiles are read in store order, so that a batch reads profiles.txt forward."""
+        positions = self.locate(user_ids)
+        profiles = [None] * len(positions)
+        for idx in np.argsort(positions, kind='stable'):
+            if positions[idx] >= 0:
+                profiles[idx] = self._read_profile(positions[idx])
+        return profiles
+
+    def get_column(self, column, user_ids):
+        """Return a numeric column of user ids as an array, followers_count, friends_count or statuses_count
+        as int64 with -1 for a missing count or user, or verified as bool with False for a missing user."""
+        if column not in self.columns:
+            if column not in COUNT_COLUMNS and column != 'verified':
+                raise ValueError('Unknown column {0}, choose from {1}'.format(column, COUNT_COLUMNS + ('verified',)))
+            self.columns[column] = np.load(os.path.join(self.store_dir, '{0}.npy'.format(column)), mmap_mode='r')
+        values = self.columns[column]
+        positions = self.locate(user_ids)
+        found = positions >= 0
+        result = np.full(len(positions), False if column == 'verified' else MISSING_COUNT, dtype=values.dtype)
+        result[found] = values[positions[found]]
+        return result
+
+    def close(self):
+        self.profiles.close()
+        self.profile_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
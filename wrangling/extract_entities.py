@@ -4,21 +4,452 @@
 """ Extract timestamp_ms, user posting, hashtag, and user mentioned.
 In the process, correct timestamp_ms in rate limit message, remove duplicate tweets, and sort tweets chronologically.
 
-Usage: python extract_entities.py
-Input data files: ../data/[app_name]_out/*.txt.bz
-Output data files: ../data/[app_name]_out/[ts|user|vid|mention|hashtag|retweet]_*.txt
-Time: ~4H
+Usage: python extract_entities.py [-p PROC_NUM]
+Input data files: ../data/[app_name]_out/*.txt.[bz2|zst|lz4|gz], or ../data/[app_name]_out/*.parquet with status_format = 'parquet'
+Output data files: ../data/[app_name]_out/[ts|user|vid|mention|hashtag|retweet]_*.txt, compressed by entity_codec
+                   ../data/[app_name]_out/ts_*/[date].txt with ts_partition
+                   ../data/[app_name]_out/retweet_*/[root_ids|offsets|retweet_ids|followers].bin with retweet_binary
+Time: ~4H with one process, about the time of the largest sub-crawler with -p PROC_NUM processes, each one holds
+      an equal share of the memory budget
+There is no incremental extraction: every run reads the whole tweet status archive of each sub-crawler and rewrites
+its entity files and retweet cascades in full, even when only a day of tweets is new. Only the final merge in
+merge_subcrawlers.py is incremental, it merges the lines past the watermark of each sub-crawler into the complete
+files, and it still merges retweet cascades in full.
 """
 
-import sys, os, bz2
-from datetime import datetime, timezone
-from collections import defaultdict
+import sys, os, time, json, shutil, argparse
+from array import array
+from datetime import datetime, timezone, timedelta
+from multiprocessing import Pool
+from operator import itemgetter
+import numpy as np
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer, make_snowflake, melt_snowflake
+from utils.codec import open_file, with_codec, resolve_path
+from utils.partition import PartitionWriter
+from utils.extsort import ExternalSorter
+from utils.manifest import file_signature
+from wrangling.retweet_cascade import RetweetCascadeBuilder
+from wrangling.status_sink import TWEET_STATUS_FIELDS, is_ratemsg_record, read_parquet_records, load_status_fields
+
+DEFAULT_RATEMSG_OFFSET = 5000
+# percentiles of rate limit message offsets in the summary of each sub-crawler, see estimate_ratemsg_offset
+OFFSET_PERCENTILES = (0, 10, 25, 50, 75, 90, 100)
+# approximate bytes of entity records that EntityCollector holds in memory before spilling sorted runs to disk
+ENTITY_MEMORY_BUDGET = 4 << 30
+
+# tweet status fields used in the entity files, see EntityCollector.add for the order
+ENTITY_FIELDS = ('tweet_id_str', 'timestamp_ms',
+                 'user_id_str', 'reply_user_id_str', 'retweeted_user_id_str', 'quoted_user_id_str',
+                 'original_vids', 'retweeted_vids', 'quoted_vids',
+                 'original_mentions', 'retweeted_mentions', 'quoted_mentions',
+                 'original_hashtags', 'retweeted_hashtags', 'quoted_hashtags',
+                 'reply_tweet_id_str', 'retweeted_tweet_id_str', 'quoted_tweet_id_str',
+                 'original_user_followers_count')
+
+
+def entity_projection(status_fields=TWEET_STATUS_FIELDS):
+    """Return a function that picks the entity fields from a tweet status record with status_fields."""
+    missing_fields = [field for field in ENTITY_FIELDS if field not in status_fields]
+    if len(missing_fields) > 0:
+        raise ValueError('Tweet status misses entity fields {0}'.format(missing_fields))
+    return itemgetter(*[status_fields.index(field) for field in ENTITY_FIELDS])
+
+
+def retweet_order(retweet):
+    """Sort key of a 'tweet_id-followers' retweet in a cascade, chronological by the numeric tweet id."""
+    return int(retweet.split('-', 1)[0]), retweet
+
+
+def load_disconnect_dict(app_name, target_suffix):
+    """Load timestamp_ms of disconnect messages for each sub-crawler from crawl log."""
+    disconnect_dict = {k: [] for k in target_suffix}
+    if os.path.exists('../log/{0}_crawl.log'.format(app_name)):
+        with open('../log/{0}_crawl.log'.format(app_name), 'r') as fin:
+            for line in fin:
+                split_line = line.rstrip().split()
+                timestamp_ms = int(datetime.strptime('{0} {1}'.format(split_line[0], split_line[1][:-4]), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()) * 1000 + int(split_line[1][-3:])
+                disconnect_dict[split_line[4].split('_')[1]].append(timestamp_ms)
+    return disconnect_dict
+
+
+class EntityCollector(object):
+    """ Entity Collector Class.
+
+    Collect timestamp, user, vid, mention, hashtag, retweet and follower records of one sub-crawler,
+    then sort them chronologically and dump them into the entity files.
+
+    :param suffix: suffix of the sub-crawler, e.g., '1' or 'all'
+    :param suffix_idx: index of the sub-crawler, used as the sequence id of made-up snowflake ids
+    :param best_offset: rate limit message timestamp_ms offset, None to estimate it from the added records,
+                        as the mean offset of rate limit messages from their neighbouring tweets, see ratemsg_offsets()
+    :param disconnect_list: timestamp_ms of disconnect messages
+    :param status_fields: field names of the tweet status records to project, see schema.txt of TweetExtractor
+    :param memory_budget: approximate bytes of records held in memory, shared by the entity files
+    :param tmp_dir: directory of sorted runs spilled to disk, None for the system temporary directory
+
+    Records are sorted by external memory sort, see utils/extsort.py, so a sub-crawler of any size
+    is sorted within memory_budget. Duplicate tweets are not tracked in memory, their records share the tweet id key
+    and are collapsed into the first added one on dump, as are their retweets in cascades, see RetweetCascadeBuilder.
+    Tweet ids are kept as int64 python ints, so that they are compared and sorted numerically,
+    and converted from and to strings only when records are added and dumped.
+    With best_offset None, records must be added in the order of the tweet status file, as fused ingest does,
+    and rate limit messages are held as int64 pairs until dump, when the offset of this sub-crawler is known.
+    """
+
+    def __init__(self, suffix, suffix_idx, best_offset, disconnect_list=(), status_fields=TWEET_STATUS_FIELDS,
+                 memory_budget=ENTITY_MEMORY_BUDGET, tmp_dir=None):
+        self.suffix = suffix
+        self.suffix_idx = suffix_idx
+        self.best_offset = best_offset
+        # rate limit messages held until the offset is estimated, and the running sum of their offsets
+        self.ratemsg_timestamps = array('q')
+        self.ratemsg_tracks = array('q')
+        self.last_tweet_ms = None
+        self.last_ratemsg_ms = None
+        self.ratemsg_offset_sum = 0
+        self.ratemsg_offset_count = 0
+        self.status_fields = tuple(status_fields)
+        self._project_entity_fields = entity_projection(status_fields)
+
+        self.min_tweet_id = None
+        sorter_budget = memory_budget // 7
+        self.ts_streaming_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+        self.user_streaming_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+        self.vid_streaming_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+        self.mention_streaming_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+        self.hashtag_streaming_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+        # (root_id, retweet_id, followers) triples of 8 bytes each, and a few times that while a chunk is sorted
+        self.retweet_cascade = RetweetCascadeBuilder(tmp_dir, max(sorter_budget // 96, 1))
+        self.root_tweet_follower_sorter = ExternalSorter(sorter_budget, tmp_dir, key_type=int)
+
+        for disconnect_ts in disconnect_list:
+            # make a snowflake id for disconnect message
+            self.ts_streaming_sorter.add(make_snowflake(disconnect_ts, 31, 31, suffix_idx + 1), 'disconnect')
+
+    def project(self, split_line):
+        """Project a tweet status record onto the entity fields, keep rate limit message as it is."""
+        if is_ratemsg_record(split_line):
+            return split_line
+        return self._project_entity_fields(split_line)
+
+    @staticmethod
+    def _union_entities(entities_list):
+        to_write_entity = set()
+        for entities in entities_list:
+            if entities != 'N':
+                if ';' in entities:
+                    to_write_entity.update(set(entities.split(';')))
+                else:
+                    to_write_entity.add(entities)
+        return to_write_entity
+
+    def add(self, record):
+        """Add a projected record, rate limit message or tweet status."""
+        if is_ratemsg_record(record):
+            if self.best_offset is None:
+                # the last rate limit message of a run is compared with the tweets before and after it
+                self.last_ratemsg_ms = int(record[1])
+                self.ratemsg_timestamps.append(int(record[1]))
+                self.ratemsg_tracks.append(int(record[2]))
+            else:
+                self._add_ratemsg(int(record[1]), record[2], self.best_offset)
+            return
+
+        tweet_id, timestamp_ms, \
+        user_id_str, reply_user_id_str, retweeted_user_id_str, quoted_user_id_str, \
+        original_vids, retweeted_vids, quoted_vids, \
+        original_mentions, retweeted_mentions, quoted_mentions, \
+        original_hashtags, retweeted_hashtags, quoted_hashtags, \
+        reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str, \
+        user_followers_count = record
+
+        if self.best_offset is None:
+            # duplicate tweets are in the tweet status file, so they count as neighbours of rate limit messages
+            tweet_ms = int(timestamp_ms)
+            if self.last_ratemsg_ms is not None and self.last_tweet_ms is not None:
+                self.ratemsg_offset_sum += self.last_ratemsg_ms - (self.last_tweet_ms + tweet_ms) // 2
+                self.ratemsg_offset_count += 1
+            self.last_ratemsg_ms = None
+            self.last_tweet_ms = tweet_ms
+
+        tweet_id = int(tweet_id)
+        if self.min_tweet_id is None:
+            self.min_tweet_id = tweet_id
+        else:
+            if tweet_id < self.min_tweet_id:
+                self.min_tweet_id = tweet_id
+
+        self.ts_streaming_sorter.add(tweet_id, timestamp_ms)
+
+        # root_user_id_str, reply_user_id_str, retweeted_user_id_str, quoted_user_id_str
+        self.user_streaming_sorter.add(tweet_id, '{0},{1},{2},{3}'.format(user_id_str, reply_user_id_str, retweeted_user_id_str, quoted_user_id_str))
+
+        to_write_vid = self._union_entities([original_vids, retweeted_vids, quoted_vids])
+        if len(to_write_vid) > 0:
+            self.vid_streaming_sorter.add(tweet_id, ','.join(to_write_vid))
+
+        to_write_mention = self._union_entities([original_mentions, retweeted_mentions, quoted_mentions])
+        if len(to_write_mention) > 0:
+            self.mention_streaming_sorter.add(tweet_id, ','.join(to_write_mention))
+
+        to_write_hashtag = self._union_entities([original_hashtags, retweeted_hashtags, quoted_hashtags])
+        if len(to_write_hashtag) > 0:
+            self.hashtag_streaming_sorter.add(tweet_id, ','.join(to_write_hashtag))
+
+        if retweeted_tweet_id_str != 'N' and int(retweeted_tweet_id_str) >= self.min_tweet_id:
+            self.retweet_cascade.add(int(retweeted_tweet_id_str), tweet_id, user_followers_count)
+
+        if reply_tweet_id_str == 'N' and retweeted_tweet_id_str == 'N' and quoted_tweet_id_str == 'N':
+            # the followers count is an int in fused ingest, the sorter takes string values
+            self.root_tweet_follower_sorter.add(tweet_id, str(user_followers_count))
+
+    def _add_ratemsg(self, timestamp_ms, track, offset):
+        # make a snowflake id for rate limit message
+        self.ts_streaming_sorter.add(make_snowflake(timestamp_ms - offset, 31, 31, self.suffix_idx), 'ratemsg{0}-{1}'.format(self.suffix, track))
+
+    def estimate_ratemsg_offset(self):
+        """Return the mean offset of the rate limit messages added so far, DEFAULT_RATEMSG_OFFSET if there is none.
+        Unlike estimate_ratemsg_offset() over all sub-crawlers, the mean is of this sub-crawler only."""
+        if self.ratemsg_offset_count == 0:
+            return DEFAULT_RATEMSG_OFFSET
+        return int(self.ratemsg_offset_sum / self.ratemsg_offset_count)
+
+    def _iter_ts_lines(self):
+        """Yield (timestamp_ms, line) of the ts file in tweet id order."""
+        for tid, value in self.ts_streaming_sorter.first_values():
+            if value.startswith('ratemsg'):
+                ts = melt_snowflake(tid)[0]
+                ratesuffix, track = value.split('-')
+                yield ts, '{0},{1},{2}\n'.format(ts, ratesuffix, track)
+            elif value.startswith('disconnect'):
+                ts = melt_snowflake(tid)[0]
+                yield ts, '{0},{1},{2}\n'.format(ts, 'disconnect', self.suffix)
+            else:
+                yield value, '{0},{1}\n'.format(value, tid)
+
+    def dump(self, output_dir, suffix_dir, codec='none', partition=None, retweet_binary=False):
+        """Sort all records and write [ts|user|vid|mention|hashtag|retweet|follower]_[suffix_dir].txt in output_dir,
+        compressed by codec. With partition 'hour' or 'day', the ts file is written in the time partitioned layout,
+        see utils/partition.py. With retweet_binary, retweet cascades are also written as binary columns with per-root
+        offsets into the directory retweet_[suffix_dir], see wrangling/retweet_cascade.py.
+        A record added again for the same id is skipped, so a duplicate tweet is written once, as first added.
+        Sorted runs are removed once dumped."""
+        ts_output_path = with_codec(os.path.join(output_dir, 'ts_{0}.txt'.format(suffix_dir)), codec)
+        user_output_path = with_codec(os.path.join(output_dir, 'user_{0}.txt'.format(suffix_dir)), codec)
+        vid_output_path = with_codec(os.path.join(output_dir, 'vid_{0}.txt'.format(suffix_dir)), codec)
+        mention_output_path = with_codec(os.path.join(output_dir, 'mention_{0}.txt'.format(suffix_dir)), codec)
+        hashtag_output_path = with_codec(os.path.join(output_dir, 'hashtag_{0}.txt'.format(suffix_dir)), codec)
+        retweet_output_path = with_codec(os.path.join(output_dir, 'retweet_{0}.txt'.format(suffix_dir)), codec)
+        follower_output_path = with_codec(os.path.join(output_dir, 'follower_{0}.txt'.format(suffix_dir)), codec)
+
+        if self.best_offset is None:
+            self.best_offset = self.estimate_ratemsg_offset()
+            print('best rate limit message timestamp_ms offset of {0} is {1}'.format(suffix_dir, self.best_offset))
+            for timestamp_ms, track in zip(self.ratemsg_timestamps, self.ratemsg_tracks):
+                self._add_ratemsg(timestamp_ms, track, self.best_offset)
+            self.ratemsg_timestamps = array('q')
+            self.ratemsg_tracks = array('q')
+
+        if partition is None:
+            with open_file(ts_output_path, 'w') as fout1:
+                for _, line in self._iter_ts_lines():
+                    fout1.write(line)
+        else:
+            with PartitionWriter(ts_output_path, partition, codec) as fout1:
+                for ts, line in self._iter_ts_lines():
+                    fout1.write(ts, line)
+        self.ts_streaming_sorter.close()
+
+        with open_file(user_output_path, 'w') as fout2:
+            for tid, value in self.user_streaming_sorter.first_values():
+                fout2.write('{0},{1}\n'.format(tid, value))
+        self.user_streaming_sorter.close()
+
+        with open_file(vid_output_path, 'w') as fout3:
+            for tid, value in self.vid_streaming_sorter.first_values():
+                fout3.write('{0},{1}\n'.format(tid, value))
+        self.vid_streaming_sorter.close()
+
+        with open_file(mention_output_path, 'w') as fout4:
+            for tid, value in self.mention_streaming_sorter.first_values():
+                fout4.write('{0},{1}\n'.format(tid, value))
+        self.mention_streaming_sorter.close()
+
+        with open_file(hashtag_output_path, 'w', encoding='utf-8') as fout5:
+            for tid, value in self.hashtag_streaming_sorter.first_values():
+                fout5.write('{0},{1}\n'.format(tid, value))
+        self.hashtag_streaming_sorter.close()
+
+        retweet_binary_dir = os.path.join(output_dir, 'retweet_{0}'.format(suffix_dir))
+        if not retweet_binary and os.path.isdir(retweet_binary_dir):
+            # binary cascades of an earlier run no longer match the text cascades, see merge_retweet_cascades
+            shutil.rmtree(retweet_binary_dir)
+        with open_file(retweet_output_path, 'w') as fout6:
+            self.retweet_cascade.dump(fout6, retweet_binary_dir if retweet_binary else None)
+        self.retweet_cascade.close()
+
+        with open_file(follower_output_path, 'w') as fout7:
+            for root_tweet_id, value in self.root_tweet_follower_sorter.first_values():
+                fout7.write('{0},{1}\n'.format(root_tweet_id, value))
+        self.root_tweet_follower_sorter.close()
+
+
+def entity_input_path(app_name, suffix, status_format='csv'):
+    """Path of the tweet status file of a sub-crawler, as written by extract_tweet_status.py."""
+    suffix_dir = '{0}_{1}'.format(app_name, suffix)
+    if status_format == 'parquet':
+        return '../data/{0}_out/{1}.parquet'.format(app_name, suffix_dir)
+    # any codec, see utils/codec.py
+    return resolve_path('../data/{0}_out/{1}.txt'.format(app_name, suffix_dir))
+
+
+def entity_input_size(app_name, suffix, status_format='csv'):
+    input_path = entity_input_path(app_name, suffix, status_format)
+    return os.path.getsize(input_path) if os.path.exists(input_path) else 0
+
+
+def load_ratemsg_timestamps(input_path, status_format='csv', status_fields=TWEET_STATUS_FIELDS):
+    """Load timestamp_ms of all records of a tweet status file in order, and whether each is a rate limit message,
+    as two numpy arrays."""
+    if status_format == 'parquet':
+        table = pq.read_table(input_path, columns=['timestamp_ms', 'track'])
+        timestamps = table.column('timestamp_ms').to_numpy().astype(np.int64)
+        is_ratemsg = ~np.asarray(table.column('track').is_null())
+        return timestamps, is_ratemsg
+
+    timestamp_idx = status_fields.index('timestamp_ms')
+    # 9 bytes per record, rather than python lists of ints and bools
+    timestamps = array('q')
+    is_ratemsg = array('b')
+    with open_file(input_path, 'rb') as fin:
+        for line in fin:
+            if line.startswith(b'ratemsg,'):
+                # ratemsg, timestamp_ms, track
+                timestamps.append(int(line.split(b',', 2)[1]))
+                is_ratemsg.append(1)
+            else:
+                timestamps.append(int(line.split(b',', timestamp_idx + 1)[timestamp_idx]))
+                is_ratemsg.append(0)
+    return np.frombuffer(timestamps, dtype=np.int64), np.frombuffer(is_ratemsg, dtype=np.int8).astype(bool)
+
+
+def ratemsg_offsets(timestamps, is_ratemsg):
+    """Offsets of rate limit messages from the midpoint of their neighbouring tweets.
+    Of consecutive rate limit messages, the last one is compared with the tweets before and after the run,
+    a run without a tweet on either side is skipped."""
+    tweet_idx = np.flatnonzero(~is_ratemsg)
+    # last rate limit message of each run, followed by a tweet
+    last_ratemsg_idx = np.flatnonzero(is_ratemsg[:-1] & ~is_ratemsg[1:])
+    # number of tweets before each of them, 0 for a run at the start of the file
+    num_tweets_before = np.searchsorted(tweet_idx, last_ratemsg_idx)
+    has_tweet_before = num_tweets_before > 0
+    last_ratemsg_idx = last_ratemsg_idx[has_tweet_before]
+    last_timestamps = timestamps[tweet_idx[num_tweets_before[has_tweet_before] - 1]]
+    next_timestamps = timestamps[last_ratemsg_idx + 1]
+    return timestamps[last_ratemsg_idx] - (last_timestamps + next_timestamps) // 2
+
+
+def summarize_ratemsg_offsets(app_name, suffix, status_format='csv'):
+    """Return (suffix, summary) of the rate limit message offsets of a sub-crawler,
+    summary has the input file signature, the number, mean and percentiles of offsets."""
+    input_path = entity_input_path(app_name, suffix, status_format)
+    status_fields = load_status_fields('../data/{0}_out/{0}_{1}_schema.txt'.format(app_name, suffix))
+    offsets = ratemsg_offsets(*load_ratemsg_timestamps(input_path, status_format, status_fields))
+    summary = {'path': input_path, 'signature': list(file_signature(input_path)), 'count': len(offsets)}
+    if len(offsets) > 0:
+        summary.update({'mean': float(np.mean(offsets)), 'std': float(np.std(offsets)),
+                        'percentiles': [float(x) for x in np.percentile(offsets, OFFSET_PERCENTILES)]})
+    return suffix, summary
+
+
+def estimate_ratemsg_offset(app_name, target_suffix, status_format='csv', proc_num=1):
+    """Estimate the rate limit message timestamp_ms offset as the mean offset over all sub-crawlers.
+
+    Offsets are summarized per sub-crawler and cached in ../data/[app_name]_out/ratemsg_offset.json,
+    a sub-crawler is loaded again only if its tweet status file has changed since.
+    Return DEFAULT_RATEMSG_OFFSET if there is no rate limit message.
+    """
+    cache_path = '../data/{0}_out/ratemsg_offset.json'.format(app_name)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, 'r') as fin:
+            cache = json.load(fin)
+
+    stale_suffix = []
+    for suffix in target_suffix:
+        input_path = entity_input_path(app_name, suffix, status_format)
+        summary = cache.get(suffix)
+        if summary is None or summary['path'] != input_path or summary['signature'] != list(file_signature(input_path)):
+            stale_suffix.append(suffix)
+    if len(stale_suffix) > 0:
+        tasks = [(app_name, suffix, status_format) for suffix in stale_suffix]
+        if proc_num > 1 and len(tasks) > 1:
+            with Pool(min(proc_num, len(tasks))) as pool:
+                cache.update(pool.starmap(summarize_ratemsg_offsets, tasks, chunksize=1))
+        else:
+            cache.update(summarize_ratemsg_offsets(*task) for task in tasks)
+        with open(cache_path, 'w') as fout:
+            json.dump(cache, fout, indent=1, sort_keys=True)
+
+    print('>>> rate limit message timestamp_ms offset')
+    print('|  suffix  |  count  |  min  |  10th  |  25th  | median |  75th  |  90th  |  max  |  mean  |  std  |')
+    total_count = 0
+    total_offset = 0
+    for suffix in target_suffix:
+        summary = cache[suffix]
+        if summary['count'] == 0:
+            continue
+        print('|{0: ^10}|{1: ^9}|{2: ^7.0f}|{3: ^8.0f}|{4: ^8.0f}|{5: ^8.0f}|{6: ^8.0f}|{7: ^8.0f}|{8: ^7.0f}|{9: ^8.0f}|{10: ^7.0f}|'
+              .format(suffix, summary['count'], *summary['percentiles'], summary['mean'], summary['std']))
+        total_count += summary['count']
+        total_offset += summary['count'] * summary['mean']
+    if total_count == 0:
+        return DEFAULT_RATEMSG_OFFSET
+    return int(total_offset / total_count)
+
+
+def extract_suffix_entities(app_name, suffix, suffix_idx, best_offset, disconnect_list, status_format='csv',
+                            entity_codec='none', ts_partition=None, memory_budget=ENTITY_MEMORY_BUDGET, retweet_binary=False):
+    """Extract the entity files of one sub-crawler, return its suffix_dir and elapsed seconds.
+    Sub-crawlers are independent, so that they can be extracted in parallel processes."""
+    start_time = time.time()
+
+    suffix_dir = '{0}_{1}'.format(app_name, suffix)
+    # field names written by extract_tweet_status.py, all fields if there is no schema file
+    status_fields = load_status_fields('../data/{0}_out/{1}_schema.txt'.format(app_name, suffix_dir))
+    collector = EntityCollector(suffix, suffix_idx, best_offset, disconnect_list, status_fields,
+                                memory_budget, '../data/{0}_out'.format(app_name))
+
+    input_path = entity_input_path(app_name, suffix, status_format)
+    if status_format == 'parquet':
+        # only load the entity columns
+        for record in read_parquet_records(input_path, ENTITY_FIELDS):
+            collector.add(record)
+    else:
+        with open_file(input_path, 'rb') as fin:
+            for line in fin:
+                split_line = line.decode('utf8').rstrip().split(',')
+                collector.add(collector.project(split_line))
+
+    print('>>> Loaded all data, ready to sort and dump {0}...'.format(input_path))
+    collector.dump('../data/{0}_out'.format(app_name), suffix_dir, entity_codec, ts_partition, retweet_binary)
+    print('>>> Dumped entities of {0}'.format(suffix_dir))
+    return suffix_dir, time.time() - start_time
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Extract entities of each sub-crawler from its tweet status file.')
+    # number of sub-crawlers extracted in parallel, each process gets an equal share of memory_budget
+    parser.add_argument('-p', '--proc_num', type=int, default=1, help='number of sub-crawlers extracted in parallel')
+    args = parser.parse_args()
+
     timer = Timer()
     timer.start()
 
@@ -32,186 +463,41 @@ def main():
 
     os.makedirs('../data/{0}_out'.format(app_name), exist_ok=True)
 
+    # csv or parquet, as written by extract_tweet_status.py
+    status_format = 'csv'
+    # bz2, zstd, lz4, gzip or none
+    entity_codec = 'none'
+    # None for flat ts files, or 'hour' or 'day' for the time partitioned layout, see utils/partition.py
+    ts_partition = None
+    # approximate bytes of entity records in memory, sorted runs beyond it are spilled into the output directory
+    memory_budget = ENTITY_MEMORY_BUDGET
+    # also write retweet cascades as binary columns with per-root offsets, see wrangling/retweet_cascade.py
+    retweet_binary = False
+    proc_num = max(args.proc_num, 1)
+
     # load disconnect msg
-    disconnect_dict = {k: [] for k in target_suffix}
-    if os.path.exists('../log/{0}_crawl.log'.format(app_name)):
-        with open('../log/{0}_crawl.log'.format(app_name), 'r') as fin:
-            for line in fin:
-                split_line = line.rstrip().split()
-                timestamp_ms = int(datetime.strptime('{0} {1}'.format(split_line[0], split_line[1][:-4]), '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp()) * 1000 + int(split_line[1][-3:])
-                disconnect_dict[split_line[4].split('_')[1]].append(timestamp_ms)
+    disconnect_dict = load_disconnect_dict(app_name, target_suffix)
 
-    # ratemsg_offset = []
-    # for suffix_idx, suffix in enumerate(target_suffix):
-    #     suffix_dir = '{0}_{1}'.format(app_name, suffix)
-    #     input_path = '../data/{0}_out/{1}.txt.bz2'.format(app_name, suffix_dir)
-    #
-    #     with bz2.BZ2File(input_path, mode='r') as fin:
-    #         ratemsg_ts_streaming_dict = {}
-    #
-    #         last_timestamp_ms = 0
-    #         last_ratemsg_timestamp_ms = 0
-    #         has_ratemsg = False
-    #
-    #         for line in fin:
-    #             split_line = line.decode('utf8').rstrip().split(',')
-    #             if len(split_line) == 3:
-    #                 last_ratemsg_timestamp_ms = int(split_line[1])
-    #                 ratemsg_ts_streaming_dict[last_ratemsg_timestamp_ms] = 'ratemsg{0}-{1}'.format(suffix, split_line[2])
-    #                 has_ratemsg = True
-    #             else:
-    #                 current_timestamp_ms = int(split_line[2])
-    #
-    #                 if has_ratemsg:
-    #                     corrected_ratemsg_ts = (last_timestamp_ms + current_timestamp_ms) // 2
-    #                     ratemsg_offset.append(last_ratemsg_timestamp_ms - corrected_ratemsg_ts)
-    #                     has_ratemsg = False
-    #
-    #                 last_timestamp_ms = current_timestamp_ms
-    #         print('>>> Loaded rate limit message timestamp offset for {0}...'.format(input_path))
-    #
-    # if len(ratemsg_offset) > 0:
-    #     print('>>> rate limit message timestamp_ms offset')
-    #     print('|  min  |  10th  |  25th  | median |  75th  |  90th  |  max  |  mean  |  std  |')
-    #     print('|{0: ^7.0f}|{1: ^8.0f}|{2: ^8.0f}|{3: ^8.0f}|{4: ^8.0f}|{5: ^8.0f}|{6: ^7.0f}|{7: ^8.0f}|{8: ^7.0f}|'
-    #           .format(np.min(ratemsg_offset), np.percentile(ratemsg_offset, 10), np.percentile(ratemsg_offset, 25),
-    #                   np.median(ratemsg_offset), np.percentile(ratemsg_offset, 75), np.percentile(ratemsg_offset, 90),
-    #                   np.max(ratemsg_offset), np.mean(ratemsg_offset), np.std(ratemsg_offset)))
-    #     best_offset = int(np.mean(ratemsg_offset))
-    # else:
-    best_offset = 5000
+    # estimate the rate limit message timestamp_ms offset from data, cached per crawl
+    best_offset = estimate_ratemsg_offset(app_name, target_suffix, status_format, proc_num)
     print('best rate limit message timestamp_ms offset is {0}'.format(best_offset))
-    # timer.stop()
 
-    for suffix_idx, suffix in enumerate(target_suffix):
-        timer = Timer()
-        timer.start()
+    tasks = [(app_name, suffix, suffix_idx, best_offset, disconnect_dict[suffix], status_format, entity_codec,
+              ts_partition, memory_budget // proc_num, retweet_binary) for suffix_idx, suffix in enumerate(target_suffix)]
+    if proc_num > 1:
+        # largest sub-crawlers first, so that the last one to finish starts early
+        tasks.sort(key=lambda task: -entity_input_size(task[0], task[1], status_format))
+        with Pool(min(proc_num, len(tasks))) as pool:
+            elapsed_times = dict(pool.starmap(extract_suffix_entities, tasks, chunksize=1))
+    else:
+        elapsed_times = dict(extract_suffix_entities(*task) for task in tasks)
 
+    print('>>> Elapsed time of each sub-crawler with {0} processes:'.format(proc_num))
+    for suffix in target_suffix:
         suffix_dir = '{0}_{1}'.format(app_name, suffix)
-        input_path = '../data/{0}_out/{1}.txt.bz2'.format(app_name, suffix_dir)
-        ts_output_path = '../data/{0}_out/ts_{1}.txt'.format(app_name, suffix_dir)
-        user_output_path = '../data/{0}_out/user_{1}.txt'.format(app_name, suffix_dir)
-        vid_output_path = '../data/{0}_out/vid_{1}.txt'.format(app_name, suffix_dir)
-        mention_output_path = '../data/{0}_out/mention_{1}.txt'.format(app_name, suffix_dir)
-        hashtag_output_path = '../data/{0}_out/hashtag_{1}.txt'.format(app_name, suffix_dir)
-        retweet_output_path = '../data/{0}_out/retweet_{1}.txt'.format(app_name, suffix_dir)
-        follower_output_path = '../data/{0}_out/follower_{1}.txt'.format(app_name, suffix_dir)
-
-        disconnect_list = disconnect_dict[suffix]
-
-        with bz2.BZ2File(input_path, mode='r') as fin:
-            min_tweet_id = None
-            visited_tid = set()
-            ts_streaming_dict = {}
-            user_streaming_dict = {}
-            vid_streaming_dict = {}
-            mention_streaming_dict = {}
-            hashtag_streaming_dict = {}
-            tid_retweet_dict = defaultdict(set)
-            root_tweet_follower_dict = {}
-
-            for disconnect_ts in disconnect_list:
-                # make a snowflake id for disconnect message
-                ts_streaming_dict[str(make_snowflake(disconnect_ts, 31, 31, suffix_idx + 1))] = 'disconnect'
-
-            for line in fin:
-                split_line = line.decode('utf8').rstrip().split(',')
-                if len(split_line) == 3:
-                    # make a snowflake id for rate limit message
-                    ts_streaming_dict[str(make_snowflake(int(split_line[1]) - best_offset, 31, 31, suffix_idx))] = 'ratemsg{0}-{1}'.format(suffix, split_line[2])
-                else:
-                    tweet_id = split_line[0]
-                    if min_tweet_id is None:
-                        min_tweet_id = tweet_id
-                    else:
-                        if tweet_id < min_tweet_id:
-                            min_tweet_id = tweet_id
-                    if tweet_id in visited_tid:
-                        continue
-
-                    ts_streaming_dict[tweet_id] = split_line[2]
-
-                    # root_user_id_str, reply_user_id_str, retweeted_user_id_str, quoted_user_id_str
-                    user_streaming_dict[tweet_id] = '{0},{1},{2},{3}'.format(split_line[3], split_line[35], split_line[36], split_line[37])
-
-                    to_write_vid = set()
-                    for vids in [split_line[5], split_line[6], split_line[7]]:
-                        if vids != 'N':
-                            if ';' in vids:
-                                to_write_vid.update(set(vids.split(';')))
-                            else:
-                                to_write_vid.add(vids)
-                    if len(to_write_vid) > 0:
-                        vid_streaming_dict[tweet_id] = ','.join(to_write_vid)
-
-                    to_write_mention = set()
-                    for mentions in [split_line[8], split_line[9], split_line[10]]:
-                        if mentions != 'N':
-                            if ';' in mentions:
-                                to_write_mention.update(set(mentions.split(';')))
-                            else:
-                                to_write_mention.add(mentions)
-                    if len(to_write_mention) > 0:
-                        mention_streaming_dict[tweet_id] = ','.join(to_write_mention)
-
-                    to_write_hashtag = set()
-                    for hashtags in [split_line[11], split_line[12], split_line[13]]:
-                        if hashtags != 'N':
-                            if ';' in hashtags:
-                                to_write_hashtag.update(set(hashtags.split(';')))
-                            else:
-                                to_write_hashtag.add(hashtags)
-                    if len(to_write_hashtag) > 0:
-                        hashtag_streaming_dict[tweet_id] = ','.join(to_write_hashtag)
-
-                    if split_line[33] != 'N' and split_line[33] >= min_tweet_id:
-                        tid_retweet_dict[split_line[33]].add('{0}-{1}'.format(tweet_id, split_line[20]))
-
-                    if split_line[32] == 'N' and split_line[33] == 'N' and split_line[34] == 'N':
-                        root_tweet_follower_dict[tweet_id] = split_line[20]
-
-                    visited_tid.add(split_line[0])
-
-            print('>>> Loaded all data, ready to sort and dump {0}...'.format(input_path))
-
-            with open(ts_output_path, 'w') as fout1:
-                for tid in sorted(ts_streaming_dict.keys()):
-                    if ts_streaming_dict[tid].startswith('ratemsg'):
-                        ts = melt_snowflake(tid)[0]
-                        ratesuffix, track = ts_streaming_dict[tid].split('-')
-                        fout1.write('{0},{1},{2}\n'.format(ts, ratesuffix, track))
-                    elif ts_streaming_dict[tid].startswith('disconnect'):
-                        ts = melt_snowflake(tid)[0]
-                        fout1.write('{0},{1},{2}\n'.format(ts, 'disconnect', suffix))
-                    else:
-                        fout1.write('{0},{1}\n'.format(ts_streaming_dict[tid], tid))
-
-            with open(user_output_path, 'w') as fout2:
-                for tid in sorted(user_streaming_dict.keys()):
-                    fout2.write('{0},{1}\n'.format(tid, user_streaming_dict[tid]))
-
-            with open(vid_output_path, 'w') as fout3:
-                for tid in sorted(vid_streaming_dict.keys()):
-                    fout3.write('{0},{1}\n'.format(tid, vid_streaming_dict[tid]))
-
-            with open(mention_output_path, 'w') as fout4:
-                for tid in sorted(mention_streaming_dict.keys()):
-                    fout4.write('{0},{1}\n'.format(tid, mention_streaming_dict[tid]))
-
-            with open(hashtag_output_path, 'w', encoding='utf-8') as fout5:
-                for tid in sorted(hashtag_streaming_dict.keys()):
-                    fout5.write('{0},{1}\n'.format(tid, hashtag_streaming_dict[tid]))
-
-            with open(retweet_output_path, 'w') as fout6:
-                for root_tweet_id in sorted(tid_retweet_dict.keys()):
-                    fout6.write('{0}:{1}\n'.format(root_tweet_id, ','.join(sorted(list(tid_retweet_dict[root_tweet_id])))))
-
-            with open(follower_output_path, 'w') as fout7:
-                for root_tweet_id in sorted(root_tweet_follower_dict.keys()):
-                    fout7.write('{0},{1}\n'.format(root_tweet_id, root_tweet_follower_dict[root_tweet_id]))
-
-        timer.stop()
-
+        print('{0}: {1}'.format(suffix_dir, str(timedelta(seconds=elapsed_times[suffix_dir]))[:-3]))
+    print('>>> Sum of elapsed time: {0}'.format(str(timedelta(seconds=sum(elapsed_times.values())))[:-3]))
+    timer.stop()
 
 if __name__ == '__main__':
     main()
@@ -28,20 +28,87 @@ Usage: python extract_tweet_status.py
 Input data files: ../data/[app_name]/*/*.bz2
 Output data files: ../data/[app_name]_out/*.txt.bz
 Time: ~4H
+
+With fused_ingest = True, entity records are extracted straight from the tweet bz2 files,
+output data files: ../data/[app_name]_out/[ts|user|vid|mention|hashtag|retweet|follower]_*.txt, ../data/[app_name]_out/*_user.txt.bz2
+There is no need to run extract_entities.py afterwards. The rate limit message timestamp_ms offset is estimated
+per sub-crawler, whereas extract_entities.py takes the mean over all sub-crawlers.
+The entity records of each input file are kept uncompressed in ../data/[app_name]/[app_name]_*/entity_stats/, whatever
+shard_codec is, so that an interrupted run resumes from the files that are done, see TweetExtractor.extract_fused.
+
+With status_format = 'parquet', tweet status is written in typed columns, see wrangling/status_sink.py,
+output data files: ../data/[app_name]_out/*.parquet
+
+Compression codecs, see utils/codec.py:
+shard_codec:   codec of the per-file tweet status and user status files, e.g., lz4 for a scratch stage
+archive_codec: codec of the merged tweet status and user status files, e.g., zstd for archives
+entity_codec:  codec of the entity files written with fused_ingest = True
+With status_fields, only the given tweet status fields are extracted, in the given order, starting with tweet_id_str
+or timestamp_ms,
+schema file: ../data/[app_name]_out/*_schema.txt, read by extract_entities.py
+With dict_encode = True, lang, filter, country code and geoname in csv tweet status are integer codes,
+side dictionary file: ../data/[app_name]_out/*_dictionary.txt, in lines of 'group,code,value', see decode_record() in status_sink.py
+With concat_shards = True and the same shard and archive codec, tweet status files are concatenated byte by byte,
+otherwise they are decompressed and compressed again.
 """
 
-import sys, os, bz2
+import sys, os, shutil
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
 from wrangling.tweet_extractor import TweetExtractor
+from wrangling.extract_entities import ENTITY_FIELDS, EntityCollector, load_disconnect_dict
+from utils.codec import open_file, with_codec, concat_files
+from utils.idset import SharedIdSet
+from wrangling.status_sink import merge_parquet_files, status_path
 
 
-def extract_status(input_dir, output_dir, proc_num):
-    """Extract tweet status from given folder, output in output_dir."""
+def extract_status(input_dir, output_dir, proc_num, status_format='csv', codec='bz2', dict_encode=False,
+                   stage_procs=None, status_fields=None, user_capacity=1 << 24):
+    """Extract tweet status from given folder, output in output_dir, return the output filenames of the tasks."""
     extractor = TweetExtractor(input_dir, output_dir)
     extractor.set_proc_num(proc_num)
+    extractor.set_fields(status_fields)
+    if stage_procs is not None:
+        extractor.set_stage_procs(*stage_procs)
+    extractor.set_status_format(status_format)
+    extractor.set_codec(codec)
+    extractor.set_dict_encode(dict_encode)
+    extractor.set_user_capacity(user_capacity)
     extractor.extract()
+    return extractor.task_filenames
+
+
+def extract_status_fused(input_dir, output_dir, proc_num, collector, codec='bz2', user_capacity=1 << 24):
+    """Extract entity records from given folder into collector, output user status in output_dir.
+    Only the entity fields are extracted, collector is built with status_fields ENTITY_FIELDS.
+    Return the output filenames of the tasks."""
+    extractor = TweetExtractor(input_dir, output_dir)
+    extractor.set_proc_num(proc_num)
+    extractor.set_fields(ENTITY_FIELDS)
+    extractor.set_codec(codec)
+    extractor.set_user_capacity(user_capacity)
+    extractor.extract_fused(collector)
+    return extractor.task_filenames
+
+
+def list_shards(shard_dir, task_filenames, status_format='csv', codec='bz2'):
+    """List the tweet status or user status files of the tasks of this run in shard_dir, in filename order.
+    Files left by an earlier run with another codec or split, e.g., a.zst next to a.bz2, or a.bz2 next to a-0000.bz2,
+    and temporary files of an interrupted run are skipped, so is the missing output of a failed task, the number of
+    missing files is printed."""
+    shard_paths = []
+    num_missing = 0
+    for filename in sorted(task_filenames):
+        shard_path = status_path(os.path.join(shard_dir, filename), status_format, codec)
+        if os.path.exists(shard_path):
+            shard_paths.append(shard_path)
+        else:
+            num_missing += 1
+    if num_missing > 0:
+        print('>>> {0} of {1} files are missing in {2}, their tasks failed, rerun to extract them'
+              .format(num_missing, len(task_filenames), shard_dir))
+    return shard_paths
 
 
 if __name__ == '__main__':
@@ -55,42 +122,90 @@ if __name__ == '__main__':
 
     os.makedirs('../data/{0}_out'.format(app_name), exist_ok=True)
 
-    for suffix in target_suffix:
+    # skip the tweet status files, write entity files directly
+    fused_ingest = False
+    # csv or parquet
+    status_format = 'csv'
+    # projection of tweet status fields, e.g., ENTITY_FIELDS in extract_entities.py, None for all fields
+    status_fields = None
+    # write low-cardinality columns of csv as integer codes plus a dictionary file
+    dict_encode = False
+    # bz2, zstd, lz4, gzip or none
+    shard_codec = 'bz2'
+    archive_codec = 'bz2'
+    entity_codec = 'none'
+    # concatenate the compressed tweet status files rather than recompress them
+    concat_shards = True
+    # number of slots in the user id sets of extraction and of merging user status files, 8 bytes each
+    user_capacity = 1 << 24
+    if fused_ingest:
+        disconnect_dict = load_disconnect_dict(app_name, target_suffix)
+
+    for suffix_idx, suffix in enumerate(target_suffix):
         timer = Timer()
         timer.start()
 
         suffix_dir = '{0}_{1}'.format(app_name, suffix)
         input_dir = '/mnt/siqi/data/{0}/{1}'.format(app_name, suffix_dir)
         output_dir = '../data/{0}/{1}'.format(app_name, suffix_dir)
-        bz2_output_path = '../data/{0}_out/{1}.txt.bz2'.format(app_name, suffix_dir)
-        bz2_user_output_path = '../data/{0}_out/{1}_user.txt.bz2'.format(app_name, suffix_dir)
+        text_output_path = with_codec('../data/{0}_out/{1}.txt'.format(app_name, suffix_dir), archive_codec)
+        parquet_output_path = '../data/{0}_out/{1}.parquet'.format(app_name, suffix_dir)
+        user_output_path = with_codec('../data/{0}_out/{1}_user.txt'.format(app_name, suffix_dir), archive_codec)
+        dictionary_output_path = '../data/{0}_out/{1}_dictionary.txt'.format(app_name, suffix_dir)
+        schema_output_path = '../data/{0}_out/{1}_schema.txt'.format(app_name, suffix_dir)
 
         proc_num = 24
-        extract_status(input_dir, output_dir, proc_num)
-        print('>>> Completed extracting tweet status for {0}.'.format(suffix_dir))
-
-        print('>>> Start to bz2 the texts...')
-        # merge all files into one bz2 file
-        with bz2.open(bz2_output_path, 'at') as fout:
-            for subdir, _, files in os.walk(os.path.join(output_dir, 'tweet_stats')):
-                for f in sorted(files):
-                    with bz2.BZ2File(os.path.join(subdir, f), mode='r') as fin:
-                        for line in fin:
+        # (decompress, parse, write) processes of the staged pipeline, None to extract each file in one process
+        stage_procs = None
+        if fused_ingest:
+            # the rate limit message offset is estimated from this sub-crawler only, on dump
+            collector = EntityCollector(suffix, suffix_idx, None, disconnect_dict[suffix], ENTITY_FIELDS,
+                                        tmp_dir='../data/{0}_out'.format(app_name))
+            task_filenames = extract_status_fused(input_dir, output_dir, proc_num, collector, shard_codec, user_capacity)
+            print('>>> Completed extracting entities for {0}.'.format(suffix_dir))
+            collector.dump('../data/{0}_out'.format(app_name), suffix_dir, entity_codec)
+            print('>>> Completed dumping entities for {0}.'.format(suffix_dir))
+        else:
+            task_filenames = extract_status(input_dir, output_dir, proc_num, status_format, shard_codec, dict_encode,
+                                            stage_procs, status_fields, user_capacity)
+            print('>>> Completed extracting tweet status for {0}.'.format(suffix_dir))
+            shutil.copyfile(os.path.join(output_dir, 'schema.txt'), schema_output_path)
+
+            if status_format == 'parquet':
+                print('>>> Start to merge the parquet files...')
+                # merge all files into one parquet file, row groups are copied as they are
+                merge_parquet_files(list_shards(os.path.join(output_dir, 'tweet_stats'), task_filenames, status_format),
+                                    parquet_output_path)
+                print('>>> Completed merging parquet for {0}.'.format(suffix_dir))
+            else:
+                print('>>> Start to {0} the texts...'.format(archive_codec))
+                shard_paths = list_shards(os.path.join(output_dir, 'tweet_stats'), task_filenames, status_format, shard_codec)
+                if concat_shards and shard_codec == archive_codec:
+                    # merge all files into one multi-stream file
+                    concat_files(shard_paths, text_output_path)
+                else:
+                    # merge all files into one file
+                    with open_file(text_output_path, 'wb') as fout:
+                        for shard_path in shard_paths:
+                            with open_file(shard_path, 'rb') as fin:
+                                for line in fin:
+                                    fout.write(line)
+                if dict_encode:
+                    shutil.copyfile(os.path.join(output_dir, 'dictionary.txt'), dictionary_output_path)
+                print('>>> Completed {0} text for {1}.'.format(archive_codec, suffix_dir))
+
+        print('>>> Start to {0} the users...'.format(archive_codec))
+        # merge all files into one file, users are deduplicated by their int64 ids
+        visited_user_ids = SharedIdSet(user_capacity)
+        with open_file(user_output_path, 'wb') as fout:
+            for shard_path in list_shards(os.path.join(output_dir, 'user_stats'), task_filenames, codec=shard_codec):
+                with open_file(shard_path, 'rb') as fin:
+                    for line in fin:
+                        if visited_user_ids.add(int(line.split(b',', 1)[0])):
                             fout.write(line)
-        print('>>> Completed bz2 text for {0}.'.format(suffix_dir))
-
-        print('>>> Start to bz2 the users...')
-        # merge all files into one bz2 file
-        visited_user_id_str = set()
-        with bz2.open(bz2_user_output_path, 'at') as fout:
-            for subdir, _, files in os.walk(os.path.join(output_dir, 'user_stats')):
-                for f in sorted(files):
-                    with bz2.BZ2File(os.path.join(subdir, f), mode='r') as fin:
-                        for line in fin:
-                            user_id_str, _ = line.decode('utf8').rstrip().split(',', 1)
-                            if user_id_str not in visited_user_id_str:
-                                fout.write(line)
-                                visited_user_id_str.add(user_id_str)
-        print('>>> Completed bz2 user for {0}.'.format(suffix_dir))
+        if visited_user_ids.is_full():
+            print('>>> User id set is full, some profiles are written more than once, raise user_capacity above {0}'
+                  .format(user_capacity))
+        print('>>> Completed {0} user for {1}.'.format(archive_codec, suffix_dir))
 
         timer.stop()
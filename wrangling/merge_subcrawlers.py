@@ -6,148 +6,429 @@ For the ground-truth stream, the lower bound is the merged tweets (as they are w
 The upper bound is the number of merged tweets plus the sum of all rate limit messages,
 assuming all missing tweets in each sub-crawler are disjointed, representing a upper bound of total missing tweets.
 
-Usage: python merge_subcrawlers.py
+Usage: python merge_subcrawlers.py [-p PROC_NUM]
 Input data files: ../data/[app_name]_out/[ts|user|vid|hashtag|mention|retweet]_*.txt, ../log/[app_name]_crawl.log
-Output data files: ../data/[app_name]_out/complete_[ts|user|vid|hashtag|mention|retweet]_[app].txt
+                  ../data/[app_name]_out/retweet_[app_name]_all/, binary cascades of the all crawler if they exist
+Output data files: ../data/[app_name]_out/complete_[ts|user|vid|hashtag|mention|retweet]_[app].txt, compressed by entity_codec
+                   ../data/[app_name]_out/complete_ts_[app]/[date].txt with ts_partition
+                   ../data/[app_name]_out/complete_[ts|user|vid|hashtag|mention]_[app].state.json, for incremental merges
+Input files of any codec are read, see utils/codec.py
 Time: ~1H
+With incremental = True, only the new lines of the entity files are merged into the complete files.
+Only this final merge is incremental, the pipeline before it is not: extract_entities.py reads the whole tweet status
+archive of every sub-crawler again and rewrites its entity files in full, and retweet cascades are merged in full on
+every run. An incremental run saves the time of the merge, not of extraction, which is the larger part.
 """
 
-import sys, os
+import sys, os, io, time, json, shutil, argparse
+from array import array
+from collections import deque
+from datetime import timedelta
+from multiprocessing import Pool
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
-from utils.helper import Timer
+from utils.helper import Timer, make_snowflake, melt_snowflake
+from utils.codec import open_file, with_codec
+from utils.partition import PartitionWriter, list_partitions, open_partitioned
+from utils.kmerge import kway_merge, kway_merge_groups, open_from, seek_head
+from utils.dedup import WindowDeduplicator
+from wrangling.extract_entities import retweet_order
+from wrangling.retweet_cascade import load_retweet_cascades, get_retweet_cascade, format_followers
 
+# lines of a sub-crawler are merged again from this long before its watermark in an incremental merge
+MERGE_OVERLAP_MS = 10 * 60 * 1000
 
-def find_next_item(nextline_list):
-    end_flag = all(v.rstrip() == '' for v in nextline_list)
-    if end_flag:
-        return None, None, True
-    else:
-        lst = []
-        for item in nextline_list:
-            if item.rstrip() == '':
-                lst.append('END')
-            else:
-                lst.append(item)
-        index_min = min(range(len(lst)), key=lst.__getitem__)
-        return index_min, lst[index_min], False
 
+def item_order(item):
+    """Sort key of an entity line, the leading tweet id or timestamp_ms as an integer, then the rest of the line."""
+    head, _, rest = item.partition(',')
+    return int(head), rest
 
-def main():
-    app_name = 'cyberbullying'
-    if app_name == 'cyberbullying':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
-    elif app_name == 'youtube':
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', 'all']
-    else:
-        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
 
-    archive_dir = '../data/{0}_out'.format(app_name)
+def parse_entity_line(line):
+    return item_order(line), line
 
-    # extract retweet cascade
-    timer = Timer()
-    timer.start()
 
+def parse_retweet_line(line):
+    """Parse a retweet cascade line into the root tweet id as an integer and its list of 'tid-followers'."""
+    root_tweet_id, cascade = line.rstrip().split(':')
+    return int(root_tweet_id), cascade.split(',')
+
+
+def load_root_followers(follower_paths):
+    """Load the root tweet followers files, return the root tweet ids and their followers counts as int64 arrays
+    sorted by root tweet id. A root tweet in more than one file keeps the count of the last file, as a dict would."""
+    root_tweet_ids = array('q')
+    root_user_followers = array('q')
+    for follower_path in follower_paths:
+        with open_file(follower_path, 'r') as fin:
+            for line in fin:
+                root_tweet_id, root_user_follower = line.rstrip().split(',')
+                root_tweet_ids.append(int(root_tweet_id))
+                root_user_followers.append(int(root_user_follower))
+    root_tweet_ids = np.frombuffer(root_tweet_ids, dtype=np.int64)
+    root_user_followers = np.frombuffer(root_user_followers, dtype=np.int64)
+    # a stable sort keeps the lines of a root tweet in file order, the last of them is kept
+    order = np.argsort(root_tweet_ids, kind='stable')
+    root_tweet_ids = root_tweet_ids[order]
+    is_last = np.append(root_tweet_ids[1:] != root_tweet_ids[:-1], True) if len(order) > 0 else np.zeros(0, dtype=bool)
+    return root_tweet_ids[is_last], root_user_followers[order][is_last]
+
+
+def find_root_follower(root_tweet_ids, root_user_followers, root_tweet_id):
+    """Return the followers count of a root tweet in the arrays of load_root_followers(), None if it is not there."""
+    idx = np.searchsorted(root_tweet_ids, root_tweet_id)
+    if idx == len(root_tweet_ids) or root_tweet_ids[idx] != root_tweet_id:
+        return None
+    return int(root_user_followers[idx])
+
+
+def merge_retweet_cascades(archive_dir, app_name, target_suffix, entity_codec='none'):
+    """Merge the retweet cascades of sub-crawlers, also write the sample cascades of the all crawler.
+    Return 'retweet' and elapsed seconds."""
+    start_time = time.time()
     print('>>> Merging entity retweet cascade')
 
     # get sample cascade
-    root_tweet_follower_dict = {}
-    with open(os.path.join(archive_dir, 'follower_{0}_all.txt'.format(app_name)), 'r') as fin:
-        for line in fin:
-            root_tweet_id, root_user_follower = line.rstrip().split(',')
-            root_user_follower = int(root_user_follower)
-            root_tweet_follower_dict[root_tweet_id] = root_user_follower
-
-    with open(os.path.join(archive_dir, 'sample_retweet_{0}.txt'.format(app_name)), 'w') as fout:
-        with open(os.path.join(archive_dir, 'retweet_{0}_all.txt'.format(app_name)), 'r') as fin:
-            for line in fin:
-                root_tweet_id, cascade = line.rstrip().split(':')
-                if root_tweet_id in root_tweet_follower_dict:
-                    fout.write('{0}-{1}:{2}\n'.format(root_tweet_id, root_tweet_follower_dict[root_tweet_id], cascade))
+    root_tweet_ids, root_user_followers = load_root_followers([os.path.join(archive_dir, 'follower_{0}_all.txt'.format(app_name))])
+
+    binary_dir = os.path.join(archive_dir, 'retweet_{0}_all'.format(app_name))
+    with open_file(with_codec(os.path.join(archive_dir, 'sample_retweet_{0}.txt'.format(app_name)), entity_codec), 'w') as fout:
+        if os.path.isdir(binary_dir):
+            # look up the cascades of sampled root tweets in the binary columns, rather than parse every cascade
+            cascades = load_retweet_cascades(binary_dir)
+            for root_tweet_id, root_user_follower in zip(root_tweet_ids.tolist(), root_user_followers.tolist()):
+                cascade = get_retweet_cascade(cascades, root_tweet_id)
+                if cascade is not None:
+                    retweet_ids, followers = cascade
+                    fout.write('{0}-{1}:{2}\n'.format(root_tweet_id, root_user_follower,
+                                                      ','.join(['{0}-{1}'.format(retweet_id, format_followers(follower))
+                                                                for retweet_id, follower in zip(retweet_ids.tolist(), followers.tolist())])))
+        else:
+            with open_file(os.path.join(archive_dir, 'retweet_{0}_all.txt'.format(app_name)), 'r') as fin:
+                for line in fin:
+                    root_tweet_id, cascade = line.rstrip().split(':')
+                    root_user_follower = find_root_follower(root_tweet_ids, root_user_followers, int(root_tweet_id))
+                    if root_user_follower is not None:
+                        fout.write('{0}-{1}:{2}\n'.format(root_tweet_id, root_user_follower, cascade))
 
     # get complete cascade
-    root_tweet_follower_dict = {}
     follower_file_list = ['follower_{0}_{1}.txt'.format(app_name, suffix) for suffix in target_suffix]
-    for follower_file in follower_file_list:
-        with open(os.path.join(archive_dir, follower_file), 'r') as fin:
-            for line in fin:
-                root_tweet_id, root_user_follower = line.rstrip().split(',')
-                root_user_follower = int(root_user_follower)
-                root_tweet_follower_dict[root_tweet_id] = root_user_follower
+    root_tweet_ids, root_user_followers = load_root_followers([os.path.join(archive_dir, follower_file)
+                                                               for follower_file in follower_file_list])
 
     retweet_file_list = ['retweet_{0}_{1}.txt'.format(app_name, suffix) for suffix in target_suffix]
-    retweet_file_handles = [open(os.path.join(archive_dir, retweet_file), 'r') for retweet_file in retweet_file_list]
+    retweet_file_handles = [open_file(os.path.join(archive_dir, retweet_file), 'r') for retweet_file in retweet_file_list]
+
+    with open_file(with_codec(os.path.join(archive_dir, 'complete_retweet_{0}.txt'.format(app_name)), entity_codec), 'w') as fout:
+        for root_tid, cascades in kway_merge_groups(retweet_file_handles, parse_retweet_line):
+            root_user_follower = find_root_follower(root_tweet_ids, root_user_followers, root_tid)
+            if root_user_follower is not None:
+                children_tid_set = set()
+                for _, children_tid_list in cascades:
+                    children_tid_set.update(children_tid_list)
+                fout.write('{0}-{1}:{2}\n'.format(root_tid,
+                                                  root_user_follower,
+                                                  ','.join(sorted(children_tid_set, key=retweet_order))))
 
-    with open(os.path.join(archive_dir, 'complete_retweet_{0}.txt'.format(app_name)), 'w') as fout:
-        nextline_list = [retweet_file.readline() for retweet_file in retweet_file_handles]
+    for retweet_file in retweet_file_handles:
+        retweet_file.close()
 
-        while True:
-            end_flag = all(v.rstrip() == '' for v in nextline_list)
-            if end_flag:
-                break
+    print('>>> Merged entity retweet cascade')
+    return 'retweet', time.time() - start_time
+
+
+def item_time(entity, head):
+    """Timestamp in milliseconds of an entity line, ts lines lead with timestamp_ms, other entity lines with a tweet id."""
+    return head if entity == 'ts' else melt_snowflake(head)[0]
+
+
+def time_head(entity, timestamp_ms):
+    """The smallest leading integer of entity lines at timestamp_ms, the inverse of item_time()."""
+    return timestamp_ms if entity == 'ts' else make_snowflake(timestamp_ms, 0, 0, 0)
+
+
+def merge_state_path(archive_dir, entity, app_name):
+    return os.path.join(archive_dir, 'complete_{0}_{1}.state.json'.format(entity, app_name))
+
+
+def load_merge_state(path):
+    """Load the state of the last merge of an entity, None if there is none."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fin:
+        return json.load(fin)
+
+
+def save_merge_state(path, state):
+    """Save the state of a merge, the state file is replaced only once it is complete."""
+    with open('{0}.tmp'.format(path), 'w', encoding='utf-8') as fout:
+        json.dump(state, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.replace('{0}.tmp'.format(path), path)
+
+
+def merge_entity(archive_dir, app_name, target_suffix, entity, entity_codec='none', ts_partition=None,
+                 dedup_window_ms=None, dedup_margin_ms=60 * 1000, incremental=False, overlap_ms=MERGE_OVERLAP_MS):
+    """Merge the [ts|user|vid|hashtag|mention] files of sub-crawlers, return the entity and elapsed seconds.
+    Entities are merged from disjoint files, so that they can be merged in parallel processes.
+
+    An incremental merge saves a state next to the complete file: the high watermark timestamp of each sub-crawler,
+    the size of the complete file, and per sub-crawler the lines read in the last overlap_ms before its watermark.
+    The next incremental merge only reads lines within overlap_ms before the watermark of each sub-crawler or later,
+    and skips the lines in the saved overlap of that sub-crawler, as they were merged by the last run.
+    The new lines are merged with the tail of the complete file from the first new line on, so it stays sorted.
+    The merged tail is written aside, then the new state with the seam of the tail, and only then is the complete
+    file truncated at the seam and the tail appended. A merge interrupted at any point leaves either the last state
+    with an unchanged complete file, or the new state with its tail, which the next merge applies, see check_merge_state.
+    Lines of a sub-crawler that arrive more than overlap_ms behind its watermark are not merged.
+    Only this final merge step is incremental, the entity files of sub-crawlers are still extracted in full by
+    extract_entities.py, and retweet cascades are merged in full, see merge_retweet_cascades.
+    The complete file is searched and truncated in place, so an incremental merge needs a flat file
+    without compression, i.e., entity_codec 'none' and, for ts, no ts_partition. Other layouts raise ValueError.
+    """
+    start_time = time.time()
+    print('>>> Merging entity {0}'.format(entity))
+
+    output_path = with_codec(os.path.join(archive_dir, 'complete_{0}_{1}.txt'.format(entity, app_name)), entity_codec)
+    partitioned_output = entity == 'ts' and ts_partition is not None
+    if incremental and (entity_codec != 'none' or partitioned_output):
+        raise ValueError('Incremental merge needs a flat complete file without compression, got codec {0} and ts_partition {1}'
+                         .format(entity_codec, ts_partition if entity == 'ts' else None))
+    state_path = merge_state_path(archive_dir, entity, app_name)
+    state = load_merge_state(state_path) if incremental else None
+    if state is not None:
+        state = check_merge_state(state, output_path)
+        if state is None:
+            print('>>> State of the last merge does not match {0}, merge in full'.format(output_path))
+    if state is None and os.path.exists(state_path):
+        # the complete file is replaced, the state of an earlier merge no longer matches it
+        os.remove(state_path)
+
+    if state is None:
+        watermarks = {}
+        overlap_item_sets = [set() for _ in target_suffix]
+    else:
+        watermarks = state['watermarks']
+        overlap_item_sets = [set(item for _, item in state['overlap'].get(suffix, [])) for suffix in target_suffix]
+    # lines at or before these timestamps were merged by the last run, None to read all lines
+    start_ms_list = [None if watermarks.get(suffix) is None else watermarks[suffix] - overlap_ms for suffix in target_suffix]
+    watermark_list = [watermarks.get(suffix) for suffix in target_suffix]
+
+    inputfile_list = [os.path.join(archive_dir, '{0}_{1}_{2}.txt'.format(entity, app_name, suffix)) for suffix in target_suffix]
+    inputfile_handles = []
+    for inputfile, start_ms in zip(inputfile_list, start_ms_list):
+        if start_ms is not None and list_partitions(inputfile) is not None:
+            # ts files may be in the time partitioned layout, only the partitions since start_ms are read
+            inputfile_handles.append(open_partitioned(inputfile, encoding='utf-8', start_ms=start_ms))
+        elif start_ms is not None:
+            # ts files are sorted by tweet id rather than timestamp_ms, seek back one more overlap to be safe
+            inputfile_handles.append(open_from(inputfile, time_head(entity, start_ms - overlap_ms if entity == 'ts' else start_ms)))
+        else:
+            inputfile_handles.append(open_partitioned(inputfile, encoding='utf-8'))
+
+    if dedup_window_ms is None:
+        visited_item_set = set().union(*overlap_item_sets)
+    else:
+        deduplicator = WindowDeduplicator(dedup_window_ms, dedup_margin_ms, tmp_dir=archive_dir)
+        if state is not None:
+            for item_ts, item in sorted(item for suffix in target_suffix for item in state['overlap'].get(suffix, [])):
+                deduplicator.add(item, item_ts)
+    # lines read from each sub-crawler since its watermark minus overlap_ms, to be saved in the state
+    overlaps = [deque() for _ in target_suffix]
+
+    if partitioned_output:
+        fout = PartitionWriter(output_path, ts_partition, entity_codec)
+        write_item = lambda item: fout.write(item.split(',', 1)[0], item)
+    else:
+        # new lines of an incremental merge are merged with the tail of the complete file once they are all known
+        new_path = '{0}.new'.format(output_path)
+        fout = open_file(output_path if state is None else new_path, 'w', encoding='utf-8')
+        write_item = fout.write
+    first_new_head = None
+
+    for num_items, (next_key, next_idx, next_item) in enumerate(kway_merge(inputfile_handles, parse_entity_line)):
+        item_ts = item_time(entity, next_key[0])
+        if start_ms_list[next_idx] is not None and item_ts <= start_ms_list[next_idx]:
+            continue
+        if incremental:
+            overlaps[next_idx].append((item_ts, next_item))
+        if start_ms_list[next_idx] is not None and item_ts <= watermarks[target_suffix[next_idx]] \
+                and next_item in overlap_item_sets[next_idx]:
+            continue
+        if watermark_list[next_idx] is None or item_ts > watermark_list[next_idx]:
+            watermark_list[next_idx] = item_ts
+
+        # omit rate limit messages in the all crawler
+        if 'ratemsgall' not in next_item:
+            if 'ratemsg' in next_item or 'disconnect' in next_item:
+                is_new = True
+            elif dedup_window_ms is None:
+                is_new = next_item not in visited_item_set
+                if is_new:
+                    visited_item_set.add(next_item)
             else:
-                root_tid_list = []
-                children_tid_list = []
-
-                for item in nextline_list:
-                    if item.rstrip() == '':
-                        root_tid_list.append('END')
-                        children_tid_list.append('END')
-                    else:
-                        root_tid_list.append(item.rstrip().split(':')[0])
-                        children_tid_list.append(set(item.rstrip().split(':')[1].split(',')))
-
-                minimum_root_tid = min(root_tid_list)
-                min_indices = [i for i, v in enumerate(root_tid_list) if v == minimum_root_tid]
-
-                if minimum_root_tid in root_tweet_follower_dict:
-                    min_children_tid_set = set()
-                    for idx in min_indices:
-                        min_children_tid_set.update(children_tid_list[idx])
-                    fout.write('{0}-{1}:{2}\n'.format(minimum_root_tid,
-                                                      root_tweet_follower_dict[minimum_root_tid],
-                                                      ','.join(sorted(list(min_children_tid_set)))))
-
-                for idx in min_indices:
-                    nextline_list[idx] = retweet_file_handles[idx].readline()
+                is_new = deduplicator.add(next_item, item_ts)
+            if is_new:
+                write_item(next_item)
+                if first_new_head is None:
+                    first_new_head = next_key[0]
+
+        if incremental and num_items % 65536 == 0:
+            prune_overlaps(overlaps, watermark_list, overlap_ms)
+
+    fout.close()
+    for inputfile in inputfile_handles:
+        inputfile.close()
+    if dedup_window_ms is not None:
+        print('>>> {0} {1} lines out of order by more than {2}ms, {3} of them beyond the margin'.format(
+            deduplicator.num_stragglers, entity, dedup_window_ms, deduplicator.num_late))
+        deduplicator.close()
+
+    if incremental:
+        prune_overlaps(overlaps, watermark_list, overlap_ms)
+        new_state = {'watermarks': {suffix: watermark for suffix, watermark in zip(target_suffix, watermark_list)
+                                    if watermark is not None},
+                     'size': os.path.getsize(output_path),
+                     'overlap': {suffix: [[item_ts, item] for item_ts, item in overlap]
+                                 for suffix, overlap in zip(target_suffix, overlaps)}}
+        if state is not None and first_new_head is not None:
+            # the new state is saved with the seam and the size after the tail is applied, before the complete file
+            # is changed, so an interrupted merge is finished by the next one, see check_merge_state
+            seam, tail_size = merge_tail(output_path, new_path, first_new_head)
+            new_state['seam'] = seam
+            new_state['size'] = seam + tail_size
+            save_merge_state(state_path, new_state)
+            apply_tail(output_path, seam)
+        else:
+            # the state is saved after the complete file is closed
+            save_merge_state(state_path, new_state)
+        if state is not None:
+            os.remove(new_path)
+
+    print('>>> Merged entity {0}'.format(entity))
+    return entity, time.time() - start_time
+
+
+def prune_overlaps(overlaps, watermark_list, overlap_ms):
+    """Drop the lines of each sub-crawler that are more than overlap_ms behind its own watermark."""
+    for overlap, watermark in zip(overlaps, watermark_list):
+        while len(overlap) > 0 and overlap[0][0] <= watermark - overlap_ms:
+            overlap.popleft()
+
+
+def merge_tail(output_path, new_path, first_new_head):
+    """Merge the sorted new lines in new_path with the flat complete file, from its first line whose leading
+    integer is at least first_new_head on, and skip new lines that are already in it.
+    The merged tail is written into [output_path].tail, the complete file is not changed.
+    Return the seam, the byte offset in the complete file where the tail goes, and the size of the tail."""
+    tail_path = '{0}.tail'.format(output_path)
+    with open(output_path, 'rb') as fin:
+        seek_head(fin, first_new_head)
+        seam = fin.tell()
+        with io.TextIOWrapper(fin, encoding='utf-8') as tail_input, open(new_path, 'r', encoding='utf-8') as new_input, \
+                open(tail_path, 'w', encoding='utf-8') as fout:
+            last_tail_item = None
+            for _, idx, item in kway_merge([tail_input, new_input], parse_entity_line):
+                if idx == 0:
+                    last_tail_item = item
+                elif item == last_tail_item and 'ratemsg' not in item and 'disconnect' not in item:
+                    # a duplicate sorts right after the merged line, as lines are sorted by the whole line
+                    continue
+                fout.write(item)
+            fout.flush()
+            os.fsync(fout.fileno())
+    return seam, os.path.getsize(tail_path)
+
+
+def apply_tail(output_path, seam):
+    """Replace the complete file from the seam on by [output_path].tail written by merge_tail(), then remove it.
+    Only the tail is written again, and applying it twice gives the same file."""
+    tail_path = '{0}.tail'.format(output_path)
+    os.truncate(output_path, seam)
+    with open(output_path, 'ab') as fout, open(tail_path, 'rb') as fin:
+        shutil.copyfileobj(fin, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    os.remove(tail_path)
+
+
+def check_merge_state(state, output_path):
+    """Check the state of the last merge against the complete file, return the state if they match, None otherwise.
+    A merge interrupted after its state was saved left the tail and the seam, the tail is applied again."""
+    if not (isinstance(state.get('overlap'), dict) and os.path.exists(output_path)):
+        return None
+    tail_path = '{0}.tail'.format(output_path)
+    size = os.path.getsize(output_path)
+    if size != state['size'] and state.get('seam') is not None and os.path.exists(tail_path) \
+            and size >= state['seam'] and os.path.getsize(tail_path) == state['size'] - state['seam']:
+        print('>>> Finishing the interrupted merge of {0} from byte {1}'.format(output_path, state['seam']))
+        apply_tail(output_path, state['seam'])
+        size = os.path.getsize(output_path)
+    if size != state['size']:
+        return None
+    if os.path.exists(tail_path):
+        # a tail of a merge interrupted before its state was saved
+        os.remove(tail_path)
+    return state
 
-    for retweet_file in retweet_file_handles:
-        retweet_file.close()
 
-    timer.stop()
+def main():
+    parser = argparse.ArgumentParser(description='Merge the entity files of all sub-crawlers into complete files.')
+    # number of entities merged in parallel, each merge reads its own files and holds its own dedup set.
+    # Peak memory is about the sum of the dedup sets of the entities merged at once, with dedup_window_ms None
+    # a set of all merged lines of an entity, so raise proc_num only with memory to spare, or with dedup_window_ms
+    parser.add_argument('-p', '--proc_num', type=int, default=1, help='number of entities merged in parallel')
+    args = parser.parse_args()
+
+    timer = Timer()
+    timer.start()
+
+    app_name = 'cyberbullying'
+    if app_name == 'cyberbullying':
+        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
+    elif app_name == 'youtube':
+        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', 'all']
+    else:
+        target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
 
-    # merge other entities
+    archive_dir = '../data/{0}_out'.format(app_name)
+    # bz2, zstd, lz4, gzip or none
+    entity_codec = 'none'
+    # None for a flat complete_ts file, or 'hour' or 'day' for the time partitioned layout, see utils/partition.py
+    ts_partition = None
+    # None to deduplicate lines by a set of all merged lines, or a time window in milliseconds, lines are only kept
+    # in memory for the window plus dedup_margin_ms behind the latest timestamp, older lines are spilled into
+    # archive_dir and read back only for lines further out of order than that, see utils/dedup.py
+    dedup_window_ms = None
+    dedup_margin_ms = 60 * 1000
+    # merge the lines past the watermarks of the last merge into the complete files, instead of merging in full.
+    # It needs flat complete files without compression, entity_codec 'none' and ts_partition None.
+    # Retweet cascades are always merged in full, as new retweets extend the cascades of earlier root tweets,
+    # and the entity files are extracted in full by extract_entities.py before each merge
+    incremental = False
+    merge_overlap_ms = MERGE_OVERLAP_MS
+    proc_num = max(args.proc_num, 1)
+
+    # merge retweet cascade, then other entities
     entities = ['ts', 'user', 'vid', 'hashtag', 'mention']
-    for entity in entities:
-        timer = Timer()
-        timer.start()
-
-        print('>>> Merging entity {0}'.format(entity))
-
-        inputfile_list = ['{0}_{1}_{2}.txt'.format(entity, app_name, suffix) for suffix in target_suffix]
-        inputfile_handles = [open(os.path.join(archive_dir, inputfile), 'r', encoding='utf-8') for inputfile in inputfile_list]
-        visited_item_set = set()
-
-        with open(os.path.join(archive_dir, 'complete_{0}_{1}.txt'.format(entity, app_name)), 'w', encoding='utf-8') as fout:
-            nextline_list = [inputfile.readline() for inputfile in inputfile_handles]
-
-            while True:
-                next_idx, next_item, end_flag = find_next_item(nextline_list)
-                if end_flag:
-                    break
-                # omit rate limit messages in the all crawler
-                if 'ratemsgall' not in next_item:
-                    if 'ratemsg' in next_item or 'disconnect' in next_item:
-                        fout.write(next_item)
-                    elif next_item not in visited_item_set:
-                        fout.write(next_item)
-                        visited_item_set.add(next_item)
-                nextline_list[next_idx] = inputfile_handles[next_idx].readline()
-
-        for inputfile in inputfile_handles:
-            inputfile.close()
-
-        timer.stop()
+    tasks = [(merge_retweet_cascades, (archive_dir, app_name, target_suffix, entity_codec))] + \
+            [(merge_entity, (archive_dir, app_name, target_suffix, entity, entity_codec, ts_partition,
+                             dedup_window_ms, dedup_margin_ms, incremental, merge_overlap_ms)) for entity in entities]
+    if proc_num > 1:
+        with Pool(min(proc_num, len(tasks))) as pool:
+            results = [pool.apply_async(func, args) for func, args in tasks]
+            elapsed_times = dict(result.get() for result in results)
+    else:
+        elapsed_times = dict(func(*args) for func, args in tasks)
+
+    print('>>> Elapsed time of each entity with {0} processes:'.format(proc_num))
+    for entity in ['retweet'] + entities:
+        print('{0}: {1}'.format(entity, str(timedelta(seconds=elapsed_times[entity]))[:-3]))
+    print('>>> Sum of elapsed time: {0}'.format(str(timedelta(seconds=sum(elapsed_times.values())))[:-3]))
+    timer.stop()
 
 
 if __name__ == '__main__':
@@ -1,18 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-""" Merge all user profiles into one file.
+""" Merge all user profiles into one store, keyed by int64 user id, see utils/profile_store.py.
 
 Usage: python merge_user_profiles.py
-Input data files: ../data/[app_name]_out/[app_name]_*_user.txt.bz2
-Output data files: ../data/[app_name]_out/complete_user_profiles.txt
+Input data files: ../data/[app_name]_out/[app_name]_*_user.txt.[bz2|zst|lz4|gz]
+Output data files: ../data/[app_name]_out/user_profile_[app_name]/[profiles.txt|keys.npy|offsets.npy|*.npy]
 Time: ~1H
 """
 
-import sys, os, bz2
+import sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import Timer
+from utils.codec import resolve_path
+from utils.profile_store import build_profile_store
 
 
 def main():
@@ -25,26 +27,21 @@ def main():
         target_suffix = ['1', '2', '3', '4', '5', '6', '7', '8', 'all']
 
     archive_dir = '../data/{0}_out'.format(app_name)
+    # first or last, keep the first or the last seen profile of a user, sub-crawlers in the order of target_suffix.
+    # Each sub-crawler has one profile per user, an arbitrary snapshot of its crawl, not the earliest or latest one
+    keep = 'first'
+    # approximate bytes of profile lines in memory, sorted runs beyond it are spilled into archive_dir
+    memory_budget = 1 << 30
 
     timer = Timer()
     timer.start()
 
     print('>>> Merging user profile')
 
-    fout = open(os.path.join(archive_dir, 'complete_user_profile_{0}.txt'.format(app_name)), 'w')
-    visited_user_id_str = set()
-    num_users = 0
-    for suffix in target_suffix:
-        with bz2.BZ2File(os.path.join(archive_dir, '{0}_{1}_user.txt.bz2'.format(app_name, suffix)), mode='r') as fin:
-            for line in fin:
-                line = line.decode('utf8')
-                user_id_str, _ = line.rstrip().split(',', 1)
-                if user_id_str not in visited_user_id_str:
-                    fout.write(line)
-                    visited_user_id_str.add(user_id_str)
-                    num_users += 1
+    input_paths = [resolve_path(os.path.join(archive_dir, '{0}_{1}_user.txt'.format(app_name, suffix))) for suffix in target_suffix]
+    num_users = build_profile_store(input_paths, os.path.join(archive_dir, 'user_profile_{0}'.format(app_name)),
+                                    keep, memory_budget, archive_dir)
     print('>>> We retrieve profiles for {0} users'.format(num_users))
-    fout.close()
 
     timer.stop()
 
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+""" Retweet cascades built from (root_id, retweet_id, followers) triples with bounded memory.
+
+Triples are buffered in int64 columns, each full chunk is sorted by numpy and appended to on-disk column files
+as a sorted run. Cascades are read back by a k-way merge of the runs, grouped by root id.
+A retweet added more than once keeps the followers count it was first added with, as the sort of a chunk and the merge
+of runs are both stable on (root_id, retweet_id), and runs are merged in the order they were spilled.
+Two outputs:
+1. text:   'root_id:retweet_id-followers,...' lines, retweets in tweet id order, see EntityCollector.dump
+2. binary: a directory of raw int64 column files, root_ids.bin, offsets.bin, retweet_ids.bin and followers.bin.
+           The retweets of root_ids[i] are retweet_ids[offsets[i]:offsets[i + 1]], see load_retweet_cascades().
+Missing followers count 'N' is stored as -1.
+"""
+
+import os, heapq, shutil, tempfile
+from array import array
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+
+TRIPLE_COLUMNS = ('root_id', 'retweet_id', 'followers')
+BINARY_COLUMNS = ('root_ids', 'offsets', 'retweet_ids', 'followers')
+MISSING_FOLLOWERS = -1
+
+
+def parse_followers(followers):
+    return MISSING_FOLLOWERS if followers == 'N' else int(followers)
+
+
+def format_followers(followers):
+    return 'N' if followers == MISSING_FOLLOWERS else str(followers)
+
+
+class RetweetCascadeBuilder(object):
+    """ Retweet Cascade Builder Class.
+
+    :param tmp_dir: directory to create the column buffer directory in, None for the system temporary directory
+    :param chunk_size: number of triples held in memory, a full chunk is sorted and spilled as a run
+    :param block_size: number of triples read from each run at a time when runs are merged
+
+    Memory is about 24 bytes per triple of a chunk, several times that while a chunk is sorted,
+    plus a block per run and the largest cascade when cascades are read back.
+    """
+
+    def __init__(self, tmp_dir=None, chunk_size=1 << 22, block_size=1 << 13):
+        self.tmp_dir = tmp_dir
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.buffer_dir = None
+        self.chunk = tuple(array('q') for _ in TRIPLE_COLUMNS)
+        self.run_bounds = [0]
+
+    def __len__(self):
+        return self.run_bounds[-1] + len(self.chunk[0])
+
+    def add(self, root_id, retweet_id, followers):
+        """Add a retweet of root_id, ids are ints, followers is a followers count string."""
+        root_ids, retweet_ids, followers_counts = self.chunk
+        root_ids.append(root_id)
+        retweet_ids.append(retweet_id)
+        followers_counts.append(parse_followers(followers))
+        if len(root_ids) >= self.chunk_size:
+            self._spill()
+
+    def _column_path(self, column):
+        return os.path.join(self.buffer_dir, '{0}.bin'.format(column))
+
+    def _spill(self):
+        if len(self.chunk[0]) == 0:
+            return
+        if self.buffer_dir is None:
+            self.buffer_dir = tempfile.mkdtemp(prefix='cascade_', dir=self.tmp_dir)
+        columns = [np.frombuffer(column, dtype=np.int64) for column in self.chunk]
+        # np.lexsort sorts by the last key first, and is stable, duplicates of a retweet stay in the order added
+        order = np.lexsort((columns[1], columns[0]))
+        for column, values in zip(TRIPLE_COLUMNS, columns):
+            with open(self._column_path(column), 'ab') as fout:
+                values[order].tofile(fout)
+        self.run_bounds.append(self.run_bounds[-1] + len(order))
+        self.chunk = tuple(array('q') for _ in TRIPLE_COLUMNS)
+
+    def _iter_run(self, columns, start, end):
+        for block_start in range(start, end, self.block_size):
+            block_end = min(block_start + self.block_size, end)
+            for triple in zip(*[column[block_start:block_end].tolist() for column in columns]):
+                yield triple
+
+    def __iter__(self):
+        """Yield (root_id, retweet_id, followers) in order, one triple per retweet of a root,
+        so that a retweet added more than once, e.g., of a duplicate tweet, is yielded once, as it was first added."""
+        self._spill()
+        if len(self.run_bounds) == 1:
+            return
+        columns = [np.memmap(self._column_path(column), dtype=np.int64, mode='r') for column in TRIPLE_COLUMNS]
+        runs = [self._iter_run(columns, start, end) for start, end in zip(self.run_bounds[:-1], self.run_bounds[1:])]
+        last_pair = None
+        # on ties heapq.merge yields from the earlier run first
+        for triple in runs[0] if len(runs) == 1 else heapq.merge(*runs, key=itemgetter(0, 1)):
+            if triple[:2] != last_pair:
+                yield triple
+                last_pair = triple[:2]
+
+    def cascades(self):
+        """Yield (root_id, [(retweet_id, followers)]) of each root in order, retweets in tweet id order."""
+        for root_id, triples in groupby(self, key=itemgetter(0)):
+            yield root_id, [(retweet_id, followers) for _, retweet_id, followers in triples]
+
+    def dump(self, text_output, binary_dir=None):
+        """Write cascades as text lines into an open text_output, and as binary columns into binary_dir if given.
+        The binary columns are written into a temporary directory, which replaces binary_dir."""
+        binary_outputs = None
+        if binary_dir is not None:
+            tmp_binary_dir = '{0}.tmp'.format(binary_dir)
+            if os.path.exists(tmp_binary_dir):
+                shutil.rmtree(tmp_binary_dir)
+            os.makedirs(tmp_binary_dir)
+            binary_outputs = {column: open(os.path.join(tmp_binary_dir, '{0}.bin'.format(column)), 'wb')
+                              for column in BINARY_COLUMNS}
+            binary_buffers = {column: array('q') for column in BINARY_COLUMNS}
+            binary_buffers['offsets'].append(0)
+
+        offset = 0
+        for root_id, retweets in self.cascades():
+            text_output.write('{0}:{1}\n'.format(root_id, ','.join(['{0}-{1}'.format(retweet_id, format_followers(followers))
+                                                                    for retweet_id, followers in retweets])))
+            if binary_outputs is not None:
+                offset += len(retweets)
+                binary_buffers['root_ids'].append(root_id)
+                binary_buffers['offsets'].append(offset)
+                binary_buffers['retweet_ids'].extend([retweet_id for retweet_id, _ in retweets])
+                binary_buffers['followers'].extend([followers for _, followers in retweets])
+                if len(binary_buffers['retweet_ids']) >= self.chunk_size:
+                    self._flush_binary(binary_outputs, binary_buffers)
+
+        if binary_outputs is not None:
+            self._flush_binary(binary_outputs, binary_buffers)
+            for binary_output in binary_outputs.values():
+                binary_output.close()
+            if os.path.exists(binary_dir):
+                shutil.rmtree(binary_dir)
+            os.replace(tmp_binary_dir, binary_dir)
+
+    @staticmethod
+    def _flush_binary(binary_outputs, binary_buffers):
+        for column, binary_buffer in binary_buffers.items():
+            binary_buffer.tofile(binary_outputs[column])
+            del binary_buffer[:]
+
+    def close(self):
+        """Drop all triples and remove the column buffer."""
+        if self.buffer_dir is not None:
+            shutil.rmtree(self.buffer_dir, ignore_errors=True)
+        self.buffer_dir = None
+        self.chunk = tuple(array('q') for _ in TRIPLE_COLUMNS)
+        self.run_bounds = [0]
+
+
+def _load_column(path):
+    if os.path.getsize(path) == 0:
+        # an empty file cannot be memory-mapped
+        return np.zeros(0, dtype=np.int64)
+    return np.memmap(path, dtype=np.int64, mode='r')
+
+
+def load_retweet_cascades(binary_dir):
+    """Memory-map the binary columns of retweet cascades, return {column: int64 array}."""
+    return {column: _load_column(os.path.join(binary_dir, '{0}.bin'.format(column))) for column in BINARY_COLUMNS}
+
+
+def get_retweet_cascade(cascades, root_id):
+    """Return (retweet_ids, followers) of root_id in memory-mapped cascades, None if root_id has no cascade."""
+    root_ids = cascades['root_ids']
+    idx = np.searchsorted(root_ids, root_id)
+    if idx == len(root_ids) or root_ids[idx] != root_id:
+        return None
+    start, end = cascades['offsets'][idx], cascades['offsets'][idx + 1]
+    return cascades['retweet_ids'][start:end], cascades['followers'][start:end]
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+
+""" Sinks of tweet status records.
+1. csv:     comma-joined text lines, compressed by the given codec (bz2 by default, see utils/codec.py),
+            rate limit message as 'ratemsg,timestamp_ms,track'
+2. parquet: typed columns, int64 ids, int32 counts, dictionary-encoded lang, filter, country code and geoname,
+            rate limit message as a row with track, timestamp_ms and null tweet_id_str.
+            A parquet file is a row group per PARQUET_ROW_GROUP_SIZE records, readers can load only the columns they need.
+With dict_encode, the lang, filter, country code and geoname columns of csv are written as integer codes,
+and the codes are listed in a side dictionary file, see StatusDictionary.
+Readers of such csv decode the records by decode_record() with the dictionary of load_status_dictionary().
+"""
+
+import sys, os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
+from utils.helper import strify
+from utils.codec import CODEC_EXTENSIONS, open_file
+
+# column names of the tweet status record, in output order
+TWEET_STATUS_FIELDS = ('tweet_id_str', 'created_at', 'timestamp_ms', 'user_id_str',
+                       'original_lang', 'retweeted_lang', 'quoted_lang',
+                       'original_vids', 'retweeted_vids', 'quoted_vids',
+                       'original_mentions', 'retweeted_mentions', 'quoted_mentions',
+                       'original_hashtags', 'retweeted_hashtags', 'quoted_hashtags',
+                       'original_geoname', 'retweeted_geoname', 'quoted_geoname',
+                       'original_countrycode', 'retweeted_countrycode', 'quoted_countrycode',
+                       'original_filter', 'retweeted_filter', 'quoted_filter',
+                       'original_retweet_count', 'retweeted_retweet_count', 'quoted_retweet_count',
+                       'original_favorite_count', 'retweeted_favorite_count', 'quoted_favorite_count',
+                       'original_user_followers_count', 'retweeted_user_followers_count', 'quoted_user_followers_count',
+                       'original_user_friends_count', 'retweeted_user_friends_count', 'quoted_user_friends_count',
+                       'original_user_statuses_count', 'retweeted_user_statuses_count', 'quoted_user_statuses_count',
+                       'original_user_favourites_count', 'retweeted_user_favourites_count', 'quoted_user_favourites_count',
+                       'reply_tweet_id_str', 'retweeted_tweet_id_str', 'quoted_tweet_id_str',
+                       'reply_user_id_str', 'retweeted_user_id_str', 'quoted_user_id_str',
+                       'original_text', 'retweeted_text', 'quoted_text')
+TWEET_STATUS_INDEX = {field: idx for idx, field in enumerate(TWEET_STATUS_FIELDS)}
+
+# first field of a rate limit message record (ratemsg, timestamp_ms, track), which marks it apart from tweet status records
+RATEMSG = 'ratemsg'
+
+# a projection starts with one of these numeric fields, so that no tweet status record starts with RATEMSG
+RECORD_KEY_FIELDS = ('tweet_id_str', 'timestamp_ms')
+
+STATUS_FORMATS = ('csv', 'parquet')
+
+# number of records buffered in columns before they are written as a row group
+PARQUET_ROW_GROUP_SIZE = 100000
+
+
+def _status_field_type(field):
+    if field.endswith('_id_str') or field == 'timestamp_ms':
+        return 'id'
+    if field.endswith('_count'):
+        return 'count'
+    if field.endswith('_lang') or field.endswith('_filter') or field.endswith('_countrycode') \
+            or field.endswith('_geoname'):
+        return 'category'
+    return 'string'
+
+
+STATUS_FIELD_TYPES = {field: _status_field_type(field) for field in TWEET_STATUS_FIELDS}
+
+# low-cardinality columns that are dictionary encoded in csv, columns of a group share codes,
+# e.g., original_lang, retweeted_lang and quoted_lang
+DICT_ENCODED_GROUPS = ('lang', 'filter', 'countrycode', 'geoname')
+
+
+def dict_encoded_fields(fields=TWEET_STATUS_FIELDS):
+    """Return (index, group) of the dictionary encoded columns among fields."""
+    return tuple((idx, field.rsplit('_', 1)[1]) for idx, field in enumerate(fields)
+                 if field.rsplit('_', 1)[1] in DICT_ENCODED_GROUPS)
+
+
+def _arrow_type(field_type):
+    return {'id': pa.int64(), 'count': pa.int32(), 'category': pa.dictionary(pa.int32(), pa.string()),
+            'string': pa.string()}[field_type]
+
+
+def status_schema(fields=TWEET_STATUS_FIELDS):
+    """Arrow schema of the tweet status table, track is only set for rate limit messages.
+    timestamp_ms is always included, as rate limit messages need it."""
+    if pa is None:
+        raise ImportError('pyarrow is required for parquet tweet status, pip install pyarrow')
+    columns = list(fields)
+    if 'timestamp_ms' not in columns:
+        columns.append('timestamp_ms')
+    return pa.schema([pa.field(field, _arrow_type(STATUS_FIELD_TYPES[field])) for field in columns] +
+                     [pa.field('track', pa.int64())])
+
+
+def write_status_fields(path, fields):
+    """Write the field names of tweet status files into a schema file, as one comma-joined line."""
+    with open(path, 'w') as fout:
+        fout.write('{0}\n'.format(strify(fields)))
+
+
+def load_status_fields(path):
+    """Load the field names of tweet status files from a schema file, all fields if the file does not exist."""
+    if not os.path.exists(path):
+        return TWEET_STATUS_FIELDS
+    with open(path, 'r') as fin:
+        return tuple(fin.readline().rstrip().split(','))
+
+
+def is_ratemsg_record(record):
+    """Tell a rate limit message record from a tweet status record by its first field,
+    so a projection of any number of fields can be told apart, as long as it starts with one of RECORD_KEY_FIELDS."""
+    return record[0] == RATEMSG
+
+
+def _to_int(value):
+    if value == 'N' or value is None:
+        return None
+    return int(value)
+
+
+def _to_str(value):
+    if value == 'N' or value is None:
+        return None
+    return value
+
+
+class CsvStatusSink(object):
+    """Write tweet status records as comma-joined lines into a file compressed by codec.
+    Lines go into a temporary file, which is renamed to path on close."""
+
+    def __init__(self, path, codec='bz2'):
+        self.path = path
+        self.output = open_file('{0}.tmp'.format(path), 'w', codec=codec)
+
+    @staticmethod
+    def serialize(records):
+        """Format records into text, so that formatting can be done apart from compressing and writing."""
+        return ''.join(['{0}\n'.format(strify(map(str, record))) for record in records])
+
+    def write(self, record):
+        self.output.write('{0}\n'.format(strify(map(str, record))))
+
+    def write_serialized(self, text):
+        self.output.write(text)
+
+    def close(self):
+        self.output.close()
+        os.replace('{0}.tmp'.format(self.path), self.path)
+
+    def discard(self):
+        """Close and remove the temporary file, leave no output."""
+        self.output.close()
+        os.remove('{0}.tmp'.format(self.path))
+
+
+class ParquetStatusSink(object):
+    """Buffer tweet status records in columns, write them as a row group into a parquet file every row_group_size records.
+    The parquet file is written into a temporary file, which is renamed to path on close."""
+
+    def __init__(self, path, fields=TWEET_STATUS_FIELDS, row_group_size=PARQUET_ROW_GROUP_SIZE):
+        self.schema = status_schema(fields)
+        self.path = path
+        self.fields = fields
+        self.row_group_size = row_group_size
+        self.columns = {field: [] for field in self.schema.names}
+        self.num_rows = 0
+        self.converters = [_to_int if STATUS_FIELD_TYPES[field] in ('id', 'count') else _to_str for field in fields]
+        self.writer = pq.ParquetWriter('{0}.tmp'.format(path), self.schema)
+
+    def write(self, record):
+        if is_ratemsg_record(record):
+            # ratemsg, timestamp_ms, track
+            for field in self.schema.names:
+                self.columns[field].append(None)
+            self.columns['timestamp_ms'][-1] = int(record[1])
+            self.columns['track'][-1] = int(record[2])
+        else:
+            for field, convert, value in zip(self.fields, self.converters, record):
+                self.columns[field].append(convert(value))
+            for field in self.schema.names[len(self.fields):]:
+                self.columns[field].append(None)
+        self.num_rows += 1
+        if self.num_rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        """Write the buffered columns as a row group."""
+        if self.num_rows > 0:
+            self.writer.write_table(pa.Table.from_pydict(self.columns, schema=self.schema))
+            self.columns = {field: [] for field in self.schema.names}
+            self.num_rows = 0
+
+    @staticmethod
+    def serialize(records):
+        """Records are converted into columns on write."""
+        return list(records)
+
+    def write_serialized(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+        os.replace('{0}.tmp'.format(self.path), self.path)
+
+    def discard(self):
+        """Drop the buffered columns, close and remove the temporary file, leave no output."""
+        self.columns = {field: [] for field in self.schema.names}
+        self.num_rows = 0
+        self.writer.close()
+        os.remove('{0}.tmp'.format(self.path))
+
+
+def status_path(path, status_format='csv', codec='bz2'):
+    """Append the extension of status_format and codec to a path without extension,
+    a csv file without compression is a .txt file."""
+    if status_format == 'parquet':
+        return '{0}.parquet'.format(path)
+    return '{0}{1}'.format(path, CODEC_EXTENSIONS[codec] or '.txt')
+
+
+def serialize_records(records, status_format='csv'):
+    """Serialize records for the sink of status_format, see write_serialized."""
+    if status_format == 'csv':
+        return CsvStatusSink.serialize(records)
+    elif status_format == 'parquet':
+        return ParquetStatusSink.serialize(records)
+    raise ValueError('Unknown tweet status format {0}, choose from {1}'.format(status_format, STATUS_FORMATS))
+
+
+def open_status_sink(path, status_format='csv', codec='bz2', fields=TWEET_STATUS_FIELDS):
+    """Open a tweet status sink, path has no extension, the extension of status_format and codec is appended."""
+    if status_format == 'csv':
+        return CsvStatusSink(status_path(path, status_format, codec), codec)
+    elif status_format == 'parquet':
+        return ParquetStatusSink(status_path(path, status_format), fields)
+    raise ValueError('Unknown tweet status format {0}, choose from {1}'.format(status_format, STATUS_FORMATS))
+
+
+class StatusDictionary(object):
+    """ Dictionary of low-cardinality tweet status columns, interned per extractor process.
+
+    :param path: path of the dictionary file, in lines of 'group,code,value'
+    :param fields: field names of the tweet status records
+
+    Each worker process assigns codes on its own, from a code space of its worker index modulo the number of workers,
+    so that no code is shared with another process and no lookup crosses processes, see start_worker().
+    A value met by several workers may get several codes, every code decodes to one value.
+    A new code is appended to the dictionary file of the worker, [path].[worker_idx], once it is assigned,
+    so that files written before a crash can still be decoded. Worker files are merged into the dictionary file
+    by merge_worker_files() once the workers have finished, or when a resumed run opens the dictionary,
+    and a resumed run continues after the largest code.
+    """
+
+    def __init__(self, path, fields=TWEET_STATUS_FIELDS):
+        self.path = path
+        self.encoded_fields = dict_encoded_fields(fields)
+        self.merge_worker_files()
+        self.codes = load_status_codes(path)
+        self.next_code = max(self.codes.values()) + 1 if len(self.codes) > 0 else 0
+        self.code_step = 1
+        self.worker_path = None
+        self.worker_output = None
+
+    def _worker_paths(self):
+        dirname, basename = os.path.split(self.path)
+        prefix = '{0}.'.format(basename)
+        return [os.path.join(dirname, f) for f in sorted(os.listdir(dirname or '.'))
+                if f.startswith(prefix) and f[len(prefix):].isdigit()]
+
+    def merge_worker_files(self):
+        """Append the codes of worker dictionary files to the dictionary file, then remove the worker files."""
+        worker_paths = self._worker_paths()
+        if len(worker_paths) == 0:
+            return
+        with open(self.path, 'a', encoding='utf-8') as fout:
+            for worker_path in worker_paths:
+                with open(worker_path, 'r', encoding='utf-8') as fin:
+                    for line in fin:
+                        # a partial line of an interrupted write has no code for any written record
+                        if line.endswith('\n'):
+                            fout.write(line)
+        for worker_path in worker_paths:
+            os.remove(worker_path)
+
+    def reset(self):
+        """Forget all codes."""
+        self.codes = {}
+        self.next_code = 0
+        for path in [self.path] + self._worker_paths():
+            if os.path.exists(path):
+                os.remove(path)
+
+    def start_worker(self, worker_idx, num_workers):
+        """Take the code space of a worker, called in the worker process before it encodes any record."""
+        self.next_code += worker_idx
+        self.code_step = num_workers
+        self.worker_path = '{0}.{1}'.format(self.path, worker_idx)
+
+    def close_worker(self):
+        """Close the dictionary file of a worker, called in the worker process once it has finished."""
+        if self.worker_output is not None:
+            self.worker_output.close()
+            self.worker_output = None
+
+    def encode(self, group, value):
+        if value == 'N':
+            return value
+        key = (group, value)
+        code = self.codes.get(key)
+        if code is None:
+            code = self.next_code
+            self.next_code += self.code_step
+            self.codes[key] = code
+            if self.worker_output is None:
+                self.worker_output = open(self.worker_path or self.path, 'a', encoding='utf-8')
+            self.worker_output.write('{0},{1},{2}\n'.format(group, code, value))
+            self.worker_output.flush()
+        return code
+
+    def encode_record(self, record):
+        """Replace the values of dictionary encoded columns in a tweet status record by their codes."""
+        if is_ratemsg_record(record):
+            # ratemsg, timestamp_ms, track
+            return record
+        record = list(record)
+        for idx, group in self.encoded_fields:
+            record[idx] = self.encode(group, record[idx])
+        return record
+
+
+def load_status_codes(path):
+    """Load {(group, value): code} from a dictionary file, empty if the file does not exist.
+    A value with several codes keeps the largest one."""
+    codes = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                group, code, value = line.rstrip('\n').split(',', 2)
+                codes[(group, value)] = max(int(code), codes.get((group, value), -1))
+    return codes
+
+
+def load_status_dictionary(path):
+    """Load {group: {code: value}} from a dictionary file, to decode dictionary encoded columns.
+    Every code of a value met by several workers is kept."""
+    dictionary = {group: {} for group in DICT_ENCODED_GROUPS}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as fin:
+            for line in fin:
+                group, code, value = line.rstrip('\n').split(',', 2)
+                dictionary[group][code] = value
+    return dictionary
+
+
+def decode_record(record, dictionary, fields=TWEET_STATUS_FIELDS):
+    """Replace the codes of dictionary encoded columns in a csv tweet status record by their values,
+    the inverse of StatusDictionary.encode_record, dictionary is loaded by load_status_dictionary()."""
+    if is_ratemsg_record(record):
+        # ratemsg, timestamp_ms, track
+        return record
+    record = list(record)
+    for idx, group in dict_encoded_fields(fields):
+        if record[idx] != 'N':
+            record[idx] = dictionary[group][str(record[idx])]
+    return record
+
+
+def merge_parquet_files(input_paths, output_path):
+    """Merge parquet tweet status files into one, row group by row group, so that a row group is in memory at a time."""
+    schema = pq.read_schema(input_paths[0]) if len(input_paths) > 0 else status_schema()
+    writer = pq.ParquetWriter(output_path, schema)
+    for input_path in input_paths:
+        parquet_file = pq.ParquetFile(input_path)
+        for row_group_idx in range(parquet_file.num_row_groups):
+            writer.write_table(parquet_file.read_row_group(row_group_idx))
+    writer.close()
+
+
+def read_parquet_records(path, fields):
+    """Read only the given columns of a parquet tweet status file.
+    Yield ('ratemsg', timestamp_ms, track) for rate limit messages, and tuples of fields for tweet status,
+    values are in their csv text form, null as 'N'.
+    """
+    columns = list(fields)
+    for extra_field in ('timestamp_ms', 'track'):
+        if extra_field not in columns:
+            columns.append(extra_field)
+    timestamp_idx = columns.index('timestamp_ms')
+    track_idx = columns.index('track')
+
+    parquet_file = pq.ParquetFile(path)
+    for batch in parquet_file.iter_batches(columns=columns):
+        values = [batch.column(field).to_pylist() for field in columns]
+        for row in zip(*values):
+            if row[track_idx] is not None:
+                yield RATEMSG, str(row[timestamp_idx]), str(row[track_idx])
+            else:
+                yield tuple('N' if value is None else str(value) for value in row[:len(fields)])
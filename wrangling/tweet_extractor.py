@@ -22,12 +22,87 @@
 3. ratemsg, timestamp_ms, track
 """
 
-import sys, os, bz2, re, json, logging, logging.config
+import sys, os, io, bz2, re, time, logging, logging.config
+from array import array
 from datetime import datetime
-from multiprocessing import Process, Queue
+from functools import lru_cache
+from collections import defaultdict
+from multiprocessing import Process, Queue, Lock
+from queue import Empty
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../'))
 from utils.helper import strify, str2obj, obj2str
+from utils.bz2block import split_bz2_file
+from utils.json_decoder import JsonDecoder
+from utils.manifest import Manifest
+from utils.codec import open_file
+from utils.idset import SharedIdSet
+from wrangling.status_sink import TWEET_STATUS_FIELDS, TWEET_STATUS_INDEX, RATEMSG, RECORD_KEY_FIELDS, StatusDictionary, \
+    open_status_sink, status_path, serialize_records, write_status_fields
+
+# stream message types, told apart by the first key of a raw line
+STATUS_MESSAGE = 'status'
+LIMIT_MESSAGE = 'limit'
+DELETE_MESSAGE = 'delete'
+DISCONNECT_MESSAGE = 'disconnect'
+OTHER_MESSAGE = 'other'
+MESSAGE_PREFIXES = ((b'{"created_at":', STATUS_MESSAGE),
+                    (b'{"limit":', LIMIT_MESSAGE),
+                    (b'{"delete":', DELETE_MESSAGE),
+                    (b'{"disconnect":', DISCONNECT_MESSAGE))
+LIMIT_PATTERN = re.compile(rb'^\s*\{"limit":\s*\{"track":\s*(\d+),\s*"timestamp_ms":\s*"(\d+)"\}\}\s*$')
+
+# a youtube video id is 11 alphanumeric, dash or underline characters,
+# after the first 'v=' of a watch url, or at the start of the last path segment of a youtu.be url
+WATCH_VID_PATTERN = re.compile(r'^(?:(?!v=).)*v=([\w-]{11})', re.DOTALL)
+SHORT_VID_PATTERN = re.compile(r'(?:^|/)([\w-]{11})[^/]*\Z')
+# number of expanded urls whose video id is cached in each process, viral urls repeat millions of times
+VID_CACHE_SIZE = 1 << 16
+# keys of the video id cache hits and misses in the stats of a task, next to the message types
+VID_CACHE_HITS = 'vid_cache_hits'
+VID_CACHE_MISSES = 'vid_cache_misses'
+# seconds to wait on a queue that workers put into, before checking that the workers are still alive
+WORKER_POLL_SECONDS = 5
+
+
+@lru_cache(maxsize=VID_CACHE_SIZE)
+def extract_vid(expanded_url):
+    """Extract the youtube video id from an expanded url, None if it is not a youtube video url."""
+    if 'watch?' in expanded_url and 'v=' in expanded_url:
+        match = WATCH_VID_PATTERN.match(expanded_url)
+    elif 'youtu.be' in expanded_url:
+        match = SHORT_VID_PATTERN.search(expanded_url)
+    else:
+        return None
+    if match is None:
+        return None
+    return match.group(1)
+
+
+# the original, retweeted and quoted status, by the prefix of a tweet status field
+STATUS_PREFIXES = {'original': None, 'retweeted': 'retweeted_status', 'quoted': 'quoted_status'}
+
+# number of line batches each queue of the staged pipeline holds per parse process
+PIPELINE_QUEUE_BATCHES = 4
+
+
+def classify_message(line):
+    """Classify a raw stream line as status, limit, delete, disconnect or other message without decoding it."""
+    line = line.lstrip()
+    for prefix, message_type in MESSAGE_PREFIXES:
+        if line.startswith(prefix):
+            return message_type
+    return OTHER_MESSAGE
+
+
+def parse_limit_message(line):
+    """Parse (timestamp_ms, track) from a raw rate limit message, None if it is not in the usual layout.
+    e.g., {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}
+    """
+    match = LIMIT_PATTERN.match(line)
+    if match is None:
+        return None
+    return match.group(2).decode('ascii'), int(match.group(1))
 
 
 class TweetExtractor(object):
@@ -35,6 +110,31 @@ class TweetExtractor(object):
 
     :param input_dir: directory that contains all tweet bz2 files
     :param output_dir: directory that composes of 2 folders -- tweet_stats and user_stats
+    :param chunk_size: bz2 files larger than chunk_size bytes are split into chunks at bz2 block boundaries,
+                       each chunk is extracted by one process into [filename]-[chunk_idx].bz2. Files are only split
+                       with more than one worker, or more than one decompress process of stage_procs
+    :param json_backend: JSON decoder backend, 'auto' picks the fastest installed one, see utils/json_decoder.py
+    :param status_format: format of tweet status files, 'csv' or 'parquet', see wrangling/status_sink.py
+    :param codec: compression codec of tweet status and user status files, 'bz2', 'zstd', 'lz4', 'gzip' or 'none',
+                  see utils/codec.py
+    :param dict_encode: write lang, filter, country code and geoname of csv tweet status as integer codes,
+                        the codes are listed in [output_dir]/dictionary.txt, see StatusDictionary in status_sink.py.
+                        Each process assigns its own codes, so a value may have one code per process
+    :param user_capacity: number of slots in the user id set shared by all processes, so that a user profile is written
+                          once per run rather than once per input file, see utils/idset.py.
+                          The profile written is a snapshot from whichever task meets the user first, tasks run
+                          concurrently, so it is not the chronologically first one and may differ between runs.
+                          A profile is not written again when it changes later in the crawl, there is no
+                          profile-change window, tweet status keeps the counts of every tweet for that.
+    :param fields: projection of tweet status fields to extract, in output order, None for all TWEET_STATUS_FIELDS.
+                   It starts with tweet_id_str or timestamp_ms, so that no record is taken for a rate limit message.
+                   The field names are written into [output_dir]/schema.txt
+    :param stage_procs: (decompress, parse, write) numbers of processes of the staged pipeline, see _run_pipeline,
+                        None to extract each task in a single process
+    :param batch_size: number of lines in a batch passed between pipeline stages
+    :param resume: skip input files and chunks that are recorded as done in [output_dir]/manifest.jsonl,
+                   otherwise the manifest is cleared and all input files are extracted again. A task is done only while
+                   its outputs exist, and all are extracted again if status_format, codec, fields or dict_encode change
 
     For a tweet, the dictionaries must include the following fields:
 
@@ -59,23 +159,86 @@ class TweetExtractor(object):
                       extended_tweet: entities: urls: expanded_url
     """
 
-    def __init__(self, input_dir, output_dir, proc_num=1):
+    def __init__(self, input_dir, output_dir, proc_num=1, chunk_size=128 * 1024 * 1024, json_backend='auto',
+                 status_format='csv', codec='bz2', dict_encode=False, user_capacity=1 << 24, fields=None, stage_procs=None, batch_size=1000, resume=True):
         self.input_dir = input_dir
         self.output_dir = output_dir
         self.proc_num = proc_num
+        self.chunk_size = chunk_size
+        self.json_backend = json_backend
+        self.status_format = status_format
+        self.codec = codec
+        self.dict_encode = dict_encode
+        self.user_capacity = user_capacity
+        self.fields = None
+        self._status_record = None
+        self.set_fields(fields)
+        self.stage_procs = stage_procs
+        self.batch_size = batch_size
+        self.resume = resume
+        self.dictionary = None
+        self.visited_user_ids = None
+        # output filenames of the tasks of the last run, see _list_input_tasks
+        self.task_filenames = []
         self.logger = None
 
         self.tweet_stats_path = "{0}/{1}".format(output_dir, 'tweet_stats')
         self.user_stats_path = "{0}/{1}".format(output_dir, 'user_stats')
+        # entity record files of extract_fused, created once it runs
+        self.entity_stats_path = "{0}/{1}".format(output_dir, 'entity_stats')
         os.makedirs(self.tweet_stats_path, exist_ok=True)
         os.makedirs(self.user_stats_path, exist_ok=True)
 
+        # the lock is inherited by workers, so that manifest lines are appended one at a time
+        self.manifest = Manifest(os.path.join(output_dir, 'manifest.jsonl'), Lock())
+
         self._setup_logger('tweetextractor')
 
     def set_proc_num(self, n):
         """Set the number of processes used in extracting."""
         self.proc_num = n
 
+    def set_chunk_size(self, n):
+        """Set the size in bytes above which a bz2 file is split into chunks, None to never split."""
+        self.chunk_size = n
+
+    def set_json_backend(self, backend):
+        """Set the JSON decoder backend used in extracting."""
+        self.json_backend = backend
+
+    def set_status_format(self, status_format):
+        """Set the format of tweet status files, 'csv' or 'parquet'."""
+        self.status_format = status_format
+
+    def set_codec(self, codec):
+        """Set the compression codec of tweet status and user status files."""
+        self.codec = codec
+
+    def set_dict_encode(self, dict_encode):
+        """Set whether to write low-cardinality columns of csv tweet status as integer codes."""
+        self.dict_encode = dict_encode
+
+    def set_user_capacity(self, n):
+        """Set the number of slots in the shared user id set."""
+        self.user_capacity = n
+
+    def set_fields(self, fields):
+        """Set the projection of tweet status fields to extract, None for all fields."""
+        self._status_record = self._compile_projection(fields)
+        self.fields = TWEET_STATUS_FIELDS if fields is None else tuple(fields)
+
+    def set_stage_procs(self, num_decompress, num_parse, num_write):
+        """Set the numbers of processes of the staged pipeline, which replaces proc_num in extract."""
+        self.stage_procs = (num_decompress, num_parse, num_write)
+
+    def set_batch_size(self, n):
+        """Set the number of lines in a batch passed between pipeline stages."""
+        self.batch_size = n
+
+    def set_resume(self, resume):
+        """Set whether to skip input files and chunks that are recorded as done in the manifest."""
+        self.resume = resume
+
     def _setup_logger(self, logger_name):
         """Set logger from conf file."""
         log_dir = '../log/'
@@ -94,43 +257,503 @@ class TweetExtractor(object):
     def _replace_comma_space(text):
         return re.sub(',\\s*|\s+', ' ', text)
 
-    def extract(self):
-        self.logger.debug('**> Start extracting tweet status from tweet bz2 files...')
-
-        processes = []
-        filequeue = Queue()
+    @staticmethod
+    def _intern(obj):
+        # low-cardinality strings repeat in millions of tweets, keep one copy of each per process
+        if isinstance(obj, str):
+            return sys.intern(obj)
+        return obj
 
+    def _list_input_files(self):
+        filepaths = []
         for subdir, _, files in os.walk(self.input_dir):
             for f in sorted(files):
                 filename, filetype = f.split('.')
                 if filetype == 'bz2':
-                    filepath = os.path.join(subdir, f)
-                    filequeue.put(filepath)
+                    filepaths.append(os.path.join(subdir, f))
+        return filepaths
+
+    def _list_input_tasks(self, skip_done=False):
+        """List (filepath, chunk) tasks, chunk is None for a whole file.
+        If skip_done, leave out the tasks that are recorded as done in the manifest.
+        The output filenames of all tasks of this run, done or not, are kept in task_filenames."""
+        tasks = []
+        self.task_filenames = []
+        num_skipped = 0
+        # chunks of a file are decompressed in parallel by the workers, or by the decompress stage of the pipeline
+        num_decompress = self.proc_num if self.stage_procs is None else self.stage_procs[0]
+        for filepath in self._list_input_files():
+            if skip_done and self.manifest.is_file_done(filepath):
+                # the outputs of the split that is done, which may differ from the split of this run
+                self.task_filenames.extend(self._output_filename(filepath, entry['chunk'])
+                                           for entry in self.manifest.file_entries(filepath))
+                num_skipped += 1
+                continue
+            if num_decompress > 1 and self.chunk_size is not None and os.path.getsize(filepath) > self.chunk_size:
+                try:
+                    chunks = split_bz2_file(filepath, self.chunk_size)
+                except (OSError, ValueError):
+                    chunks = []
+                if len(chunks) > 1:
+                    self.logger.debug('Split {0} into {1} chunks'.format(filepath, len(chunks)))
+                    for chunk in chunks:
+                        self.task_filenames.append(self._task_filename((filepath, chunk)))
+                        if skip_done and self._is_task_done((filepath, chunk)):
+                            num_skipped += 1
+                        else:
+                            tasks.append((filepath, chunk))
+                    continue
+            self.task_filenames.append(self._task_filename((filepath, None)))
+            if skip_done and self._is_task_done((filepath, None)):
+                num_skipped += 1
+                continue
+            tasks.append((filepath, None))
+        if num_skipped > 0:
+            self.logger.info('Skip {0} files or chunks that are done in an earlier run'.format(num_skipped))
+            print('>>> Skip {0} files or chunks that are done in an earlier run'.format(num_skipped))
+        return tasks
+
+    def _is_task_done(self, task):
+        filepath, chunk = task
+        if chunk is None:
+            return self.manifest.is_done(filepath)
+        start, end = chunk.byte_range()
+        return self.manifest.is_done(filepath, chunk.index, start, end, chunk.bit_range())
+
+    def _mark_task_done(self, task, outputs):
+        filepath, chunk = task
+        if chunk is None:
+            self.manifest.mark_done(filepath, outputs=outputs)
+        else:
+            start, end = chunk.byte_range()
+            self.manifest.mark_done(filepath, chunk.index, chunk.num_chunks, start, end, chunk.bit_range(), outputs)
+
+    def _output_config(self, fused=False):
+        """The settings that shape the outputs of a task, a task done under other settings is extracted again.
+        Entity record files of extract_fused are uncompressed csv of the fields, whatever the status format."""
+        if fused:
+            return {'codec': self.codec, 'fields': list(self.fields)}
+        return {'status_format': self.status_format, 'codec': self.codec, 'fields': list(self.fields),
+                'dict_encode': self.dict_encode and self.status_format == 'csv'}
+
+    def _set_manifest_config(self, fused=False):
+        """Set the output config of the manifest, return True if tasks of an earlier run were forgotten under it."""
+        if self.manifest.set_config(self._output_config(fused)):
+            self.logger.info('Output config differs from the earlier run, extract all files again')
+            print('>>> Output config differs from the earlier run, extract all files again')
+            return True
+        return False
 
+    @staticmethod
+    def _output_filename(filepath, chunk_index):
+        """Output filename of a file or its chunk of chunk_index, without extension."""
+        filename, filetype = os.path.basename(os.path.normpath(filepath)).split('.')
+        if chunk_index is None:
+            return filename
+        return '{0}-{1:04d}'.format(filename, chunk_index)
+
+    def _task_filename(self, task):
+        """Output filename of a task, without extension."""
+        filepath, chunk = task
+        return self._output_filename(filepath, None if chunk is None else chunk.index)
+
+    def _open_task(self, task):
+        """Open the lines of a task, return them with the output filename."""
+        filepath, chunk = task
+        filename = self._task_filename(task)
+        if chunk is None:
+            return bz2.BZ2File(filepath, mode='r'), filename
+        return chunk, filename
+
+    @staticmethod
+    def _task_size(task):
+        filepath, chunk = task
+        if chunk is None:
+            return os.path.getsize(filepath)
+        return len(chunk)
+
+    def _run_workers(self, process_task, tasks, *args):
+        """Start proc_num processes that run process_task(task, *args) over tasks, return them with the stats queue.
+
+        Tasks are queued in the given order followed by a None sentinel per worker, an idle worker takes the next
+        task until it meets a sentinel.
+        """
+        taskqueue = Queue()
+        statsqueue = Queue()
+        for task in tasks:
+            taskqueue.put(task)
+        for w in range(self.proc_num):
+            taskqueue.put(None)
+
+        processes = []
         for w in range(self.proc_num):
-            p = Process(target=self._extract_tweet, args=(filequeue,))
+            p = Process(target=self._run_worker, args=(w, process_task, taskqueue, statsqueue) + args)
             p.daemon = True
             p.start()
             processes.append(p)
+        return processes, statsqueue
 
+    def _run_worker(self, worker_idx, process_task, taskqueue, statsqueue, *args):
+        start_time = time.time()
+        num_tasks = 0
+        busy_time = 0
+        if self.dictionary is not None:
+            self.dictionary.start_worker(worker_idx, self.proc_num)
+        for task in iter(taskqueue.get, None):
+            task_start_time = time.time()
+            try:
+                process_task(task, *args)
+            except Exception:
+                self.logger.exception('Worker {0} failed on task {1}'.format(worker_idx, task))
+            busy_time += time.time() - task_start_time
+            num_tasks += 1
+        if self.dictionary is not None:
+            self.dictionary.close_worker()
+        statsqueue.put((worker_idx, num_tasks, busy_time, time.time() - start_time))
+
+    @staticmethod
+    def _get_from_workers(queue, processes):
+        """Get an item that workers put into queue, raise RuntimeError once a worker has died or all workers
+        have exited without putting one, rather than block forever."""
+        while True:
+            try:
+                return queue.get(timeout=WORKER_POLL_SECONDS)
+            except Empty:
+                failed_processes = [p for p in processes if p.exitcode is not None and p.exitcode != 0]
+                if len(failed_processes) > 0:
+                    raise RuntimeError('Worker processes {0} exited with codes {1}'.format(
+                        [p.name for p in failed_processes], [p.exitcode for p in failed_processes]))
+                if all(p.exitcode is not None for p in processes):
+                    # an exited worker has flushed what it put
+                    try:
+                        return queue.get(timeout=WORKER_POLL_SECONDS)
+                    except Empty:
+                        raise RuntimeError('All worker processes exited before putting an item')
+
+    def _join_workers(self, processes, statsqueue, start_time):
+        """Wait for workers to finish, then log their utilization."""
+        worker_stats = sorted(self._get_from_workers(statsqueue, processes) for _ in processes)
         for p in processes:
             p.join()
+        return self._log_utilization(worker_stats, start_time)
 
-        self.logger.debug('**> Finish extracting tweet status from tweet bz2 files.')
+    def _log_utilization(self, worker_stats, start_time):
+        elapsed_time = time.time() - start_time
+        total_busy_time = 0
+        for worker_idx, num_tasks, busy_time, wall_time in worker_stats:
+            total_busy_time += busy_time
+            self.logger.info('Worker {0}: {1} tasks, busy {2:.1f}s of {3:.1f}s, utilization {4:.1%}'
+                             .format(worker_idx, num_tasks, busy_time, elapsed_time, busy_time / max(elapsed_time, 1e-9)))
+        utilization = total_busy_time / max(elapsed_time * len(worker_stats), 1e-9)
+        self.logger.info('Overall utilization of {0} workers: {1:.1%}'.format(len(worker_stats), utilization))
+        print('>>> Overall utilization of {0} workers: {1:.1%}'.format(len(worker_stats), utilization))
+        return worker_stats
 
-    @staticmethod
-    def _extract_vid_from_expanded_url(expanded_url):
-        if 'watch?' in expanded_url and 'v=' in expanded_url:
-            vid = expanded_url.split('v=')[1][:11]
-        elif 'youtu.be' in expanded_url:
-            vid = expanded_url.rsplit('/', 1)[-1][:11]
+    def _run_pipeline(self, tasks):
+        """Extract tasks in a staged pipeline of decompress, parse and write processes.
+
+        decompress: read the lines of a task and pass them on in batches, followed by an end marker with the number
+                    of batches.
+        parse:      decode the lines of a batch, and serialize the tweet status and user status records.
+        write:      compress and write the serialized batches of a task in input order, then finish its outputs once
+                    all its batches are written. Tasks are routed to write processes by task index, so that the
+                    outputs of a task are owned by one process.
+        Stages are connected by bounded queues, a stage that runs ahead blocks until the next stage catches up,
+        and every stage is sized to its own cost by stage_procs.
+        """
+        start_time = time.time()
+        num_decompress, num_parse, num_write = self.stage_procs
+        taskqueue = Queue()
+        batchqueue = Queue(maxsize=PIPELINE_QUEUE_BATCHES * num_parse)
+        writequeues = [Queue(maxsize=PIPELINE_QUEUE_BATCHES * num_parse) for _ in range(num_write)]
+        statsqueue = Queue()
+        for task_idx in range(len(tasks)):
+            taskqueue.put(task_idx)
+        for w in range(num_decompress):
+            taskqueue.put(None)
+
+        stages = [(self._decompress_stage, num_decompress, taskqueue, batchqueue),
+                  (self._parse_stage, num_parse, batchqueue, writequeues),
+                  (self._write_stage, num_write, writequeues, None)]
+        stage_processes = []
+        for target, num_procs, inqueue, outqueue in stages:
+            processes = []
+            for w in range(num_procs):
+                p = Process(target=target, args=(w, tasks, inqueue, outqueue, statsqueue))
+                p.daemon = True
+                p.start()
+                processes.append(p)
+            stage_processes.append(processes)
+
+        # a stage is stopped by sentinels once the stage before it has finished
+        decompressors, parsers, writers = stage_processes
+        for p in decompressors:
+            p.join()
+        for w in range(num_parse):
+            batchqueue.put(None)
+        for p in parsers:
+            p.join()
+        for writequeue in writequeues:
+            writequeue.put(None)
+        for p in writers:
+            p.join()
+
+        all_processes = decompressors + parsers + writers
+        worker_stats = sorted(self._get_from_workers(statsqueue, all_processes) for _ in all_processes)
+        self._log_utilization(worker_stats, start_time)
+
+    def _decompress_stage(self, worker_idx, tasks, taskqueue, batchqueue, statsqueue):
+        start_time = time.time()
+        num_batches_total = 0
+        wait_time = 0
+        for task_idx in iter(taskqueue.get, None):
+            task = tasks[task_idx]
+            num_batches = 0
+            failed = False
+            try:
+                filedata, filename = self._open_task(task)
+            except:
+                self.logger.warn('Exists non-bz2 file {0} in dataset folder'.format(task[0]))
+                batchqueue.put((task_idx, None, (num_batches, True)))
+                continue
+
+            try:
+                batch = []
+                for line in filedata:
+                    batch.append(line)
+                    if len(batch) == self.batch_size:
+                        put_start_time = time.time()
+                        batchqueue.put((task_idx, num_batches, batch))
+                        wait_time += time.time() - put_start_time
+                        num_batches += 1
+                        batch = []
+                if len(batch) > 0:
+                    batchqueue.put((task_idx, num_batches, batch))
+                    num_batches += 1
+            except Exception:
+                self.logger.exception('Failed to decompress {0}'.format(filename))
+                failed = True
+            finally:
+                filedata.close()
+            # the end marker may overtake batches in the parse stage, so it carries the number of batches
+            batchqueue.put((task_idx, None, (num_batches, failed)))
+            num_batches_total += num_batches
+        wall_time = time.time() - start_time
+        statsqueue.put(('decompress-{0}'.format(worker_idx), num_batches_total, wall_time - wait_time, wall_time))
+
+    def _parse_stage(self, worker_idx, tasks, batchqueue, writequeues, statsqueue):
+        start_time = time.time()
+        num_batches = 0
+        busy_time = 0
+        if self.dictionary is not None:
+            self.dictionary.start_worker(worker_idx, self.stage_procs[1])
+        for task_idx, seq, lines in iter(batchqueue.get, None):
+            writequeue = writequeues[task_idx % len(writequeues)]
+            if seq is None:
+                writequeue.put((task_idx, seq, lines))
+                continue
+            batch_start_time = time.time()
+            filename = self._task_filename(tasks[task_idx])
+            user_output = io.StringIO()
+            new_user_ids = array('q')
+            stats = defaultdict(int)
+            try:
+                records = []
+                for record in self._iter_records(lines, filename, user_output, new_user_ids, stats):
+                    if self.dictionary is not None:
+                        record = self.dictionary.encode_record(record)
+                    records.append(record)
+                # the ids of users first met in the batch go along, so that they are discarded if the task fails,
+                # and so do the stats of the batch, which are logged once per task
+                payload = serialize_records(records, self.status_format), user_output.getvalue(), new_user_ids, stats
+            except Exception:
+                self.logger.exception('Failed to parse batch {0} of {1}'.format(seq, filename))
+                for user_id in new_user_ids:
+                    self.visited_user_ids.discard(user_id)
+                payload = None
+            busy_time += time.time() - batch_start_time
+            num_batches += 1
+            writequeue.put((task_idx, seq, payload))
+        if self.dictionary is not None:
+            self.dictionary.close_worker()
+        statsqueue.put(('parse-{0}'.format(worker_idx), num_batches, busy_time, time.time() - start_time))
+
+    def _write_stage(self, worker_idx, tasks, writequeues, _, statsqueue):
+        start_time = time.time()
+        num_batches = 0
+        busy_time = 0
+        # task index -> [outputs, pending payloads by seq, next seq, number of batches, failed, new user ids, stats]
+        states = {}
+        for task_idx, seq, payload in iter(writequeues[worker_idx].get, None):
+            batch_start_time = time.time()
+            state = states.setdefault(task_idx, [None, {}, 0, None, False, array('q'), defaultdict(int)])
+            if seq is None:
+                state[3], failed = payload
+                state[4] = state[4] or failed
+            else:
+                state[1][seq] = payload
+                if payload is not None:
+                    state[5].extend(payload[2])
+                    for key, count in payload[3].items():
+                        state[6][key] += count
+                num_batches += 1
+            # write in input order, a batch waits for the batches before it
+            while state[2] in state[1]:
+                payload = state[1].pop(state[2])
+                if payload is None:
+                    state[4] = True
+                elif not state[4]:
+                    if state[0] is None:
+                        state[0] = self._open_outputs(self._task_filename(tasks[task_idx]))
+                    state[0][0].write_serialized(payload[0])
+                    state[0][2].write(payload[1])
+                state[2] += 1
+            if state[3] is not None and state[2] == state[3]:
+                outputs, _, _, _, failed, new_user_ids, stats = states.pop(task_idx)
+                if failed:
+                    if outputs is not None:
+                        self._discard_outputs(outputs)
+                    # the profiles of users first met in this task are discarded, a later task or a rerun writes them
+                    for user_id in new_user_ids:
+                        self.visited_user_ids.discard(user_id)
+                else:
+                    if outputs is None:
+                        outputs = self._open_outputs(self._task_filename(tasks[task_idx]))
+                    self._close_outputs(tasks[task_idx], outputs, stats)
+            busy_time += time.time() - batch_start_time
+        statsqueue.put(('write-{0}'.format(worker_idx), num_batches, busy_time, time.time() - start_time))
+
+    def extract(self):
+        self.logger.debug('**> Start extracting tweet status from tweet bz2 files...')
+        start_time = time.time()
+
+        write_status_fields(os.path.join(self.output_dir, 'schema.txt'), self.fields)
+        if self.dict_encode and self.status_format == 'csv':
+            # parquet has its own dictionary encoding
+            self.dictionary = StatusDictionary(os.path.join(self.output_dir, 'dictionary.txt'), self.fields)
+        if not self.resume:
+            self.manifest.reset()
         else:
-            return None
-        # valid condition: contains only alphanumeric, dash or underline
-        valid = re.match('^[\w-]+$', vid) is not None
-        if valid and len(vid) == 11:
-            return vid
-        return None
+            # the tasks that workers of an earlier extract marked done
+            self.manifest.load()
+        # the manifest of a run under another output config is reset as well
+        if self._set_manifest_config() or not self.resume:
+            if self.dictionary is not None:
+                self.dictionary.reset()
+        # largest first, so that no large file is left to a single worker at the tail
+        tasks = sorted(self._list_input_tasks(skip_done=True), key=lambda task: (-self._task_size(task), task[0]))
+        self.visited_user_ids = SharedIdSet(self.user_capacity)
+        if self.stage_procs is not None:
+            self._run_pipeline(tasks)
+        else:
+            processes, statsqueue = self._run_workers(self._extract_tweet, tasks)
+            self._join_workers(processes, statsqueue, start_time)
+        self._log_visited_users()
+        if self.dictionary is not None:
+            # the codes of all workers go into one dictionary file once they have finished
+            self.dictionary.merge_worker_files()
+            self.dictionary = None
+
+        self.logger.debug('**> Finish extracting tweet status from tweet bz2 files.')
+
+    def extract_fused(self, collector):
+        """Extract entity records from tweet bz2 files and feed them straight into collector.
+
+        Workers project every tweet status record by collector.project, and stream the projected records in batches
+        of batch_size into an entity record file per task, [output_dir]/entity_stats/[filename].txt,
+        a csv of the entity fields only. Record files are scratch, read back once by the main process, so they are
+        not compressed whatever the codec of user status files. A task whose record file is in place is marked done in
+        [output_dir]/fused_manifest.jsonl. The records are added into collector from the record files in the order of
+        input files and chunks, each as soon as the tasks before it are added, so the result does not depend on
+        how tasks are scheduled, and memory holds a batch per worker rather than whole files.
+        With resume, the record files of tasks done in an earlier run are added again rather than extracted again.
+        User profiles are still written into user_stats, no tweet_stats file is written.
+        If a task fails or a worker dies, no more records are added and RuntimeError is raised once the workers stop,
+        so that a partially filled collector is never dumped. The tasks that completed are done, a rerun resumes.
+        The projection of the extractor must be the status fields of collector, set_fields(ENTITY_FIELDS) with
+        a collector of status_fields ENTITY_FIELDS has workers compute only the entity columns.
+        """
+        if self.fields != collector.status_fields:
+            raise ValueError('Extractor fields {0} do not match collector status fields {1}'
+                             .format(self.fields, collector.status_fields))
+        self.logger.debug('**> Start extracting entities from tweet bz2 files...')
+
+        # a manifest of its own, the tasks of extract are done once their tweet status files are in place,
+        # it replaces the manifest of extract until the workers have finished
+        manifest = self.manifest
+        self.manifest = Manifest(os.path.join(self.output_dir, 'fused_manifest.jsonl'), Lock())
+        try:
+            self._extract_fused_tasks(collector)
+        finally:
+            self.manifest = manifest
+
+        self.logger.debug('**> Finish extracting entities from tweet bz2 files.')
+
+    def _extract_fused_tasks(self, collector):
+        start_time = time.time()
+        if not self.resume:
+            self.manifest.reset()
+        self._set_manifest_config(fused=True)
+        os.makedirs(self.entity_stats_path, exist_ok=True)
+        tasks = self._list_input_tasks()
+        # True once the record file of a task is in place, False if the task failed, None if it has no records
+        task_status = {}
+        todo_tasks = []
+        for task_idx, task in enumerate(tasks):
+            if self.resume and self._is_task_done(task):
+                task_status[task_idx] = True
+            else:
+                todo_tasks.append((task_idx, task))
+        if len(task_status) > 0:
+            self.logger.info('Add {0} files or chunks that are done in an earlier run'.format(len(task_status)))
+            print('>>> Add {0} files or chunks that are done in an earlier run'.format(len(task_status)))
+
+        donequeue = Queue()
+        self.visited_user_ids = SharedIdSet(self.user_capacity)
+        processes, statsqueue = self._run_workers(self._extract_tweet_entities, todo_tasks, donequeue, collector.project)
+
+        # add records of task i only after tasks 0..i-1 have been added
+        failed_tasks = []
+        next_task_idx = self._add_entity_records(collector, tasks, task_status, 0)
+        for _ in range(len(todo_tasks)):
+            try:
+                task_idx, status = self._get_from_workers(donequeue, processes)
+            except RuntimeError:
+                for p in processes:
+                    p.terminate()
+                raise
+            task_status[task_idx] = status
+            if status is False:
+                # the task failed, wait for the other tasks but add nothing more
+                failed_tasks.append(self._task_filename(tasks[task_idx]))
+            if len(failed_tasks) == 0:
+                next_task_idx = self._add_entity_records(collector, tasks, task_status, next_task_idx)
+
+        self._join_workers(processes, statsqueue, start_time)
+        if len(failed_tasks) > 0:
+            raise RuntimeError('Fused extraction failed on tasks {0}'.format(failed_tasks))
+        self._log_visited_users()
+
+    def _entity_record_path(self, task):
+        return status_path(os.path.join(self.entity_stats_path, self._task_filename(task)), codec='none')
+
+    def _add_entity_records(self, collector, tasks, task_status, next_task_idx):
+        """Add the records of tasks from next_task_idx on into collector, up to the first task that is not done,
+        return the index of that task."""
+        while next_task_idx in task_status:
+            if task_status[next_task_idx]:
+                with open_file(self._entity_record_path(tasks[next_task_idx]), 'r', encoding='utf-8') as fin:
+                    for line in fin:
+                        collector.add(line.rstrip('\n').split(','))
+            next_task_idx += 1
+        return next_task_idx
+
+    def _log_visited_users(self):
+        self.logger.info('Wrote profiles of {0} users'.format(len(self.visited_user_ids)))
+        if self.visited_user_ids.is_full():
+            self.logger.warning('User id set is full, some profiles are written more than once, '
+                                'raise user_capacity above {0}'.format(self.user_capacity))
+        self.visited_user_ids = None
 
     def _expanded_urls(self, urls):
         expanded_urls = []
@@ -140,109 +763,67 @@ class TweetExtractor(object):
 
         vids = set()
         for expanded_url in expanded_urls:
-            vid = self._extract_vid_from_expanded_url(expanded_url)
+            vid = extract_vid(expanded_url)
             if vid is not None:
                 vids.add(vid)
         return vids
 
-    def _extract_vids(self, tweet):
+    @staticmethod
+    def _collect_entities(tweet):
+        """Collect the entities of original, retweeted and quoted status, retweeted and quoted status include
+        the entities of their extended_tweet."""
+        original_entities = []
+        retweeted_entities = []
+        quoted_entities = []
+        if 'entities' in tweet:
+            original_entities.append(tweet['entities'])
+        for field, entities_list in (('retweeted_status', retweeted_entities), ('quoted_status', quoted_entities)):
+            if field in tweet:
+                status = tweet[field]
+                if 'entities' in status:
+                    entities_list.append(status['entities'])
+                if 'extended_tweet' in status and 'entities' in status['extended_tweet']:
+                    entities_list.append(status['extended_tweet']['entities'])
+        return original_entities, retweeted_entities, quoted_entities
+
+    def _extract_vids(self, entities):
         original_urls = []
         retweeted_urls = []
         quoted_urls = []
-        try:
-            original_urls.extend(tweet['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            retweeted_urls.extend(tweet['retweeted_status']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            retweeted_urls.extend(tweet['retweeted_status']['extended_tweet']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            quoted_urls.extend(tweet['quoted_status']['entities']['urls'])
-        except KeyError:
-            pass
-        try:
-            quoted_urls.extend(tweet['quoted_status']['extended_tweet']['entities']['urls'])
-        except KeyError:
-            pass
+        for entities_list, urls in zip(entities, (original_urls, retweeted_urls, quoted_urls)):
+            for entity in entities_list:
+                if 'urls' in entity:
+                    urls.extend(entity['urls'])
 
         original_vids = self._replace_with_nan(self._expanded_urls(original_urls))
         retweeted_vids = self._replace_with_nan(self._expanded_urls(retweeted_urls))
         quoted_vids = self._replace_with_nan(self._expanded_urls(quoted_urls))
         return original_vids, retweeted_vids, quoted_vids
 
-    def _extract_hashtags(self, tweet):
+    def _extract_hashtags(self, entities):
         original_hashtags = set()
         retweeted_hashtags = set()
         quoted_hashtags = set()
-        try:
-            for hashtag in tweet['entities']['hashtags']:
-                original_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['retweeted_status']['entities']['hashtags']:
-                retweeted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['retweeted_status']['extended_tweet']['entities']['hashtags']:
-                retweeted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['quoted_status']['entities']['hashtags']:
-                quoted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
-        try:
-            for hashtag in tweet['quoted_status']['extended_tweet']['entities']['hashtags']:
-                quoted_hashtags.add(hashtag['text'])
-        except KeyError:
-            pass
+        for entities_list, hashtags in zip(entities, (original_hashtags, retweeted_hashtags, quoted_hashtags)):
+            for entity in entities_list:
+                if 'hashtags' in entity:
+                    for hashtag in entity['hashtags']:
+                        hashtags.add(hashtag['text'])
         original_hashtags = self._replace_with_nan(original_hashtags)
         retweeted_hashtags = self._replace_with_nan(retweeted_hashtags)
         quoted_hashtags = self._replace_with_nan(quoted_hashtags)
         return original_hashtags, retweeted_hashtags, quoted_hashtags
 
-    def _extract_mentions(self, tweet):
+    def _extract_mentions(self, entities):
         original_mentions = set()
         retweeted_mentions = set()
         quoted_mentions = set()
-        try:
-            for user_mention in tweet['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    original_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['retweeted_status']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    retweeted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['retweeted_status']['extended_tweet']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    retweeted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['quoted_status']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    quoted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
-        try:
-            for user_mention in tweet['quoted_status']['extended_tweet']['entities']['user_mentions']:
-                if user_mention['id_str'] is not None:
-                    quoted_mentions.add(user_mention['id_str'])
-        except KeyError:
-            pass
+        for entities_list, mentions in zip(entities, (original_mentions, retweeted_mentions, quoted_mentions)):
+            for entity in entities_list:
+                if 'user_mentions' in entity:
+                    for user_mention in entity['user_mentions']:
+                        if user_mention['id_str'] is not None:
+                            mentions.add(user_mention['id_str'])
         original_mentions = self._replace_with_nan(original_mentions)
         retweeted_mentions = self._replace_with_nan(retweeted_mentions)
         quoted_mentions = self._replace_with_nan(quoted_mentions)
@@ -254,17 +835,17 @@ class TweetExtractor(object):
             user_id_str = tweet[field]['user']['id_str']
             user_location = tweet[field]['user']['location']
             if 'lang' in tweet[field]:
-                lang = tweet[field]['lang']
+                lang = self._intern(tweet[field]['lang'])
             else:
                 lang = 'N'
 
             if tweet[field]['place'] is not None:
-                geo = self._replace_comma_space(tweet[field]['place']['full_name'])
-                cc = self._replace_comma_space(tweet[field]['place']['country_code'])
+                geo = self._intern(self._replace_comma_space(tweet[field]['place']['full_name']))
+                cc = self._intern(self._replace_comma_space(tweet[field]['place']['country_code']))
             else:
                 geo = 'N'
                 cc = 'N'
-            filter = tweet[field]['filter_level']
+            filter = self._intern(tweet[field]['filter_level'])
 
             retweet_count = tweet[field]['retweet_count']
             favorite_count = tweet[field]['favorite_count']
@@ -316,173 +897,373 @@ class TweetExtractor(object):
         return (user_screen_name, user_created_at, user_verified, user_location,
                 user_followers_count, user_friends_count, user_listed_count, user_statuses_count, user_description)
 
-    def _extract_tweet(self, filequeue):
-        while not filequeue.empty():
-            filepath = filequeue.get()
+    def _extract_tweet(self, task):
+        try:
+            filedata, filename = self._open_task(task)
+        except:
+            self.logger.warn('Exists non-bz2 file {0} in dataset folder'.format(task[0]))
+            return
+
+        outputs = self._open_outputs(filename)
+        tweet_output, _, user_output = outputs
+        new_user_ids = array('q')
+        stats = defaultdict(int)
+        try:
+            for record in self._iter_records(filedata, filename, user_output, new_user_ids, stats):
+                if self.dictionary is not None:
+                    record = self.dictionary.encode_record(record)
+                tweet_output.write(record)
+        except Exception:
+            self._discard_outputs(outputs)
+            # the profiles of users first met in this task are discarded, a later task or a rerun writes them
+            for user_id in new_user_ids:
+                self.visited_user_ids.discard(user_id)
+            raise
+        finally:
+            filedata.close()
+        self._close_outputs(task, outputs, stats)
+
+    def _open_outputs(self, filename):
+        """Open the tweet status sink and user status file of a task, return them with the user status path.
+        Outputs are written into temporary files and renamed on close, an interrupted task leaves no partial output.
+        """
+        tweet_output = open_status_sink(os.path.join(self.tweet_stats_path, filename), self.status_format, self.codec,
+                                        self.fields)
+        user_output_path = status_path(os.path.join(self.user_stats_path, filename), codec=self.codec)
+        user_output = open_file('{0}.tmp'.format(user_output_path), 'w', codec=self.codec)
+        return tweet_output, user_output_path, user_output
+
+    def _close_outputs(self, task, outputs, stats):
+        """Rename the outputs of a task into place, then mark it done in the manifest and log its stats."""
+        tweet_output, user_output_path, user_output = outputs
+        tweet_output.close()
+        user_output.close()
+        os.replace('{0}.tmp'.format(user_output_path), user_output_path)
+        self._mark_task_done(task, (tweet_output.path, user_output_path))
+        filename = self._task_filename(task)
+        self._log_task_stats(filename, stats)
+        self.logger.debug('{0} done!'.format(filename))
+        print('{0} done!'.format(filename))
+
+    def _log_task_stats(self, filename, stats):
+        """Log the message counts and video id cache hit rate of a task, added up over its batches."""
+        message_counts = {message_type: count for message_type, count in stats.items()
+                          if message_type not in (VID_CACHE_HITS, VID_CACHE_MISSES)}
+        self.logger.debug('{0} messages: {1}'.format(filename, message_counts))
+        hits, misses = stats[VID_CACHE_HITS], stats[VID_CACHE_MISSES]
+        self.logger.debug('{0} vid cache: {1} hits, {2} misses, hit rate {3:.1%}'
+                          .format(filename, hits, misses, hits / max(hits + misses, 1)))
+
+    @staticmethod
+    def _discard_outputs(outputs):
+        tweet_output, user_output_path, user_output = outputs
+        tweet_output.discard()
+        user_output.close()
+        os.remove('{0}.tmp'.format(user_output_path))
+
+    def _extract_tweet_entities(self, indexed_task, donequeue, project):
+        """Write the projected records of a task into its entity record file, then mark the task done.
+        Put (task index, True) into donequeue once the record file is in place, False if the task fails,
+        or None if the task has no records."""
+        task_idx, task = indexed_task
+        status = False
+        try:
             try:
-                filedata = bz2.BZ2File(filepath, mode='r')
+                filedata, filename = self._open_task(task)
             except:
-                self.logger.warn('Exists non-bz2 file {0} in dataset folder'.format(filepath))
-                continue
-            filename, filetype = os.path.basename(os.path.normpath(filepath)).split('.')
+                self.logger.warn('Exists non-bz2 file {0} in dataset folder'.format(task[0]))
+                status = None
+                return
 
-            tweet_output = bz2.open(os.path.join(self.tweet_stats_path, '{0}.bz2'.format(filename)), 'at')
-            user_output = bz2.open(os.path.join(self.user_stats_path, '{0}.bz2'.format(filename)), 'at')
-
-            visited_user_ids = set()
-            for line in filedata:
+            record_path = self._entity_record_path(task)
+            user_output_path = status_path(os.path.join(self.user_stats_path, filename), codec=self.codec)
+            new_user_ids = array('q')
+            stats = defaultdict(int)
+            try:
+                record_output = open_file('{0}.tmp'.format(record_path), 'w', encoding='utf-8', codec='none')
+                user_output = open_file('{0}.tmp'.format(user_output_path), 'w', codec=self.codec)
                 try:
-                    if line.rstrip():
-                        tweet_json = json.loads(line)
-
-                        # 3. ratemsg, timestamp_ms, track
-                        if 'limit' in tweet_json:
-                            # rate limit message
-                            # {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}
-                            tweet_output.write('{0},{1},{2}\n'.format('ratemsg', tweet_json['limit']['timestamp_ms'], tweet_json['limit']['track']))
-                            continue
+                    batch = []
+                    for record in self._iter_records(filedata, filename, user_output, new_user_ids, stats):
+                        batch.append(project(record))
+                        if len(batch) == self.batch_size:
+                            record_output.write(serialize_records(batch))
+                            batch = []
+                    record_output.write(serialize_records(batch))
+                except:
+                    record_output.close()
+                    user_output.close()
+                    os.remove('{0}.tmp'.format(record_path))
+                    os.remove('{0}.tmp'.format(user_output_path))
+                    # the profiles of users first met in this task are discarded, a later task or a rerun writes them
+                    for user_id in new_user_ids:
+                        self.visited_user_ids.discard(user_id)
+                    raise
+                record_output.close()
+                user_output.close()
+            finally:
+                filedata.close()
+            os.replace('{0}.tmp'.format(user_output_path), user_output_path)
+            os.replace('{0}.tmp'.format(record_path), record_path)
+            self._mark_task_done(task, (record_path, user_output_path))
+            status = True
+        finally:
+            donequeue.put((task_idx, status))
+        self._log_task_stats(filename, stats)
+        self.logger.debug('{0} done!'.format(filename))
+        print('{0} done!'.format(filename))
 
-                        if 'id_str' not in tweet_json:
-                            continue
+    def _compile_projection(self, fields):
+        """Compile a projection of tweet status fields into a function that extracts only those fields from a tweet.
+        Work shared by several fields, e.g., collecting entities, is done once per tweet.
+        """
+        if fields is None:
+            return self._extract_status_record
+        unknown_fields = [field for field in fields if field not in TWEET_STATUS_INDEX]
+        if len(unknown_fields) > 0:
+            raise ValueError('Unknown tweet status fields {0}, choose from {1}'.format(unknown_fields, TWEET_STATUS_FIELDS))
+        if len(fields) == 0 or fields[0] not in RECORD_KEY_FIELDS:
+            # a free-text first field could read 'ratemsg', see is_ratemsg_record
+            raise ValueError('Tweet status fields must start with one of {0}'.format(RECORD_KEY_FIELDS))
+        getters = [self._field_getter(field) for field in fields]
 
-                        # 1. tweet_id_str, created_at, timestamp_ms, user_id_str,
-                        #    original_lang, retweeted_lang, quoted_lang,
-                        #    original_vids, retweeted_vids, quoted_vids,
-                        #    original_mentions, retweeted_mentions, quoted_mentions,
-                        #    original_hashtags, retweeted_hashtags, quoted_hashtags,
-                        #    original_geoname, retweeted_geoname, quoted_geoname,
-                        #    original_countrycode, retweeted_countrycode, quoted_countrycode,
-                        #    original_filter, retweeted_filter, quoted_filter,
-                        #    original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
-                        #    original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
-                        #    original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
-                        #    original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
-                        #    original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
-                        #    original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
-                        #    reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
-                        #    reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
-                        #    original_text, retweeted_text, quoted_text
-                        tweet_id = tweet_json['id_str']
-                        created_at = obj2str(str2obj(tweet_json['created_at'], fmt='tweet'), fmt='youtube')
-                        timestamp_ms = tweet_json['timestamp_ms']
-                        user_id_str = tweet_json['user']['id_str']
-                        if 'lang' in tweet_json:
-                            lang = tweet_json['lang']
-                        else:
-                            lang = 'N'
+        def project(tweet_json):
+            cache = {}
+            return tuple([getter(tweet_json, cache) for getter in getters])
+        return project
 
-                        original_vids, retweeted_vids, quoted_vids = self._extract_vids(tweet_json)
-                        original_mentions, retweeted_mentions, quoted_mentions = self._extract_mentions(tweet_json)
-                        original_hashtags, retweeted_hashtags, quoted_hashtags, = self._extract_hashtags(tweet_json)
+    def _field_getter(self, field):
+        """Return getter(tweet_json, cache) of a tweet status field, cache holds the work shared within a tweet."""
+        if field == 'tweet_id_str':
+            return lambda tweet, cache: tweet['id_str']
+        if field == 'created_at':
+            return lambda tweet, cache: obj2str(str2obj(tweet['created_at'], fmt='tweet'), fmt='youtube')
+        if field == 'timestamp_ms':
+            return lambda tweet, cache: tweet['timestamp_ms']
+        if field == 'user_id_str':
+            return lambda tweet, cache: tweet['user']['id_str']
+        if field == 'reply_tweet_id_str':
+            return lambda tweet, cache: self._replace_with_nan(tweet['in_reply_to_status_id_str'])
+        if field == 'reply_user_id_str':
+            return lambda tweet, cache: self._replace_with_nan(tweet['in_reply_to_user_id_str'])
 
-                        if tweet_json['place'] is not None:
-                            original_geo = self._replace_comma_space(tweet_json['place']['full_name'])
-                            original_cc = self._replace_comma_space(tweet_json['place']['country_code'])
-                        else:
-                            original_geo = 'N'
-                            original_cc = 'N'
+        prefix, key = field.split('_', 1)
+        if key in ('vids', 'mentions', 'hashtags'):
+            position = ('original', 'retweeted', 'quoted').index(prefix)
+            extract = {'vids': self._extract_vids, 'mentions': self._extract_mentions,
+                       'hashtags': self._extract_hashtags}[key]
 
-                        original_filter = tweet_json['filter_level']
+            def entity_getter(tweet, cache):
+                if key not in cache:
+                    if 'entities' not in cache:
+                        cache['entities'] = self._collect_entities(tweet)
+                    cache[key] = extract(cache['entities'])
+                return strify(cache[key][position], delimiter=';')
+            return entity_getter
 
-                        original_retweet_count = tweet_json['retweet_count']
-                        original_favorite_count = tweet_json['favorite_count']
+        value_getter = self._status_value_getter(key)
+        status_field = STATUS_PREFIXES[prefix]
+        if status_field is None:
+            return lambda tweet, cache: value_getter(tweet)
+        return lambda tweet, cache: value_getter(tweet[status_field]) if status_field in tweet else 'N'
 
-                        original_user_followers_count = tweet_json['user']['followers_count']
-                        original_user_friends_count = tweet_json['user']['friends_count']
-                        original_user_statuses_count = tweet_json['user']['statuses_count']
-                        original_user_favourites_count = tweet_json['user']['favourites_count']
+    def _status_value_getter(self, key):
+        """Return getter(status) of a field of the original, retweeted or quoted status."""
+        if key == 'tweet_id_str':
+            return lambda status: status['id_str']
+        if key == 'user_id_str':
+            return lambda status: status['user']['id_str']
+        if key == 'lang':
+            return lambda status: self._intern(status['lang']) if 'lang' in status else 'N'
+        if key == 'geoname':
+            return lambda status: self._intern(self._replace_comma_space(status['place']['full_name'])) \
+                if status['place'] is not None else 'N'
+        if key == 'countrycode':
+            return lambda status: self._intern(self._replace_comma_space(status['place']['country_code'])) \
+                if status['place'] is not None else 'N'
+        if key == 'filter':
+            return lambda status: self._intern(status['filter_level'])
+        if key in ('retweet_count', 'favorite_count'):
+            return lambda status: status[key]
+        if key.startswith('user_'):
+            user_key = key[len('user_'):]
+            return lambda status: status['user'][user_key]
+        if key == 'text':
+            return self._extract_text
+        raise ValueError('Unknown tweet status field {0}'.format(key))
 
-                        reply_tweet_id_str = self._replace_with_nan(tweet_json['in_reply_to_status_id_str'])
-                        reply_user_id_str = self._replace_with_nan(tweet_json['in_reply_to_user_id_str'])
+    def _extract_text(self, status):
+        if 'extended_tweet' in status and 'full_text' in status['extended_tweet']:
+            return self._replace_comma_space(status['extended_tweet']['full_text'])
+        elif status['text'] is not None:
+            return self._replace_comma_space(status['text'])
+        return 'N'
 
-                        if 'extended_tweet' in tweet_json and 'full_text' in tweet_json['extended_tweet']:
-                            text = self._replace_comma_space(tweet_json['extended_tweet']['full_text'])
-                        elif tweet_json['text'] is not None:
-                            text = self._replace_comma_space(tweet_json['text'])
-                        else:
-                            text = 'N'
-
-                        retweeted_tweet_id_str, retweeted_user_id_str, retweeted_user_location,\
-                        retweeted_lang, retweeted_geo, retweeted_cc, retweeted_filter, \
-                        retweeted_retweet_count, retweeted_favorite_count, retweeted_user_followers_count, \
-                        retweeted_user_friends_count, retweeted_user_statuses_count, retweeted_user_favourites_count, \
-                        retweeted_text = self._extract_entities(tweet_json, 'retweeted_status')
-
-                        quoted_tweet_id_str, quoted_user_id_str, quoted_user_location,\
-                        quoted_lang, quoted_geo, quoted_cc, quoted_filter, \
-                        quoted_retweet_count, quoted_favorite_count, quoted_user_followers_count, \
-                        quoted_user_friends_count, quoted_user_statuses_count, quoted_user_favourites_count, \
-                        quoted_text = self._extract_entities(tweet_json, 'quoted_status')
-
-                        tweet_output.write('{0},{1},{2},{3},'
-                                           '{4},{5},{6},'
-                                           '{7},{8},{9},'
-                                           '{10},{11},{12},'
-                                           '{13},{14},{15},'
-                                           '{16},{17},{18},'
-                                           '{19},{20},{21},'
-                                           '{22},{23},{24},'
-                                           '{25},{26},{27},'
-                                           '{28},{29},{30},'
-                                           '{31},{32},{33},'
-                                           '{34},{35},{36},'
-                                           '{37},{38},{39},'
-                                           '{40},{41},{42},'
-                                           '{43},{44},{45},'
-                                           '{46},{47},{48},'
-                                           '{49},{50},{51}\n'
-                                           .format(tweet_id, created_at, timestamp_ms, user_id_str,
-                                                   lang, retweeted_lang, quoted_lang,
-                                                   strify(original_vids, delimiter=';'), strify(retweeted_vids, delimiter=';'), strify(quoted_vids, delimiter=';'),
-                                                   strify(original_mentions, delimiter=';'), strify(retweeted_mentions, delimiter=';'), strify(quoted_mentions, delimiter=';'),
-                                                   strify(original_hashtags, delimiter=';'), strify(retweeted_hashtags, delimiter=';'), strify(quoted_hashtags, delimiter=';'),
-                                                   original_geo, retweeted_geo, quoted_geo,
-                                                   original_cc, retweeted_cc, quoted_cc,
-                                                   original_filter, retweeted_filter, quoted_filter,
-                                                   original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
-                                                   original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
-                                                   original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
-                                                   original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
-                                                   original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
-                                                   original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
-                                                   reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
-                                                   reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
-                                                   text, retweeted_text, quoted_text))
-
-                        # 2. user_id_str, screen_name, created_at, verified, location, followers_count, friends_count, listed_count, statuses_count, description
-                        if user_id_str not in visited_user_ids:
-                            user_screen_name, user_created_at, user_verified, user_location, user_followers_count, user_friends_count, user_listed_count, user_statuses_count, user_description = self._extract_user_entities(tweet_json['user'])
+    def _extract_status_record(self, tweet_json):
+        """Extract all tweet status fields from a tweet."""
+        # 1. tweet_id_str, created_at, timestamp_ms, user_id_str,
+        #    original_lang, retweeted_lang, quoted_lang,
+        #    original_vids, retweeted_vids, quoted_vids,
+        #    original_mentions, retweeted_mentions, quoted_mentions,
+        #    original_hashtags, retweeted_hashtags, quoted_hashtags,
+        #    original_geoname, retweeted_geoname, quoted_geoname,
+        #    original_countrycode, retweeted_countrycode, quoted_countrycode,
+        #    original_filter, retweeted_filter, quoted_filter,
+        #    original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
+        #    original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
+        #    original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
+        #    original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
+        #    original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
+        #    original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
+        #    reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
+        #    reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
+        #    original_text, retweeted_text, quoted_text
+        tweet_id = tweet_json['id_str']
+        created_at = obj2str(str2obj(tweet_json['created_at'], fmt='tweet'), fmt='youtube')
+        timestamp_ms = tweet_json['timestamp_ms']
+        user_id_str = tweet_json['user']['id_str']
+        if 'lang' in tweet_json:
+            lang = self._intern(tweet_json['lang'])
+        else:
+            lang = 'N'
+
+        entities = self._collect_entities(tweet_json)
+        original_vids, retweeted_vids, quoted_vids = self._extract_vids(entities)
+        original_mentions, retweeted_mentions, quoted_mentions = self._extract_mentions(entities)
+        original_hashtags, retweeted_hashtags, quoted_hashtags, = self._extract_hashtags(entities)
+
+        if tweet_json['place'] is not None:
+            original_geo = self._intern(self._replace_comma_space(tweet_json['place']['full_name']))
+            original_cc = self._intern(self._replace_comma_space(tweet_json['place']['country_code']))
+        else:
+            original_geo = 'N'
+            original_cc = 'N'
+
+        original_filter = self._intern(tweet_json['filter_level'])
+
+        original_retweet_count = tweet_json['retweet_count']
+        original_favorite_count = tweet_json['favorite_count']
+
+        original_user_followers_count = tweet_json['user']['followers_count']
+        original_user_friends_count = tweet_json['user']['friends_count']
+        original_user_statuses_count = tweet_json['user']['statuses_count']
+        original_user_favourites_count = tweet_json['user']['favourites_count']
+
+        reply_tweet_id_str = self._replace_with_nan(tweet_json['in_reply_to_status_id_str'])
+        reply_user_id_str = self._replace_with_nan(tweet_json['in_reply_to_user_id_str'])
+
+        if 'extended_tweet' in tweet_json and 'full_text' in tweet_json['extended_tweet']:
+            text = self._replace_comma_space(tweet_json['extended_tweet']['full_text'])
+        elif tweet_json['text'] is not None:
+            text = self._replace_comma_space(tweet_json['text'])
+        else:
+            text = 'N'
+
+        retweeted_tweet_id_str, retweeted_user_id_str, retweeted_user_location,\
+        retweeted_lang, retweeted_geo, retweeted_cc, retweeted_filter, \
+        retweeted_retweet_count, retweeted_favorite_count, retweeted_user_followers_count, \
+        retweeted_user_friends_count, retweeted_user_statuses_count, retweeted_user_favourites_count, \
+        retweeted_text = self._extract_entities(tweet_json, 'retweeted_status')
+
+        quoted_tweet_id_str, quoted_user_id_str, quoted_user_location,\
+        quoted_lang, quoted_geo, quoted_cc, quoted_filter, \
+        quoted_retweet_count, quoted_favorite_count, quoted_user_followers_count, \
+        quoted_user_friends_count, quoted_user_statuses_count, quoted_user_favourites_count, \
+        quoted_text = self._extract_entities(tweet_json, 'quoted_status')
+
+        return (tweet_id, created_at, timestamp_ms, user_id_str,
+                lang, retweeted_lang, quoted_lang,
+                strify(original_vids, delimiter=';'), strify(retweeted_vids, delimiter=';'), strify(quoted_vids, delimiter=';'),
+                strify(original_mentions, delimiter=';'), strify(retweeted_mentions, delimiter=';'), strify(quoted_mentions, delimiter=';'),
+                strify(original_hashtags, delimiter=';'), strify(retweeted_hashtags, delimiter=';'), strify(quoted_hashtags, delimiter=';'),
+                original_geo, retweeted_geo, quoted_geo,
+                original_cc, retweeted_cc, quoted_cc,
+                original_filter, retweeted_filter, quoted_filter,
+                original_retweet_count, retweeted_retweet_count, quoted_retweet_count,
+                original_favorite_count, retweeted_favorite_count, quoted_favorite_count,
+                original_user_followers_count, retweeted_user_followers_count, quoted_user_followers_count,
+                original_user_friends_count, retweeted_user_friends_count, quoted_user_friends_count,
+                original_user_statuses_count, retweeted_user_statuses_count, quoted_user_statuses_count,
+                original_user_favourites_count, retweeted_user_favourites_count, quoted_user_favourites_count,
+                reply_tweet_id_str, retweeted_tweet_id_str, quoted_tweet_id_str,
+                reply_user_id_str, retweeted_user_id_str, quoted_user_id_str,
+                text, retweeted_text, quoted_text)
+
+    def _iter_records(self, filedata, filename, user_output, new_user_ids=None, stats=None):
+        """Yield the ratemsg and tweet status records in filedata, write user profiles into user_output.
+        The ids of users whose profiles are written are appended to new_user_ids if it is not None.
+        The number of messages of each type, and the video id cache hits and misses of this call, are added into stats
+        if it is not None, see _log_task_stats."""
+        decoder = JsonDecoder(self.json_backend)
+        # shared by all processes, a profile is written by whichever process meets the user first,
+        # an arbitrary snapshot of the profile in this run, see user_capacity
+        visited_user_ids = self.visited_user_ids
+        message_counts = defaultdict(int) if stats is None else stats
+        # the cache is shared by all calls in a process, its counts are taken as deltas
+        start_cache_info = extract_vid.cache_info()
+        for line in filedata:
+            try:
+                if line.rstrip():
+                    message_type = classify_message(line)
+                    message_counts[message_type] += 1
+                    if message_type == LIMIT_MESSAGE:
+                        limit = parse_limit_message(line)
+                        if limit is not None:
+                            yield RATEMSG, limit[0], limit[1]
+                            continue
+                    elif message_type == DELETE_MESSAGE or message_type == DISCONNECT_MESSAGE:
+                        continue
+
+                    tweet_json = decoder.loads(line)
+
+                    # 3. ratemsg, timestamp_ms, track
+                    if 'limit' in tweet_json:
+                        # rate limit message
+                        # {"limit":{"track":283540,"timestamp_ms":"1483189188944"}}
+                        yield RATEMSG, tweet_json['limit']['timestamp_ms'], tweet_json['limit']['track']
+                        continue
+
+                    if 'id_str' not in tweet_json:
+                        continue
+
+                    # 1. tweet status, all fields or the projected fields, see _compile_projection
+                    yield self._status_record(tweet_json)
+                    user_id_str = tweet_json['user']['id_str']
+
+                    # 2. user_id_str, screen_name, created_at, verified, location, followers_count, friends_count, listed_count, statuses_count, description
+                    if visited_user_ids.add(int(user_id_str)):
+                        if new_user_ids is not None:
+                            new_user_ids.append(int(user_id_str))
+                        user_screen_name, user_created_at, user_verified, user_location, user_followers_count, user_friends_count, user_listed_count, user_statuses_count, user_description = self._extract_user_entities(tweet_json['user'])
+                        user_output.write('{0},{1},{2},{3},{4},{5},{6},{7},{8},{9}\n'
+                                          .format(user_id_str, user_screen_name, user_created_at, user_verified,
+                                                  user_location, user_followers_count, user_friends_count,
+                                                  user_listed_count, user_statuses_count, user_description))
+
+                    if 'retweeted_status' in tweet_json:
+                        ruser_id_str = tweet_json['retweeted_status']['user']['id_str']
+                        if visited_user_ids.add(int(ruser_id_str)):
+                            if new_user_ids is not None:
+                                new_user_ids.append(int(ruser_id_str))
+                            ruser_screen_name, ruser_created_at, ruser_verified, ruser_location, ruser_followers_count, ruser_friends_count, ruser_listed_count, ruser_statuses_count, ruser_description = self._extract_user_entities(tweet_json['retweeted_status']['user'])
                             user_output.write('{0},{1},{2},{3},{4},{5},{6},{7},{8},{9}\n'
-                                              .format(user_id_str, user_screen_name, user_created_at, user_verified,
-                                                      user_location, user_followers_count, user_friends_count,
-                                                      user_listed_count, user_statuses_count, user_description))
-                            visited_user_ids.add(user_screen_name)
-
-                        if 'retweeted_status' in tweet_json:
-                            ruser_id_str = tweet_json['retweeted_status']['user']['id_str']
-                            if ruser_id_str not in visited_user_ids:
-                                ruser_screen_name, ruser_created_at, ruser_verified, ruser_location, ruser_followers_count, ruser_friends_count, ruser_listed_count, ruser_statuses_count, ruser_description = self._extract_user_entities(tweet_json['retweeted_status']['user'])
-                                user_output.write('{0},{1},{2},{3},{4},{5},{6},{7},{8},{9}\n'
-                                                  .format(ruser_id_str, ruser_screen_name, ruser_created_at, ruser_verified,
-                                                          ruser_location, ruser_followers_count, ruser_friends_count,
-                                                          ruser_listed_count, ruser_statuses_count, ruser_description))
-                                visited_user_ids.add(ruser_id_str)
-
-                        if 'quoted_status' in tweet_json:
-                            quser_id_str = tweet_json['quoted_status']['user']['id_str']
-                            if quser_id_str not in visited_user_ids:
-                                quser_screen_name, quser_created_at, quser_verified, quser_location, quser_followers_count, quser_friends_count, quser_listed_count, quser_statuses_count, quser_description = self._extract_user_entities(tweet_json['quoted_status']['user'])
-                                user_output.write('{0},{1},{2},{3},{4},{5},{6},{7},{8},{9}\n'
-                                                  .format(quser_id_str, quser_screen_name, quser_created_at, quser_verified,
-                                                          quser_location, quser_followers_count, quser_friends_count,
-                                                          quser_listed_count, quser_statuses_count, quser_description))
-                                visited_user_ids.add(quser_id_str)
-
-                except EOFError:
-                    self.logger.error('EOFError: {0} ended before the logical end-of-stream was detected,'.format(filename))
-
-            tweet_output.close()
-            user_output.close()
-            filedata.close()
-            self.logger.debug('{0} done!'.format(filename))
-            print('{0} done!'.format(filename))
+                                              .format(ruser_id_str, ruser_screen_name, ruser_created_at, ruser_verified,
+                                                      ruser_location, ruser_followers_count, ruser_friends_count,
+                                                      ruser_listed_count, ruser_statuses_count, ruser_description))
+
+                    if 'quoted_status' in tweet_json:
+                        quser_id_str = tweet_json['quoted_status']['user']['id_str']
+                        if visited_user_ids.add(int(quser_id_str)):
+                            if new_user_ids is not None:
+                                new_user_ids.append(int(quser_id_str))
+                            quser_screen_name, quser_created_at, quser_verified, quser_location, quser_followers_count, quser_friends_count, quser_listed_count, quser_statuses_count, quser_description = self._extract_user_entities(tweet_json['quoted_status']['user'])
+                            user_output.write('{0},{1},{2},{3},{4},{5},{6},{7},{8},{9}\n'
+                                              .format(quser_id_str, quser_screen_name, quser_created_at, quser_verified,
+                                                      quser_location, quser_followers_count, quser_friends_count,
+                                                      quser_listed_count, quser_statuses_count, quser_description))
+
+            except EOFError:
+                self.logger.error('EOFError: {0} ended before the logical end-of-stream was detected,'.format(filename))
+        cache_info = extract_vid.cache_info()
+        message_counts[VID_CACHE_HITS] += cache_info.hits - start_cache_info.hits
+        message_counts[VID_CACHE_MISSES] += cache_info.misses - start_cache_info.misses